@@ -3,44 +3,60 @@ from flask_jwt_extended import (
     create_access_token, jwt_required, get_jwt_identity,
     create_refresh_token, get_jwt
 )
-from werkzeug.security import check_password_hash, generate_password_hash
 from datetime import timedelta
 import os
-from app import db
+from extensions import db
+from database import read_replica
 from models import Driver, MaintenanceReport, Repair, Workshop
-from PIL import Image
-import io
+from pagination import (
+    REPORT_FILTERS, filter_reports, get_page_size, paginate_reports, paginate_workshops, PaginationError
+)
+from images import stage_upload, claim, discard, enqueue
+from bulk import BulkIngest, iter_ndjson, submitted_key
+from events import event_stream
+from passwords import PasswordHashingBusy, hash_password, verify_password
+from identity import claimed_identity, get_identity, identity_claims, identity_record
+from cache import cached_response, tag_response, report_tags
+from geo import LocationError, parse_point, nearest_workshops
+from metrics import observe
+from archive import find_archived_report
+from serializers import (
+    DRIVER, REPORT_LIST_OPTIONS, REPORT_DETAIL_OPTIONS, ARCHIVED_REPORT_DETAIL_OPTIONS, report_summary, report_detail
+)
+from sync import (
+    SyncError, SyncTokenExpired, collection_validators, resource_validators, not_modified,
+    add_validators, current_token, report_changes
+)
 import base64
-import uuid
+import time
 
 # Create a Blueprint for the API
 api_bp = Blueprint('api', __name__)
 
 # Helper function to save image
 def save_image(base64_img, folder='reports'):
+    """
+    Stage a base64 image upload for background processing.
+    Returns a PendingImage whose url is valid once the report's
+    image_status is 'ready', or None if the payload is not valid base64.
+    """
+    started = time.perf_counter()
     try:
         # Remove the data:image/...;base64, part
         if ',' in base64_img:
             base64_img = base64_img.split(',')[1]
             
-        img_data = base64.b64decode(base64_img)
-        img = Image.open(io.BytesIO(img_data))
-        
-        # Create uploads directory if it doesn't exist
-        upload_folder = os.path.join(current_app.static_folder, 'uploads', folder)
-        os.makedirs(upload_folder, exist_ok=True)
-        
-        # Generate a unique filename
-        filename = f"{uuid.uuid4()}.jpg"
-        filepath = os.path.join(upload_folder, filename)
-        
-        # Save the image
-        img.save(filepath, 'JPEG')
-        
-        return f"/static/uploads/{folder}/{filename}"
+        img_data = base64.b64decode(base64_img, validate=True)
+        return stage_upload(img_data, folder)
     except Exception as e:
         current_app.logger.error(f"Error saving image: {str(e)}")
         return None
+    finally:
+        observe('image_stage_seconds', time.perf_counter() - started, 'base64')
+
+def hashing_busy():
+    retry_after = str(current_app.config['PASSWORD_RETRY_AFTER'])
+    return jsonify({"msg": "Too many logins in progress, retry shortly"}), 503, {'Retry-After': retry_after}
 
 # Authentication Endpoints
 @api_bp.route('/auth/register', methods=['POST'])
@@ -55,30 +71,33 @@ def register():
     if Driver.query.filter_by(email=data['email']).first():
         return jsonify({"msg": "Email already registered"}), 400
     
+    try:
+        password_hash = hash_password(data['password'])
+    except PasswordHashingBusy:
+        return hashing_busy()
+    
     try:
         # Create new user
         new_user = Driver(
             name=data['name'],
             email=data['email'],
-            password=generate_password_hash(data['password'], method='pbkdf2:sha256')
+            password=password_hash
         )
         
         db.session.add(new_user)
         db.session.commit()
         
         # Generate tokens
-        access_token = create_access_token(identity=new_user.id)
+        access_token = create_access_token(
+            identity=new_user.id, additional_claims=identity_claims(identity_record(new_user))
+        )
         refresh_token = create_refresh_token(identity=new_user.id)
         
         return jsonify({
             "msg": "User created successfully",
             "access_token": access_token,
             "refresh_token": refresh_token,
-            "user": {
-                "id": new_user.id,
-                "name": new_user.name,
-                "email": new_user.email
-            }
+            "user": DRIVER.dump(new_user)
         }), 201
         
     except Exception as e:
@@ -94,115 +113,282 @@ def login():
     
     user = Driver.query.filter_by(email=data['email']).first()
     
-    if not user or not check_password_hash(user.password, data['password']):
+    try:
+        valid = user is not None and verify_password(user, data['password'])
+    except PasswordHashingBusy:
+        return hashing_busy()
+    
+    if not valid:
         return jsonify({"msg": "Invalid email or password"}), 401
     
     # Generate tokens
-    access_token = create_access_token(identity=user.id)
+    access_token = create_access_token(
+        identity=user.id, additional_claims=identity_claims(identity_record(user))
+    )
     refresh_token = create_refresh_token(identity=user.id)
     
     return jsonify({
         "access_token": access_token,
         "refresh_token": refresh_token,
-        "user": {
-            "id": user.id,
-            "name": user.name,
-            "email": user.email
-        }
+        "user": DRIVER.dump(user)
     }), 200
 
 @api_bp.route('/auth/refresh', methods=['POST'])
 @jwt_required(refresh=True)
 def refresh():
     current_user = get_jwt_identity()
-    new_token = create_access_token(identity=current_user)
+    # Fresh claims, so a changed name or email reaches the next access token
+    user = get_identity(current_user)
+    if not user:
+        return jsonify({"msg": "User not found"}), 401
+    new_token = create_access_token(identity=current_user, additional_claims=identity_claims(user))
     return jsonify({"access_token": new_token}), 200
 
 # Report Endpoints
 @api_bp.route('/reports', methods=['GET'])
 @jwt_required()
+@read_replica
 def get_user_reports():
     user_id = get_jwt_identity()
-    reports = MaintenanceReport.query.filter_by(driver_id=user_id).all()
+    if 'updated_since' in request.args:
+        return sync_user_reports(user_id)
+    try:
+        etag, last_modified = collection_validators(
+            filter_reports(MaintenanceReport.query.filter_by(driver_id=user_id), request.args), user_id
+        )
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+        reports, meta = paginate_reports(
+            MaintenanceReport.query.options(*REPORT_LIST_OPTIONS).filter_by(driver_id=user_id),
+            request.args
+        )
+    except PaginationError as e:
+        return jsonify({"msg": str(e)}), 400
+    
+    # Clients keep the token from the first page and pass it back as updated_since
+    meta['sync_token'] = current_token()
+    response = jsonify({
+        'data': [report_summary(report) for report in reports],
+        'meta': meta
+    })
+    return add_validators(response, etag, last_modified), 200
+
+def sync_user_reports(user_id):
+    """Delta mode of GET /reports: changes and deletions since a sync token"""
+    if any(request.args.get(name) for name in REPORT_FILTERS + ('cursor',)):
+        return jsonify({"msg": "updated_since cannot be combined with filters or a cursor"}), 400
+    try:
+        reports, deleted, meta = report_changes(
+            user_id, request.args['updated_since'], get_page_size(request.args), REPORT_LIST_OPTIONS
+        )
+    except SyncTokenExpired as e:
+        return jsonify({"msg": str(e)}), 410
+    except (SyncError, PaginationError) as e:
+        return jsonify({"msg": str(e)}), 400
     
-    return jsonify([{
-        'id': report.id,
-        'truck_id': report.truck_id,
-        'issue_description': report.issue_description,
-        'reported_date': report.reported_date.isoformat(),
-        'status': report.status,
-        'image_url': report.image_url
-    } for report in reports]), 200
+    return jsonify({
+        'data': [report_summary(report) for report in reports],
+        'deleted': deleted,
+        'meta': meta
+    }), 200
 
 @api_bp.route('/reports', methods=['POST'])
 @jwt_required()
 def create_report():
     user_id = get_jwt_identity()
-    data = request.get_json()
+    upload = None
+    if request.mimetype == 'multipart/form-data':
+        # The image part is spooled to disk by the form parser, never
+        # held in memory as a whole
+        data = request.form
+        upload = request.files.get('image')
+    else:
+        if (request.content_length or 0) > current_app.config['MAX_JSON_BODY_SIZE']:
+            return jsonify({"msg": "Request too large, upload the image as multipart/form-data"}), 413
+        data = request.get_json() or {}
     
     if not data.get('truck_id') or not data.get('issue_description'):
         return jsonify({"msg": "Missing required fields"}), 400
     
+    # Optional position of the truck, used to assign a nearby workshop
+    latitude, longitude = data.get('latitude'), data.get('longitude')
+    if latitude in (None, '') and longitude in (None, ''):
+        latitude = longitude = None
+    else:
+        try:
+            latitude, longitude = parse_point(latitude, longitude)
+        except LocationError:
+            return jsonify({"msg": "latitude and longitude must be numbers within [-90, 90] and [-180, 180]"}), 400
+    
+    pending_image = None
     try:
-        image_url = None
-        if data.get('image'):
-            image_url = save_image(data['image'])
+        if upload and upload.filename:
+            started = time.perf_counter()
+            pending_image = stage_upload(upload.stream)
+            observe('image_stage_seconds', time.perf_counter() - started, 'multipart')
+        elif data.get('image'):
+            pending_image = save_image(data['image'])
+        if pending_image:
+            # Identical bytes reuse the stored image and skip processing
+            claim(pending_image)
         
         report = MaintenanceReport(
             truck_id=data['truck_id'],
             issue_description=data['issue_description'],
             driver_id=user_id,
-            image_url=image_url,
+            image_url=pending_image.url if pending_image else None,
+            image_renditions=pending_image.urls if pending_image else None,
+            image_status=pending_image.status if pending_image else None,
+            image_hash=pending_image.sha256 if pending_image else None,
+            latitude=latitude,
+            longitude=longitude,
             status='reported'
         )
         
         db.session.add(report)
         db.session.commit()
         
+        # Process the photo after the row exists so the worker can mark it ready
+        if pending_image:
+            enqueue(pending_image)
+        
         return jsonify({
             "msg": "Report created successfully",
-            "report_id": report.id
+            "report_id": report.id,
+            "image_status": report.image_status
         }), 201
         
     except Exception as e:
         db.session.rollback()
+        if pending_image:
+            discard(pending_image)
         return jsonify({"msg": str(e)}), 500
 
+@api_bp.route('/reports/bulk', methods=['POST'])
+@jwt_required()
+def bulk_create_reports():
+    """
+    Create many reports from a JSON array or an NDJSON body
+    (Content-Type: application/x-ndjson). Rows default to the caller's
+    driver_id. Responds with a summary and one result per row, in order.
+    """
+    max_rows = current_app.config['BULK_MAX_ROWS']
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        rows = iter_ndjson(request.stream)
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            return jsonify({"msg": "Expected a JSON array or an NDJSON body"}), 400
+        if len(rows) > max_rows:
+            return jsonify({"msg": f"At most {max_rows} rows per request"}), 413
+    
+    ingest = BulkIngest(get_jwt_identity(), current_app.config['BULK_CHUNK_SIZE'])
+    for row in rows:
+        if len(ingest.results) >= max_rows:
+            ingest.results.append({
+                'index': len(ingest.results),
+                'idempotency_key': submitted_key(row),
+                'status': 'rejected',
+                'errors': [f"At most {max_rows} rows per request"]
+            })
+            continue
+        ingest.add(row)
+    ingest.flush()
+    
+    return jsonify({
+        "summary": ingest.summary(),
+        "results": ingest.results
+    }), 200
+
 @api_bp.route('/reports/<int:report_id>', methods=['GET'])
 @jwt_required()
+@cached_response(identity=get_jwt_identity)
 def get_report(report_id):
     user_id = get_jwt_identity()
-    report = MaintenanceReport.query.filter_by(id=report_id, driver_id=user_id).first()
+    report = MaintenanceReport.query.options(*REPORT_DETAIL_OPTIONS).filter_by(
+        id=report_id, driver_id=user_id
+    ).first()
+    if not report:
+        report = find_archived_report(report_id, driver_id=user_id, options=ARCHIVED_REPORT_DETAIL_OPTIONS)
     
     if not report:
         return jsonify({"msg": "Report not found"}), 404
     
+    etag, last_modified = resource_validators(report)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    tag_response(*report_tags(report))
+    data = report_detail(report)
+    data['repair'] = data['repairs'][0] if data['repairs'] else None
+    return add_validators(jsonify(data), etag, last_modified), 200
+
+@api_bp.route('/events', methods=['GET'])
+@jwt_required()
+def driver_events():
+    """Server-Sent Events stream of status changes on the driver's reports"""
+    return event_stream(driver_id=get_jwt_identity())
+
+# Workshop Endpoints
+@api_bp.route('/workshops', methods=['GET'])
+@jwt_required()
+@cached_response()
+def get_workshops():
+    tag_response('workshops')
+    try:
+        workshops, meta = paginate_workshops(Workshop.query, request.args)
+    except PaginationError as e:
+        return jsonify({"msg": str(e)}), 400
+    return jsonify({'data': [workshop.to_dict() for workshop in workshops], 'meta': meta}), 200
+
+@api_bp.route('/workshops/nearest', methods=['GET'])
+@jwt_required()
+def get_nearest_workshops():
+    """The limit workshops closest to lat/lon, optionally within max_km"""
+    try:
+        lat, lon = parse_point(request.args.get('lat'), request.args.get('lon'))
+        limit = int(request.args.get('limit', 5))
+        max_km = float(request.args['max_km']) if request.args.get('max_km') else None
+    except LocationError as e:
+        return jsonify({"msg": str(e)}), 400
+    except ValueError:
+        return jsonify({"msg": "limit must be an integer and max_km a number"}), 400
+    if limit < 1 or (max_km is not None and max_km <= 0):
+        return jsonify({"msg": "limit and max_km must be positive"}), 400
+    
+    # Positions vary per request, so these answers are not worth caching
+    results = nearest_workshops(lat, lon, min(limit, current_app.config['NEAREST_MAX_LIMIT']), max_km)
     return jsonify({
-        'id': report.id,
-        'truck_id': report.truck_id,
-        'issue_description': report.issue_description,
-        'reported_date': report.reported_date.isoformat(),
-        'status': report.status,
-        'image_url': report.image_url,
-        'repair': {
-            'status': report.repairs[0].status if report.repairs else None,
-            'workshop': report.repairs[0].workshop.name if report.repairs and report.repairs[0].workshop else None,
-            'notes': report.repairs[0].notes if report.repairs else None
-        } if report.repairs else None
+        'data': [dict(workshop.to_dict(), distance_km=round(distance, 3)) for workshop, distance in results],
+        'meta': {'count': len(results), 'lat': lat, 'lon': lon}
     }), 200
 
+@api_bp.route('/workshops/<int:workshop_id>', methods=['GET'])
+@jwt_required()
+@cached_response()
+def get_workshop(workshop_id):
+    workshop = Workshop.query.get(workshop_id)
+    
+    if not workshop:
+        return jsonify({"msg": "Workshop not found"}), 404
+    
+    tag_response(f'workshop:{workshop.id}')
+    return jsonify({'data': workshop.to_dict()}), 200
+
 # User Profile
 @api_bp.route('/profile', methods=['GET'])
 @jwt_required()
+@read_replica
 def get_profile():
-    user_id = get_jwt_identity()
-    user = Driver.query.get(user_id)
+    # The token's claims, unless it predates them
+    user = claimed_identity(get_jwt_identity(), get_jwt()) or get_identity(get_jwt_identity())
     
     if not user:
         return jsonify({"msg": "User not found"}), 404
     
     return jsonify({
-        'id': user.id,
-        'name': user.name,
-        'email': user.email
+        'id': user['id'],
+        'name': user['name'],
+        'email': user['email']
     }), 200
@@ -1,66 +1,116 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, send_from_directory
-from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import JWTManager
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, current_app, abort
+from datetime import timedelta
 import os
 import re
-import uuid
 import logging
 from functools import wraps
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import FormDataParser as BaseFormDataParser
 from config import get_config
+from extensions import db, jwt
+from database import read_replica
+from green import init_green
+from models import Driver, MaintenanceReport
+from pagination import paginate_reports, PaginationError
+from serializers import (
+    REPORT_LIST_OPTIONS, REPORT_DETAIL_OPTIONS, ARCHIVED_REPORT_DETAIL_OPTIONS, JSONProvider, report_summary, report_detail
+)
+from stats import init_stats, fleet_stats
+from sync import init_sync
+from events import init_events, event_stream
+from passwords import PasswordHashingBusy, hash_password, verify_password
+from identity import init_identity, get_cache as identity_cache
+from cache import init_cache, cached_response, tag_response, report_tags, get_cache as response_cache
+from metrics import init_metrics, metrics_response
+from compression import init_compression
+from outbox import init_outbox
+from archive import find_archived_report
+from api import api_bp
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Flask app
-app = Flask(__name__, static_folder='static')
+class FormDataParser(BaseFormDataParser):
+    # Werkzeug 2.3 only holds its multipart parse buffer to
+    # max_form_memory_size, so apply it to the text fields as well
+    def parse(self, stream, mimetype, content_length, options=None):
+        stream, form, files = super().parse(stream, mimetype, content_length, options)
+        limit = self.max_form_memory_size
+        if limit is not None and sum(len(value) for _, value in form.items(multi=True)) > limit:
+            raise RequestEntityTooLarge()
+        return stream, form, files
 
-# Load configuration
-config = get_config()
-app.config.from_object(config)
-app.secret_key = config.SECRET_KEY if hasattr(config, 'SECRET_KEY') else 'dev-key-123'
-app.permanent_session_lifetime = timedelta(days=7)  # Session lasts 7 days
+class Request(Flask.request_class):
+    form_data_parser_class = FormDataParser
 
-# JWT Configuration
-app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'super-secret-key')
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
-app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
-app.config['UPLOAD_FOLDER'] = os.path.join('static', 'uploads')
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    # Cap the non-file form fields werkzeug buffers in memory per request
+    @property
+    def max_form_memory_size(self):
+        return current_app.config.get('MAX_FORM_MEMORY_SIZE')
 
-# Ensure upload directory exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+def create_app(config=None):
+    """Build the app, configured from config or the FLASK_ENV config class"""
+    app = Flask(__name__, static_folder='static')
+    app.request_class = Request
 
-# Initialize extensions
-db = SQLAlchemy()
-jwt = JWTManager()
+    # Load configuration
+    config = config or get_config()
+    app.config.from_object(config)
+    app.secret_key = config.SECRET_KEY if hasattr(config, 'SECRET_KEY') else 'dev-key-123'
+    app.permanent_session_lifetime = timedelta(days=7)  # Session lasts 7 days
 
-# Import models after db initialization to avoid circular imports
-from models import Driver, MaintenanceReport, Workshop, Repair
+    # JWT Configuration
+    app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'super-secret-key')
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
+    app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
+    app.config['UPLOAD_FOLDER'] = os.path.join('static', 'uploads')
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-# Initialize extensions with app
-db.init_app(app)
-jwt.init_app(app)
+    # Ensure upload directory exists
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# Import and register blueprints
-try:
-    from api import api_bp as api_blueprint
-    app.register_blueprint(api_blueprint, url_prefix='/api/v1')
-    logger.info("API Blueprint registered successfully")
-except Exception as e:
-    logger.error(f"Error registering API Blueprint: {str(e)}")
+    # Initialize extensions with app
+    db.init_app(app)
+    jwt.init_app(app)
+    init_green(app)
+    app.json = JSONProvider(app)
+    init_stats()
+    init_sync()
+    init_events()
+    init_identity()
+    init_cache()
+    init_metrics(app)
+    init_compression(app)
+    init_outbox(app)
+
+    app.register_blueprint(api_bp, url_prefix='/api/v1')
+    register_views(app)
+    return app
+
+def __getattr__(name):
+    # `from app import app` (gunicorn app:app, the CLI jobs) builds the app
+    # on first use; importing the module alone does not
+    global app
+    if name == 'app':
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # CORS Headers
-@app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
 
-@app.route('/')
+# Uploaded images are named by the hash of their content, so the bytes
+# behind a URL never change and clients and CDNs may cache them forever
+def cache_uploads(response):
+    if request.path.startswith('/static/uploads/') and response.status_code in (200, 304):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 def home():
     if 'user_id' in session:
         return redirect(url_for('view_reports'))
@@ -80,7 +130,11 @@ def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
-@app.route('/login', methods=['GET', 'POST'])
+def busy_form(template):
+    """Re-render an auth form with 503 while password hashing is saturated"""
+    flash('Too many people are signing in right now. Please try again in a moment.', 'warning')
+    return render_template(template), 503, {'Retry-After': str(current_app.config['PASSWORD_RETRY_AFTER'])}
+
 def login():
     if 'user_id' in session:
         return redirect(url_for('view_reports'))
@@ -96,7 +150,12 @@ def login():
             
         user = Driver.query.filter_by(email=email).first()
         
-        if not user or not check_password_hash(user.password, password):
+        try:
+            valid = user is not None and verify_password(user, password)
+        except PasswordHashingBusy:
+            return busy_form('login.html')
+        
+        if not valid:
             flash('Invalid email or password', 'danger')
             return redirect(url_for('login'))
             
@@ -112,7 +171,6 @@ def login():
         
     return render_template('login.html')
 
-@app.route('/signup', methods=['GET', 'POST'])
 def signup():
     if 'user_id' in session:
         return redirect(url_for('view_reports'))
@@ -145,12 +203,17 @@ def signup():
             flash('Email already registered. Please use a different email or login.', 'warning')
             return redirect(url_for('login'))
             
+        try:
+            password_hash = hash_password(password)
+        except PasswordHashingBusy:
+            return busy_form('signup.html')
+            
         try:
             # Create new user
             new_user = Driver(
                 name=name,
                 email=email,
-                password=generate_password_hash(password, method='pbkdf2:sha256')
+                password=password_hash
             )
             
             db.session.add(new_user)
@@ -172,13 +235,11 @@ def signup():
     
     return render_template('signup.html')
 
-@app.route('/logout')
 def logout():
     session.clear()
     flash('You have been logged out.', 'info')
     return redirect(url_for('login'))
 
-@app.route('/api/report-issue', methods=['POST'])
 def report_issue():
     data = request.get_json()
     try:
@@ -194,45 +255,125 @@ def report_issue():
         db.session.rollback()
         return jsonify({'error': str(e)}), 400
 
-@app.route('/api/get-reports')
+@read_replica
 def get_reports():
-    reports = MaintenanceReport.query.all()
-    return jsonify([{
-        'id': report.id,
-        'truck_id': report.truck_id,
-        'issue_description': report.issue_description,
-        'reported_date': report.reported_date.isoformat() if report.reported_date else None,
-        'status': report.status,
-        'driver_id': report.driver_id
-    } for report in reports])
-
-@app.route('/api/get-report/<int:report_id>')
+    try:
+        reports, meta = paginate_reports(
+            MaintenanceReport.query.options(*REPORT_LIST_OPTIONS), request.args
+        )
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'data': [report_summary(report) for report in reports],
+        'meta': meta
+    })
+
+@cached_response()
 def get_report(report_id):
-    report = MaintenanceReport.query.get_or_404(report_id)
+    report = MaintenanceReport.query.options(*REPORT_DETAIL_OPTIONS).filter_by(id=report_id).first()
+    if report is None:
+        report = find_archived_report(report_id, options=ARCHIVED_REPORT_DETAIL_OPTIONS)
+    if report is None:
+        abort(404)
+    tag_response(*report_tags(report))
+    return jsonify(report_detail(report))
+
+@login_required
+@read_replica
+def search_reports():
+    """Full-text search over issue descriptions and repair notes"""
+    from search import SearchError, search_reports as run_search
+    try:
+        results = run_search(request.args.get('q'), request.args, REPORT_LIST_OPTIONS)
+    except (SearchError, PaginationError) as e:
+        return jsonify({'error': str(e)}), 400
     return jsonify({
-        'id': report.id,
-        'truck_id': report.truck_id,
-        'issue_description': report.issue_description,
-        'reported_date': report.reported_date.isoformat() if report.reported_date else None,
-        'status': report.status,
-        'driver_id': report.driver_id,
-        'driver_name': report.driver.name if report.driver else 'Unknown'
+        'data': [dict(report_summary(report), rank=rank) for report, rank in results],
+        # Archived reports are not indexed (search.py)
+        'meta': {'count': len(results), 'sort': request.args.get('sort', 'rank'), 'includes_archived': False}
     })
 
-@app.route('/reports')
+@login_required
+def fleet_events():
+    """Server-Sent Events stream of every report and repair status change"""
+    return event_stream()
+
+@login_required
+@read_replica
+def get_stats():
+    """Fleet statistics read from the incrementally maintained summary tables"""
+    try:
+        weeks = min(int(request.args.get('weeks', 12)), 104)
+        trucks = min(int(request.args.get('trucks', 20)), 100)
+    except ValueError:
+        return jsonify({'error': 'weeks and trucks must be integers'}), 400
+    return jsonify(fleet_stats(weeks=weeks, trucks=trucks))
+
+@login_required
+def identity_cache_stats():
+    """Hit and miss counters of this worker's driver identity cache"""
+    return jsonify(dict(identity_cache().stats(), pid=os.getpid()))
+
+@login_required
+def response_cache_stats():
+    """Hit and miss counters of this worker's response cache"""
+    cache = response_cache()
+    return jsonify(dict(cache.stats() if cache else {'backend': None}, pid=os.getpid()))
+
+def metrics():
+    """Request metrics of every worker in the Prometheus text format"""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return metrics_response()
+
+@login_required
+@read_replica
+def export_reports():
+    """Stream report and repair history as CSV or NDJSON, gzipped if accepted"""
+    from export import EXPORT_FORMATS, export_response
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+    try:
+        return export_response(request.args, fmt, compress='gzip' in request.accept_encodings)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
 @login_required
 def view_reports():
     return render_template('reports.html')
 
-@app.route('/report-issue')
 @login_required
 def report_issue_page():
     return render_template('report_issue.html')
 
-def create_tables():
+def register_views(app):
+    """The dashboard pages and the session-authenticated JSON endpoints"""
+    app.after_request(after_request)
+    app.after_request(cache_uploads)
+    app.add_url_rule('/', view_func=home)
+    app.add_url_rule('/login', view_func=login, methods=['GET', 'POST'])
+    app.add_url_rule('/signup', view_func=signup, methods=['GET', 'POST'])
+    app.add_url_rule('/logout', view_func=logout)
+    app.add_url_rule('/api/report-issue', view_func=report_issue, methods=['POST'])
+    app.add_url_rule('/api/get-reports', view_func=get_reports)
+    app.add_url_rule('/api/get-report/<int:report_id>', view_func=get_report)
+    app.add_url_rule('/api/search-reports', view_func=search_reports)
+    app.add_url_rule('/api/events', view_func=fleet_events)
+    app.add_url_rule('/api/stats', view_func=get_stats)
+    app.add_url_rule('/api/identity-cache', view_func=identity_cache_stats)
+    app.add_url_rule('/api/response-cache', view_func=response_cache_stats)
+    app.add_url_rule('/metrics', view_func=metrics)
+    app.add_url_rule('/api/export-reports', view_func=export_reports)
+    app.add_url_rule('/reports', view_func=view_reports)
+    app.add_url_rule('/report-issue', view_func=report_issue_page)
+
+def create_tables(app):
     with app.app_context():
-        # Create all tables
-        db.create_all()
+        # Create or upgrade tables through versioned migrations
+        from migrations import upgrade
+        upgrade()
         
         # Import and run database initialization if needed
         if os.environ.get('FLASK_ENV') == 'development':
@@ -240,9 +381,11 @@ def create_tables():
             init_db()
 
 if __name__ == '__main__':
+    app = create_app()
+
     # Only create tables if we're not in a production environment
     if os.environ.get('FLASK_ENV') != 'production':
-        create_tables()
+        create_tables(app)
     
     # Get port from environment variable or default to 5000
     port = int(os.environ.get('PORT', 5000))
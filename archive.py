@@ -0,0 +1,146 @@
+"""
+Archival of closed reports.
+
+Completed and cancelled reports whose last change (updated_at) is older
+than ARCHIVE_AFTER_DAYS are moved, with their repairs, from
+maintenance_report and repair into archived_report and archived_repair.
+Each batch of ARCHIVE_BATCH_SIZE reports is copied with INSERT ... SELECT
+and deleted from the hot tables in one transaction, so a report is always
+in exactly one place. Archiving leaves a DeletedReport tombstone, so delta
+sync clients drop the report like a deleted one. The hot tables, their
+indexes and the search index then only grow with the open and recent part
+of the fleet's history.
+
+The archive is read only. Report detail endpoints look a report up in it
+when the hot table misses (find_archived_report), the export includes it
+unless asked not to, and bulk uploads still count its idempotency keys as
+taken; listings, search and delta sync cover the hot tables. Archived ids
+are never handed out again (AUTOINCREMENT on SQLite, sequences on
+Postgres). The writes bypass the ORM, so the fleet statistics keep
+counting archived reports (stats.py rebuild reads both) and their photos
+stay referenced (images.py gc counts both).
+
+    python archive.py run [--dry-run]   # archive everything due, in batches
+    python archive.py status            # hot and archived row counts
+"""
+import sys
+import time
+import logging
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, func, insert, literal, select
+from extensions import db
+from models import ArchivedRepair, ArchivedReport, DeletedReport, MaintenanceReport, Repair
+
+logger = logging.getLogger(__name__)
+
+CLOSED_STATUSES = ('completed', 'cancelled')
+
+
+def _copy(source, target, where, **values):
+    """INSERT INTO target SELECT the matching columns FROM source WHERE where"""
+    names = [column.name for column in target.c if column.name in source.c]
+    columns = [source.c[name] for name in names]
+    columns += [literal(value, target.c[name].type) for name, value in values.items()]
+    return insert(target).from_select(names + list(values), select(*columns).where(where))
+
+
+def due_for_archival(cutoff):
+    """Filter for closed reports last changed before cutoff"""
+    report = MaintenanceReport.__table__
+    # Nothing changes before it is reported, so the reported_date bound
+    # only narrows the scan
+    return (report.c.status.in_(CLOSED_STATUSES) & (report.c.reported_date < cutoff)
+            & (func.coalesce(report.c.updated_at, report.c.reported_date) < cutoff))
+
+
+def archive_batch(conn, cutoff, after_id, batch_size):
+    """
+    Move the next batch of due reports with ids above after_id and their
+    repairs. Returns (report ids, repair count); no ids means none are left.
+    """
+    report, repair = MaintenanceReport.__table__, Repair.__table__
+    ids = conn.execute(
+        select(report.c.id).where(due_for_archival(cutoff), report.c.id > after_id)
+        .order_by(report.c.id).limit(batch_size)
+        # Postgres: a report being edited right now waits for the next run
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not ids:
+        return ids, 0
+    now = datetime.utcnow()
+    tombstone = DeletedReport.__table__
+    conn.execute(_copy(report, ArchivedReport.__table__, report.c.id.in_(ids), archived_at=now))
+    repairs = conn.execute(_copy(repair, ArchivedRepair.__table__, repair.c.report_id.in_(ids))).rowcount
+    # Delta sync reports archived reports as deleted
+    conn.execute(delete(tombstone).where(tombstone.c.report_id.in_(ids)))
+    conn.execute(insert(tombstone).from_select(
+        ['report_id', 'driver_id', 'deleted_at'],
+        select(report.c.id, report.c.driver_id, literal(now, tombstone.c.deleted_at.type)).where(report.c.id.in_(ids))
+    ))
+    conn.execute(delete(repair).where(repair.c.report_id.in_(ids)))
+    conn.execute(delete(report).where(report.c.id.in_(ids)))
+    return ids, repairs
+
+
+def archive_reports(days=None, batch_size=None, dry_run=False):
+    """Archive every report due; returns a summary of what was moved"""
+    config = current_app.config
+    days = config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    batch_size = batch_size or config['ARCHIVE_BATCH_SIZE']
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    if dry_run:
+        with db.engine.connect() as conn:
+            due = conn.execute(
+                select(func.count()).select_from(MaintenanceReport.__table__).where(due_for_archival(cutoff))
+            ).scalar()
+        return {'cutoff': cutoff.isoformat(), 'reports': due}
+
+    started = time.perf_counter()
+    summary = {'cutoff': cutoff.isoformat(), 'reports': 0, 'repairs': 0, 'batches': 0}
+    after_id = 0
+    while True:
+        # One transaction per batch keeps locks and undo short
+        with db.engine.begin() as conn:
+            ids, repairs = archive_batch(conn, cutoff, after_id, batch_size)
+        if not ids:
+            break
+        after_id = ids[-1]
+        summary['reports'] += len(ids)
+        summary['repairs'] += repairs
+        summary['batches'] += 1
+    summary['seconds'] = time.perf_counter() - started
+    logger.info(f"Archive run: {summary}")
+    return summary
+
+
+def find_archived_report(report_id, driver_id=None, options=()):
+    """An archived report by id (and owner), or None"""
+    query = ArchivedReport.query.options(*options).filter_by(id=report_id)
+    if driver_id is not None:
+        query = query.filter_by(driver_id=driver_id)
+    return query.first()
+
+
+def table_sizes():
+    """Row counts of the hot and archive tables"""
+    models = (MaintenanceReport, Repair, ArchivedReport, ArchivedRepair)
+    return {model.__tablename__: db.session.query(func.count()).select_from(model).scalar() for model in models}
+
+
+if __name__ == '__main__':
+    from app import app
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command not in ('run', 'status'):
+        print("usage: python archive.py run [--dry-run] | status")
+        sys.exit(2)
+    with app.app_context():
+        if command == 'status':
+            for table, count in table_sizes().items():
+                print(f"{table}: {count}")
+            sys.exit(0)
+        dry_run = '--dry-run' in sys.argv[2:]
+        summary = archive_reports(dry_run=dry_run)
+        print(f"{'Would archive' if dry_run else 'Archived'} {summary['reports']} report(s) "
+              f"last changed before {summary['cutoff']}"
+              + ('' if dry_run else f" with {summary['repairs']} repair(s) in {summary['batches']} batch(es)"))
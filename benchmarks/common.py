@@ -0,0 +1,79 @@
+"""
+Shared setup for the benchmark scripts.
+
+Benchmarks run from the repository root as modules, for example
+``python -m benchmarks.uploads``. Each one works in a throwaway directory
+with its own SQLite database and upload folders.
+"""
+import os
+import json
+import tempfile
+import statistics
+
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+
+def setup_app(workdir=None, database_url=None, **config):
+    """Point the app at a scratch database and upload folder and migrate it"""
+    from app import app
+    from migrations import upgrade
+
+    workdir = workdir or tempfile.mkdtemp(prefix='serepairs-bench-')
+    app.static_folder = os.path.join(workdir, 'static')
+    app.config['IMAGE_PENDING_FOLDER'] = os.path.join(workdir, 'pending')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    app.config['SQLALCHEMY_ECHO'] = False
+    app.config.update(config)
+    with app.app_context():
+        upgrade()
+    return app, workdir
+
+
+def create_driver(app, email='bench@example.com'):
+    """Create a driver and return (driver_id, auth headers)"""
+    from extensions import db
+    from models import Driver
+    from flask_jwt_extended import create_access_token
+
+    with app.app_context():
+        driver = Driver.query.filter_by(email=email).first()
+        if not driver:
+            driver = Driver(name='Bench Driver', email=email, password='!')
+            db.session.add(driver)
+            db.session.commit()
+        token = create_access_token(identity=driver.id)
+        return driver.id, {'Authorization': f'Bearer {token}'}
+
+
+def percentiles(samples):
+    """Summarize latency samples in seconds as milliseconds"""
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': pick(50),
+        'p95_ms': pick(95),
+        'p99_ms': pick(99),
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def peak_rss_kb(pid):
+    """Peak resident set size of a process in kB (Linux only)"""
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return None
+
+
+def write_results(path, results):
+    if path:
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {path}")
@@ -0,0 +1,228 @@
+"""
+Generate a synthetic fleet: drivers, workshops, reports, repairs and photos.
+
+Everything is drawn from a seeded random generator over a fixed period, so
+the same arguments give the same fleet. Rows go in with bulk inserts; the
+summary tables are rebuilt afterwards and the search and spatial triggers
+index the rows as they arrive, exactly as in production.
+
+Drivers live around the cities of benchmarks.workshops and report from
+there. A few drivers report much more than the rest, older reports are
+mostly completed, and in progress or completed reports have a repair at a
+workshop in the same city. image_share of the reports carry a photo; the
+image_blob rows and renditions are recorded, the files are not written.
+Every driver logs in with PASSWORD.
+
+    python -m benchmarks.fleet --drivers 10000 --reports 1000000 --workdir /tmp/fleet
+
+The database is written to WORKDIR/bench.db with a fleet.json manifest,
+ready for python -m benchmarks.load --fleet WORKDIR.
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import argparse
+from collections import deque
+from datetime import datetime, timedelta
+from benchmarks.common import setup_app
+from benchmarks.search import COMPONENTS, REPAIR_NOTES, describe
+from benchmarks.workshops import CITIES, populate as populate_workshops
+
+PASSWORD = 'fleet-password-1'
+PERIOD_END = datetime(2025, 1, 1)
+PERIOD_DAYS = 3 * 365
+MANIFEST = 'fleet.json'
+
+
+def driver_email(index):
+    return f'driver{index:06d}@fleet.example.com'
+
+
+def populate_drivers(app, count, batch_size=10000):
+    """Insert count drivers sharing one password hash (hashing each would take hours)"""
+    from werkzeug.security import generate_password_hash
+    from extensions import db
+    from models import Driver
+
+    password = generate_password_hash(PASSWORD, method=app.config['PASSWORD_METHOD'])
+    created = PERIOD_END - timedelta(days=PERIOD_DAYS)
+    with app.app_context():
+        for offset in range(0, count, batch_size):
+            rows = [{'name': f'Driver {i:06d}', 'email': driver_email(i), 'password': password,
+                     'created_at': created} for i in range(offset, min(offset + batch_size, count))]
+            db.session.execute(Driver.__table__.insert(), rows)
+            db.session.commit()
+        return [driver_id for (driver_id,) in db.session.query(Driver.id).order_by(Driver.id)]
+
+
+def workshops_by_city(app):
+    """Located workshop ids grouped by the index of their nearest city"""
+    from extensions import db
+    from models import Workshop
+
+    groups = [[] for _ in CITIES]
+    with app.app_context():
+        for workshop_id, lat, lon in db.session.query(Workshop.id, Workshop.latitude, Workshop.longitude):
+            city = min(range(len(CITIES)),
+                       key=lambda i: (CITIES[i][0] - lat) ** 2 + (CITIES[i][1] - lon) ** 2)
+            groups[city].append(workshop_id)
+    fallback = [workshop_id for group in groups for workshop_id in group]
+    return [group or fallback for group in groups]
+
+
+def photo(app, rng, sha256):
+    """image_blob row and report columns for a processed photo"""
+    from images import _renditions
+
+    urls = {name: url for name, (_, url, _) in _renditions(app, 'reports', sha256).items()}
+    blob = {'sha256': sha256, 'folder': 'reports', 'size': rng.randint(300000, 6000000),
+            'status': 'ready', 'renditions': urls, 'ref_count': 0}
+    columns = {'image_hash': sha256, 'image_url': urls['full'], 'image_renditions': urls,
+               'image_status': 'ready'}
+    return blob, columns
+
+
+def status_for(rng, age_days):
+    """Recent reports are mostly open, older ones mostly completed"""
+    if age_days < 3:
+        weights = (0.6, 0.3, 0.08, 0.02)
+    elif age_days < 30:
+        weights = (0.15, 0.25, 0.55, 0.05)
+    else:
+        weights = (0.01, 0.01, 0.9, 0.08)
+    return rng.choices(('reported', 'in_progress', 'completed', 'cancelled'), weights)[0]
+
+
+def populate_reports(app, driver_ids, count, workshops, batch_size=10000, image_share=0.2,
+                     reused_image_share=0.05, seed=1):
+    """Insert count reports with their repairs and photos; returns (repairs, images)"""
+    from extensions import db
+    from models import ImageBlob, MaintenanceReport, Repair
+
+    rng = random.Random(seed)
+    homes = [rng.randrange(len(CITIES)) for _ in driver_ids]
+    trucks = max(1, len(driver_ids) // 2)
+    start = PERIOD_END - timedelta(days=PERIOD_DAYS)
+    step = PERIOD_DAYS * 86400 / max(count, 1)
+    # sha256 -> reports using it; recent photos are the ones sent again
+    ref_counts, recent, repair_count = {}, deque(maxlen=1000), 0
+    with app.app_context():
+        for offset in range(0, count, batch_size):
+            reports, repairs, blobs = [], [], []
+            for i in range(offset, min(offset + batch_size, count)):
+                # Squaring skews the draw: a few drivers file most of the reports
+                driver = int(len(driver_ids) * rng.random() ** 2)
+                city = homes[driver]
+                reported = start + timedelta(seconds=(i + rng.random()) * step)
+                status = status_for(rng, (PERIOD_END - reported).days)
+                lat, lon = CITIES[city]
+                report = {
+                    'id': i + 1,
+                    'truck_id': f'TRK{(driver + rng.randrange(3)) % trucks:05d}',
+                    'issue_description': describe(rng),
+                    'driver_id': driver_ids[driver],
+                    'status': status,
+                    'reported_date': reported,
+                    'updated_at': reported + timedelta(hours=rng.uniform(0, 72)),
+                    'latitude': rng.gauss(lat, 0.6),
+                    'longitude': rng.gauss(lon, 1.0),
+                    'image_hash': None, 'image_url': None, 'image_renditions': None, 'image_status': None,
+                }
+                if rng.random() < image_share:
+                    if recent and rng.random() < reused_image_share:
+                        sha256, columns = rng.choice(recent)
+                    else:
+                        sha256 = hashlib.sha256(f'{seed}:{i}'.encode()).hexdigest()
+                        blob, columns = photo(app, rng, sha256)
+                        blob['created_at'] = reported
+                        blobs.append(blob)
+                        recent.append((sha256, columns))
+                    ref_counts[sha256] = ref_counts.get(sha256, 0) + 1
+                    report.update(columns)
+                reports.append(report)
+                if status in ('in_progress', 'completed'):
+                    started = reported + timedelta(hours=rng.uniform(1, 48))
+                    finished = started + timedelta(hours=rng.uniform(1, 96)) if status == 'completed' else None
+                    repairs.append({
+                        'report_id': report['id'],
+                        'workshop_id': rng.choice(workshops[city]),
+                        'start_date': started,
+                        'end_date': finished,
+                        'status': status,
+                        'notes': rng.choice(REPAIR_NOTES).format(c=rng.choice(COMPONENTS)),
+                        'created_at': started,
+                        'updated_at': finished or started,
+                    })
+            if blobs:
+                db.session.execute(ImageBlob.__table__.insert(), blobs)
+            db.session.execute(MaintenanceReport.__table__.insert(), reports)
+            if repairs:
+                db.session.execute(Repair.__table__.insert(), repairs)
+            db.session.commit()
+            repair_count += len(repairs)
+
+        table = ImageBlob.__table__
+        counts = [{'key': sha256, 'refs': refs} for sha256, refs in ref_counts.items()]
+        for offset in range(0, len(counts), batch_size):
+            db.session.execute(
+                table.update().where(table.c.sha256 == db.bindparam('key')).values(ref_count=db.bindparam('refs')),
+                counts[offset:offset + batch_size]
+            )
+        db.session.commit()
+    return repair_count, len(ref_counts)
+
+
+def generate(app, drivers, reports, workshops, image_share=0.2, seed=1):
+    """Populate app's (empty) database; returns the manifest"""
+    from extensions import db
+    import stats
+
+    started = time.perf_counter()
+    driver_ids = populate_drivers(app, drivers)
+    populate_workshops(app, workshops, seed=seed)
+    repairs, images = populate_reports(app, driver_ids, reports, workshops_by_city(app),
+                                       image_share=image_share, seed=seed)
+    with app.app_context():
+        # Bulk inserts skip the session hooks that keep the summary tables current
+        with db.engine.begin() as conn:
+            stats.rebuild(conn)
+            if conn.dialect.name == 'sqlite':
+                conn.exec_driver_sql("INSERT INTO report_search (report_search) VALUES ('optimize')")
+    return {
+        'drivers': drivers, 'workshops': workshops, 'reports': reports, 'repairs': repairs, 'images': images,
+        'image_share': image_share, 'seed': seed, 'password': PASSWORD,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def load_manifest(workdir):
+    with open(os.path.join(workdir, MANIFEST)) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--drivers', type=int, default=10000)
+    parser.add_argument('--reports', type=int, default=1000000)
+    parser.add_argument('--workshops', type=int, default=2000)
+    parser.add_argument('--image-share', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', required=True)
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    if os.path.exists(os.path.join(args.workdir, 'bench.db')):
+        parser.error(f"{args.workdir} already holds a database")
+    app, _ = setup_app(args.workdir)
+    manifest = generate(app, args.drivers, args.reports, args.workshops, args.image_share, args.seed)
+    with open(os.path.join(args.workdir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"{manifest['drivers']} drivers, {manifest['workshops']} workshops, {manifest['reports']} reports, "
+          f"{manifest['repairs']} repairs, {manifest['images']} photos in {manifest['seconds']:.1f}s "
+          f"({args.workdir})")
+
+
+if __name__ == '__main__':
+    main()
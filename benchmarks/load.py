@@ -0,0 +1,295 @@
+"""
+Run a scripted mixed workload against a synthetic fleet under gunicorn.
+
+The fleet comes from benchmarks.fleet: pass --fleet DIR to reuse one it
+generated, otherwise a fleet of --drivers and --reports is generated first.
+Each run starts from a fresh copy of the fleet database, so runs against
+the same fleet are comparable.
+
+--clients simulated drivers, each a random fleet driver, log in and then
+pick operations by weight (MIX) until --duration seconds have passed:
+listing their reports (following the cursor now and then), opening a
+report from the last page, filing a report, filing one with a photo, and
+logging in again. Per operation the client-side latency percentiles,
+throughput, status codes and the SQL statements per request (from the
+server's /metrics) are reported, along with the commit that was measured.
+
+    python -m benchmarks.load --fleet /tmp/fleet --clients 16 --duration 60 --output load.json
+    python -m benchmarks.load --fleet /tmp/fleet --compare load.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter, defaultdict
+import requests
+from benchmarks.common import setup_app, percentiles, write_results
+from benchmarks.fleet import driver_email, generate, load_manifest, MANIFEST
+from benchmarks.search import describe
+from benchmarks.workshops import CITIES
+
+# operation -> (weight, endpoint it is served by)
+MIX = {
+    'list': (45, 'api.get_user_reports'),
+    'detail': (30, 'api.get_report'),
+    'create': (15, 'api.create_report'),
+    'upload': (5, 'api.create_report'),
+    'login': (5, 'api.login'),
+}
+PHOTOS = 8
+
+
+def bench_app(workdir):
+    """gunicorn app factory: the run's copy of the fleet, processing photos off the request path"""
+    app, _ = setup_app(workdir, IMAGE_WORKERS=1, PASSWORD_WORKERS=1,
+                       METRICS_DIR=os.path.join(workdir, 'metrics'))
+    return app
+
+
+def prepare_fleet(args):
+    """Return the directory of a generated fleet, generating one if needed"""
+    if args.fleet:
+        return args.fleet
+    fleet = tempfile.mkdtemp(prefix='serepairs-fleet-')
+    app, _ = setup_app(fleet)
+    manifest = generate(app, args.drivers, args.reports, args.workshops)
+    with open(os.path.join(fleet, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Generated {args.drivers} drivers and {args.reports} reports in {manifest['seconds']:.1f}s ({fleet})")
+    return fleet
+
+
+def make_photos(directory, size_kb, count=PHOTOS):
+    """A few distinct noisy JPEGs, so uploads are not all deduplicated"""
+    from benchmarks.uploads import make_photo
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f'photo{i}.jpg')
+        make_photo(path, size_kb / 1024)
+        paths.append(path)
+    return paths
+
+
+def start_server(workdir, args):
+    factory = f"benchmarks.load:bench_app({workdir!r})"
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', factory, '--bind', f'127.0.0.1:{args.port}',
+         '--workers', str(args.workers), '--worker-class', 'gthread', '--threads', str(args.threads)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline and server.poll() is None:
+        try:
+            requests.get(f'http://127.0.0.1:{args.port}/login', timeout=5)
+            return server
+        except requests.RequestException:
+            time.sleep(0.2)
+    server.terminate()
+    server.wait()
+    raise RuntimeError(f"gunicorn did not start on port {args.port}")
+
+
+def sql_queries(base):
+    """{endpoint: (statements, requests)} from the server's /metrics"""
+    totals = defaultdict(lambda: [0.0, 0])
+    for line in requests.get(f'{base}/metrics').text.splitlines():
+        for suffix, slot in (('_sum', 0), ('_count', 1)):
+            prefix = f'http_request_sql_queries{suffix}{{endpoint="'
+            if line.startswith(prefix):
+                endpoint, value = line[len(prefix):].split('"} ')
+                totals[endpoint][slot] += float(value)
+    return totals
+
+
+class Client:
+    """One simulated driver working through the mix"""
+
+    def __init__(self, base, manifest, photos, seed):
+        self.base = base
+        self.rng = random.Random(seed)
+        self.email = driver_email(self.rng.randrange(manifest['drivers']))
+        self.password = manifest['password']
+        self.photos = photos
+        self.session = requests.Session()
+        self.headers = {}
+        self.report_ids = []
+        self.cursor = None
+
+    def login(self):
+        rv = self.session.post(f'{self.base}/api/v1/auth/login', json={'email': self.email, 'password': self.password})
+        if rv.status_code == 200:
+            self.headers = {'Authorization': f"Bearer {rv.json()['access_token']}"}
+        return rv
+
+    def list(self):
+        params = {'per_page': 20}
+        # Every third listing scrolls on to the next page
+        if self.cursor and self.rng.random() < 0.33:
+            params['cursor'] = self.cursor
+        rv = self.session.get(f'{self.base}/api/v1/reports', headers=self.headers, params=params)
+        if rv.status_code == 200:
+            body = rv.json()
+            self.report_ids = [report['id'] for report in body['data']] or self.report_ids
+            self.cursor = body['meta'].get('next_cursor')
+        return rv
+
+    def detail(self):
+        if not self.report_ids:
+            return self.list()
+        report_id = self.rng.choice(self.report_ids)
+        return self.session.get(f'{self.base}/api/v1/reports/{report_id}', headers=self.headers)
+
+    def _fields(self):
+        lat, lon = self.rng.choice(CITIES)
+        return {'truck_id': f'TRK{self.rng.randrange(100000):05d}', 'issue_description': describe(self.rng),
+                'latitude': round(self.rng.gauss(lat, 0.6), 5), 'longitude': round(self.rng.gauss(lon, 1.0), 5)}
+
+    def create(self):
+        return self.session.post(f'{self.base}/api/v1/reports', headers=self.headers, json=self._fields())
+
+    def upload(self):
+        with open(self.rng.choice(self.photos), 'rb') as photo:
+            return self.session.post(f'{self.base}/api/v1/reports', headers=self.headers, data=self._fields(),
+                                     files={'image': ('photo.jpg', photo, 'image/jpeg')})
+
+
+def run_client(client, deadline, samples, statuses):
+    names = list(MIX)
+    weights = [MIX[name][0] for name in names]
+    operation = 'login'
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        rv = getattr(client, operation)()
+        elapsed = time.perf_counter() - start
+        statuses[operation][rv.status_code] += 1
+        if rv.status_code < 400:
+            samples[operation].append(elapsed)
+        operation = client.rng.choices(names, weights)[0] if client.headers else 'login'
+
+
+def run(fleet, args):
+    manifest = load_manifest(fleet)
+    workdir = tempfile.mkdtemp(prefix='serepairs-load-')
+    shutil.copyfile(os.path.join(fleet, 'bench.db'), os.path.join(workdir, 'bench.db'))
+    photos = make_photos(workdir, args.photo_kb)
+    server = start_server(workdir, args)
+    base = f'http://127.0.0.1:{args.port}'
+    try:
+        # Warm up every worker before the measured window
+        warm = Client(base, manifest, photos, seed=-1)
+        warm.login()
+        for _ in range(args.workers * args.threads):
+            warm.list()
+        before = sql_queries(base)
+
+        samples, statuses = defaultdict(list), defaultdict(Counter)
+        clients = [Client(base, manifest, photos, seed=args.seed + i) for i in range(args.clients)]
+        deadline = time.monotonic() + args.duration
+        threads = [threading.Thread(target=run_client, args=(client, deadline, samples, statuses))
+                   for client in clients]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+        # Let the workers publish their last requests
+        time.sleep(2)
+        after = sql_queries(base)
+    finally:
+        server.terminate()
+        server.wait()
+
+    queries = {endpoint: (after[endpoint][0] - before[endpoint][0], after[endpoint][1] - before[endpoint][1])
+               for endpoint in after}
+    operations = {}
+    for name, (weight, endpoint) in MIX.items():
+        statements, count = queries.get(endpoint, (0, 0))
+        operations[name] = {
+            'endpoint': endpoint,
+            'latency': percentiles(samples[name]) if samples[name] else None,
+            'throughput_rps': len(samples[name]) / seconds,
+            'statuses': {str(code): n for code, n in sorted(statuses[name].items())},
+            'queries_per_request': statements / count if count else None,
+        }
+    total = sum(len(latencies) for latencies in samples.values())
+    return {
+        'commit': git_commit(),
+        'fleet': manifest,
+        'config': {'clients': args.clients, 'duration': args.duration, 'workers': args.workers,
+                   'threads': args.threads, 'photo_kb': args.photo_kb, 'seed': args.seed,
+                   'mix': {name: weight for name, (weight, _) in MIX.items()}},
+        'seconds': seconds,
+        'requests': total,
+        'throughput_rps': total / seconds,
+        'errors': sum(n for counts in statuses.values() for code, n in counts.items() if code >= 400),
+        'operations': operations,
+    }
+
+
+def git_commit():
+    """The measured commit, with -dirty when the tree has local changes"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit.strip() + ('-dirty' if dirty.strip() else '')
+
+
+def compare(baseline, results):
+    print(f"against {baseline.get('commit')}: throughput {baseline['throughput_rps']:.1f} -> "
+          f"{results['throughput_rps']:.1f} req/s")
+    for name, current in results['operations'].items():
+        previous = baseline['operations'].get(name)
+        if not previous or not previous['latency'] or not current['latency']:
+            continue
+        deltas = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            before, after = previous['latency'][key], current['latency'][key]
+            deltas.append(f"{key[:3]} {(after - before) / before * 100:+5.0f}%")
+        print(f"{name:>7}: {'  '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fleet', help='directory written by benchmarks.fleet')
+    parser.add_argument('--drivers', type=int, default=10000)
+    parser.add_argument('--reports', type=int, default=1000000)
+    parser.add_argument('--workshops', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=60, help='seconds')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gunicorn worker')
+    parser.add_argument('--photo-kb', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=5057)
+    parser.add_argument('--compare', help='results of an earlier run to compare with')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    fleet = prepare_fleet(args)
+    print(f"{args.clients} clients for {args.duration:.0f}s, {args.workers} workers x {args.threads} threads")
+    results = run(fleet, args)
+    print(f"{results['requests']} requests, {results['throughput_rps']:.1f} req/s, {results['errors']} errors")
+    for name, result in results['operations'].items():
+        latency, queries = result['latency'], result['queries_per_request']
+        if latency:
+            print(f"{name:>7}: p50 {latency['p50_ms']:7.1f} ms  p95 {latency['p95_ms']:7.1f} ms  "
+                  f"p99 {latency['p99_ms']:7.1f} ms  {result['throughput_rps']:6.1f} req/s  "
+                  f"{queries if queries is not None else 0:5.1f} queries")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
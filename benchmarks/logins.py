@@ -0,0 +1,169 @@
+"""
+Simulate a shift-change login storm against gunicorn.
+
+The app is served by gunicorn with the gthread workers used in production,
+once hashing passwords inline on the request threads and once on the
+password pool. --clients drivers log in at the same moment, --logins times
+each, while a probe keeps fetching a page of reports with a JWT. Login
+latency, how many were shed with 503, and the probe's latency during the
+storm (against an idle baseline) are reported per mode.
+
+    python -m benchmarks.logins --clients 50 --logins 4 --output logins.json
+"""
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+import requests
+from benchmarks.common import setup_app, create_driver, percentiles, write_results
+
+EMAIL = 'storm@example.com'
+PASSWORD = 'shift-change-1'
+
+
+def bench_app(workdir, password_workers, max_pending):
+    """gunicorn app factory: the benchmark database with the given hashing pool"""
+    app, _ = setup_app(workdir, PASSWORD_WORKERS=password_workers, PASSWORD_MAX_PENDING=max_pending)
+    return app
+
+
+def prepare(workdir):
+    """Create the storm driver and return auth headers for the probe"""
+    from werkzeug.security import generate_password_hash
+    from extensions import db
+    from models import Driver
+
+    app, _ = setup_app(workdir)
+    with app.app_context():
+        method = app.config['PASSWORD_METHOD']
+        db.session.add(Driver(name='Storm Driver', email=EMAIL,
+                              password=generate_password_hash(PASSWORD, method=method)))
+        db.session.commit()
+    _, headers = create_driver(app)
+    return headers
+
+
+def start_server(workdir, port, args, password_workers):
+    factory = f"benchmarks.logins:bench_app({workdir!r}, {password_workers}, {args.max_pending})"
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', factory, '--bind', f'127.0.0.1:{port}',
+         '--workers', str(args.workers), '--worker-class', 'gthread', '--threads', str(args.threads)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 60
+    # Stop polling if gunicorn exits, e.g. because the port is taken
+    while time.monotonic() < deadline and server.poll() is None:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/login', timeout=5)
+            return server
+        except requests.RequestException:
+            time.sleep(0.2)
+    server.terminate()
+    server.wait()
+    raise RuntimeError(f"gunicorn did not start on port {port}")
+
+
+def probe(url, headers, stop, samples, interval=0.05):
+    with requests.Session() as session:
+        while not stop.is_set():
+            start = time.perf_counter()
+            session.get(url, headers=headers, params={'per_page': 10}).raise_for_status()
+            samples.append(time.perf_counter() - start)
+            time.sleep(interval)
+
+
+def storm(url, clients, logins):
+    """Every client logs in logins times; returns (latencies of 200s, status counts)"""
+    latencies, statuses = [], Counter()
+    barrier = threading.Barrier(clients)
+
+    def client():
+        with requests.Session() as session:
+            barrier.wait()
+            for _ in range(logins):
+                start = time.perf_counter()
+                rv = session.post(url, json={'email': EMAIL, 'password': PASSWORD})
+                elapsed = time.perf_counter() - start
+                statuses[rv.status_code] += 1
+                if rv.status_code == 200:
+                    latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses
+
+
+def run_mode(name, password_workers, workdir, headers, args):
+    server = start_server(workdir, args.port, args, password_workers)
+    base = f'http://127.0.0.1:{args.port}'
+    try:
+        # Warm up: start the hashing pool of every worker
+        for _ in range(args.workers * 2):
+            requests.post(f'{base}/api/v1/auth/login', json={'email': EMAIL, 'password': PASSWORD})
+        idle = []
+        for _ in range(20):
+            start = time.perf_counter()
+            requests.get(f'{base}/api/v1/reports', headers=headers, params={'per_page': 10})
+            idle.append(time.perf_counter() - start)
+
+        stop, busy = threading.Event(), []
+        prober = threading.Thread(target=probe, args=(f'{base}/api/v1/reports', headers, stop, busy))
+        prober.start()
+        started = time.perf_counter()
+        latencies, statuses = storm(f'{base}/api/v1/auth/login', args.clients, args.logins)
+        seconds = time.perf_counter() - started
+        stop.set()
+        prober.join()
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        'mode': name,
+        'password_workers': password_workers,
+        'seconds': seconds,
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'login_latency': percentiles(latencies) if latencies else None,
+        'probe_idle': percentiles(idle),
+        'probe_during_storm': percentiles(busy) if busy else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--logins', type=int, default=4, help='logins per client')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gunicorn worker')
+    parser.add_argument('--pool', type=int, default=1, help='password processes per gunicorn worker')
+    parser.add_argument('--max-pending', type=int, default=4)
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='serepairs-logins-')
+    headers = prepare(workdir)
+    print(f"{args.clients} clients x {args.logins} logins, {args.workers} workers x {args.threads} threads")
+
+    results = {'clients': args.clients, 'logins': args.logins, 'workers': args.workers,
+               'threads': args.threads, 'modes': []}
+    for name, password_workers in (('inline', 0), ('pool', args.pool)):
+        result = run_mode(name, password_workers, workdir, headers, args)
+        results['modes'].append(result)
+        login, probe_busy = result['login_latency'], result['probe_during_storm']
+        print(f"{name:>6}: {result['seconds']:.1f}s, statuses {result['statuses']}")
+        if login:
+            print(f"        login p50 {login['p50_ms']:.0f} ms  p95 {login['p95_ms']:.0f} ms")
+        if probe_busy:
+            print(f"        probe p50 {probe_busy['p50_ms']:.0f} ms  p95 {probe_busy['p95_ms']:.0f} ms "
+                  f"(idle p50 {result['probe_idle']['p50_ms']:.0f} ms)")
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
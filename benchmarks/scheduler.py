@@ -0,0 +1,128 @@
+"""
+Measure the repair scheduler on a large backlog of open reports.
+
+Workshops and reports are clustered around the same cities (reports a
+little more spread out, trucks break down between towns). One scheduler
+run is timed phase by phase (load, plan, write), and the in-memory planner
+is timed on its own at several batch sizes. As a baseline, the first
+--baseline-reports reports are assigned one at a time the way a request
+handler would: nearest workshops from the spatial index, their open
+repair counts, one Repair row each; the baseline is rolled back.
+
+    python -m benchmarks.scheduler --workshops 2000 --reports 20000 --output scheduler.json
+"""
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from benchmarks.common import setup_app, create_driver, percentiles, write_results
+from benchmarks.workshops import CITIES, populate
+
+
+def populate_reports(app, driver_id, count, batch_size=10000, located_share=0.9, seed=3):
+    from extensions import db
+    from models import MaintenanceReport
+
+    rng = random.Random(seed)
+    start = datetime.utcnow() - timedelta(days=30)
+    with app.app_context():
+        for offset in range(0, count, batch_size):
+            rows = []
+            for i in range(offset, min(offset + batch_size, count)):
+                lat = lon = None
+                if rng.random() < located_share:
+                    lat, lon = rng.choice(CITIES)
+                    lat, lon = rng.gauss(lat, 0.6), rng.gauss(lon, 1.0)
+                reported = start + timedelta(seconds=i)
+                rows.append({'truck_id': f'TRK{i % 5000:04d}', 'issue_description': 'Brake warning light',
+                             'driver_id': driver_id, 'status': 'reported', 'reported_date': reported,
+                             'updated_at': reported, 'latitude': lat, 'longitude': lon})
+            db.session.execute(MaintenanceReport.__table__.insert(), rows)
+            db.session.commit()
+
+
+def one_at_a_time(app, count):
+    """Assign reports individually with per-report queries; returns per-report latencies"""
+    from extensions import db
+    from models import MaintenanceReport, Repair
+    from geo import nearest_workshops
+    from scheduler import OPEN_REPAIR_STATUSES
+
+    config = app.config
+    samples = []
+    with app.app_context():
+        reports = (MaintenanceReport.query.filter(MaintenanceReport.latitude.isnot(None))
+                   .order_by(MaintenanceReport.reported_date).limit(count).all())
+        for report in reports:
+            start = time.perf_counter()
+            best = None
+            for workshop, distance in nearest_workshops(report.latitude, report.longitude,
+                                                        config['SCHEDULER_CANDIDATES'],
+                                                        config['SCHEDULER_MAX_DISTANCE_KM']):
+                queue = Repair.query.filter(Repair.workshop_id == workshop.id,
+                                            Repair.status.in_(OPEN_REPAIR_STATUSES)).count()
+                if queue >= workshop.capacity:
+                    continue
+                cost = distance + config['SCHEDULER_QUEUE_KM'] * (queue + 1) / workshop.capacity
+                if best is None or cost < best[0]:
+                    best = (cost, workshop.id)
+            if best:
+                db.session.add(Repair(report_id=report.id, workshop_id=best[1], status='pending'))
+                db.session.flush()
+            samples.append(time.perf_counter() - start)
+        db.session.rollback()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workshops', type=int, default=2000)
+    parser.add_argument('--reports', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--baseline-reports', type=int, default=200)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    app, workdir = setup_app(SCHEDULER_BATCH_SIZE=args.batch_size)
+    driver_id, _ = create_driver(app)
+    started = time.perf_counter()
+    populate(app, args.workshops)
+    populate_reports(app, driver_id, args.reports)
+    print(f"Inserted {args.workshops} workshops and {args.reports} reports "
+          f"in {time.perf_counter() - started:.1f}s ({workdir})")
+    results = {'workshops': args.workshops, 'reports': args.reports, 'batch_size': args.batch_size}
+
+    baseline = one_at_a_time(app, args.baseline_reports)
+    results['one_at_a_time'] = percentiles(baseline)
+    per_report = sum(baseline) / len(baseline)
+    print(f"one at a time: {per_report * 1000:.2f} ms per report, "
+          f"{per_report * args.batch_size:.1f}s for a batch of {args.batch_size}")
+
+    from scheduler import load_batch, plan_assignments, run_once
+    with app.app_context():
+        reports, workshops, open_counts = load_batch(args.reports)
+        results['plan'] = []
+        for size in (1000, 5000, 20000):
+            if size > len(reports):
+                continue
+            start = time.perf_counter()
+            plan = plan_assignments(reports[:size], workshops, open_counts)
+            elapsed = time.perf_counter() - start
+            results['plan'].append({'reports': size, 'ms': elapsed * 1000, 'assigned': plan.assigned,
+                                    'unassigned': len(plan.unassigned)})
+            print(f"plan {size:>5} reports: {elapsed * 1000:7.1f} ms "
+                  f"({plan.assigned} assigned, {len(plan.unassigned)} left over)")
+
+        results['runs'] = []
+        while True:
+            summary = run_once()
+            results['runs'].append(summary)
+            print(f"run: {summary['created']:>5} repairs written | load {summary['load_ms']:6.1f} ms  "
+                  f"plan {summary['plan_ms']:6.1f} ms  write {summary['write_ms']:6.1f} ms")
+            if not summary['created']:
+                break
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
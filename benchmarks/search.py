@@ -0,0 +1,130 @@
+"""
+Measure full-text search latency over a large synthetic report history.
+
+Reports (and repairs for a share of them) are inserted through the normal
+tables, so the search triggers index them exactly as in production. Each
+query is then sent to /api/search-reports --repeat times and latency
+percentiles are reported per query.
+
+    python -m benchmarks.search --reports 1000000 --output search.json
+"""
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from benchmarks.common import setup_app, create_driver, percentiles, write_results
+
+COMPONENTS = [
+    'brake', 'coolant', 'engine', 'tire', 'transmission', 'alternator', 'battery', 'headlight',
+    'exhaust', 'suspension', 'clutch', 'radiator', 'fuel pump', 'wiper', 'mirror', 'door',
+    'starter', 'turbo', 'injector', 'axle', 'steering', 'hydraulic line', 'air compressor',
+    'trailer coupling', 'tachograph', 'seat', 'horn', 'fan belt', 'oil filter', 'dashboard',
+]
+SYMPTOMS = [
+    'leaking', 'making noise', 'squealing', 'warning light on', 'vibrating', 'overheating',
+    'not working', 'worn out', 'cracked', 'loose', 'intermittent fault', 'smells burnt',
+    'slow to respond', 'stuck', 'grinding',
+]
+LOCATIONS = ['front left', 'front right', 'rear left', 'rear right', 'cab', 'trailer', 'underside']
+REPAIR_NOTES = [
+    'replaced {c}', 'tightened {c} fittings', 'topped up fluids and checked {c}',
+    'ordered new {c}, temporary fix applied', 'no fault found on {c}', 'cleaned {c} contacts',
+]
+
+QUERIES = [
+    ('common term', {'q': 'brake'}),
+    ('two terms', {'q': 'coolant leak'}),
+    ('short prefix', {'q': 'trans'}),
+    ('rare fault code', {'q': 'P0420'}),
+    ('repair notes', {'q': 'temporary fix'}),
+    ('newest first', {'q': 'brake', 'sort': 'recent'}),
+    ('with truck filter', {'q': 'engine', 'truck_id': 'TRK0042'}),
+]
+
+
+def describe(rng):
+    text = f"{rng.choice(COMPONENTS)} {rng.choice(SYMPTOMS)} {rng.choice(LOCATIONS)}"
+    if rng.random() < 0.05:
+        text += f" code P{rng.randint(0, 1999):04d}"
+    return text.capitalize()
+
+
+def populate(app, driver_id, count, batch_size=10000, repair_share=0.3, seed=1):
+    """Insert count reports, and repairs with notes for repair_share of them"""
+    from extensions import db
+    from models import MaintenanceReport, Repair, Workshop
+
+    rng = random.Random(seed)
+    start = datetime(2022, 1, 1)
+    with app.app_context():
+        workshop = Workshop(name='Bench Workshop')
+        db.session.add(workshop)
+        db.session.commit()
+        report_id = 0
+        for offset in range(0, count, batch_size):
+            reports, repairs = [], []
+            for _ in range(min(batch_size, count - offset)):
+                report_id += 1
+                reports.append({
+                    'id': report_id,
+                    'truck_id': f'TRK{rng.randint(0, 4999):04d}',
+                    'issue_description': describe(rng),
+                    'driver_id': driver_id,
+                    'status': rng.choice(['reported', 'in_progress', 'completed']),
+                    'reported_date': start + timedelta(minutes=rng.randint(0, 3 * 365 * 24 * 60)),
+                })
+                if rng.random() < repair_share:
+                    repairs.append({
+                        'report_id': report_id,
+                        'workshop_id': workshop.id,
+                        'notes': rng.choice(REPAIR_NOTES).format(c=rng.choice(COMPONENTS)),
+                        'status': 'completed',
+                    })
+            db.session.execute(MaintenanceReport.__table__.insert(), reports)
+            if repairs:
+                db.session.execute(Repair.__table__.insert(), repairs)
+            db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reports', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    app, workdir = setup_app()
+    driver_id, _ = create_driver(app)
+
+    started = time.perf_counter()
+    populate(app, driver_id, args.reports)
+    with app.app_context():
+        from extensions import db
+        # Same as after a large backfill: merge the index into one segment
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO report_search (report_search) VALUES ('optimize')")
+    load_seconds = time.perf_counter() - started
+    print(f"Indexed {args.reports} reports in {load_seconds:.1f}s ({workdir})")
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = driver_id
+    results = {'reports': args.reports, 'load_seconds': load_seconds, 'queries': []}
+    for name, params in QUERIES:
+        params = dict(params, per_page=args.per_page)
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            rv = client.get('/api/search-reports', query_string=params)
+            samples.append(time.perf_counter() - start)
+            assert rv.status_code == 200, rv.get_json()
+        latency = percentiles(samples)
+        hits = len(rv.get_json()['data'])
+        results['queries'].append({'name': name, 'params': params, 'hits': hits, 'latency': latency})
+        print(f"{name:>18}: p50 {latency['p50_ms']:6.1f} ms  p95 {latency['p95_ms']:6.1f} ms  ({hits} hits)")
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
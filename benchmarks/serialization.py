@@ -0,0 +1,161 @@
+"""
+Measure the time to serialize pages of reports into a JSON response body.
+
+--reports reports (with repairs for a share of them) are loaded once the
+way the listing and detail endpoints load them. Each round turns them into
+a response body with the hand-written dicts and Flask's standard library
+encoder the endpoints used before ("before"), with the schemas of
+serializers.py and JSONProvider on the standard library ("schema"), and
+with the schemas on orjson when it is installed ("after"). The resulting
+bodies are checked to hold the same data, and the gzip and brotli sizes and
+compression times of the listing body are reported.
+
+    python -m benchmarks.serialization --reports 10000 --repeat 20 --output serialization.json
+"""
+import json
+import time
+import argparse
+from flask.json.provider import DefaultJSONProvider
+from benchmarks.common import setup_app, create_driver, percentiles, write_results
+from benchmarks.search import populate
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def legacy_summary(report):
+    """The report summary dict as the endpoints built it by hand before serializers.Schema"""
+    return {
+        'id': report.id,
+        'truck_id': report.truck_id,
+        'issue_description': report.issue_description,
+        'reported_date': _isoformat(report.reported_date),
+        'status': report.status,
+        'driver_id': report.driver_id,
+        'image_url': report.image_url,
+        'thumbnail_url': (report.image_renditions or {}).get('thumb'),
+        'image_status': report.image_status,
+        'latitude': report.latitude,
+        'longitude': report.longitude,
+        'updated_at': _isoformat(report.updated_at)
+    }
+
+
+def legacy_repair(repair):
+    workshop = repair.workshop
+    return {
+        'id': repair.id,
+        'report_id': repair.report_id,
+        'workshop_id': repair.workshop_id,
+        'workshop_name': workshop.name if workshop else None,
+        'workshop': {
+            'id': workshop.id,
+            'name': workshop.name,
+            'location': workshop.location,
+            'contact': workshop.contact,
+            'latitude': workshop.latitude,
+            'longitude': workshop.longitude
+        } if workshop else None,
+        'start_date': _isoformat(repair.start_date),
+        'end_date': _isoformat(repair.end_date),
+        'status': repair.status,
+        'notes': repair.notes,
+        'created_at': _isoformat(repair.created_at),
+        'updated_at': _isoformat(repair.updated_at)
+    }
+
+
+def legacy_detail(report):
+    data = legacy_summary(report)
+    data['image_renditions'] = report.image_renditions
+    data['driver_name'] = report.driver.name if report.driver else 'Unknown'
+    data['repairs'] = [legacy_repair(repair) for repair in report.repairs]
+    return data
+
+
+def time_rounds(render, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = render()
+        samples.append(time.perf_counter() - start)
+    return samples, body
+
+
+def without_orjson(render):
+    """render with JSONProvider falling back to the standard library"""
+    import serializers
+
+    def wrapper():
+        orjson, serializers.orjson = serializers.orjson, None
+        try:
+            return render()
+        finally:
+            serializers.orjson = orjson
+    return wrapper
+
+
+def compression(body, repeat):
+    """Compressed size and time of body per available encoding at the configured levels"""
+    from flask import current_app
+    from compression import available_encodings, compress
+
+    rows = []
+    for encoding in available_encodings():
+        samples, compressed = time_rounds(lambda: compress(body, encoding, current_app.config), repeat)
+        latency = percentiles(samples)
+        rows.append({'encoding': encoding, 'bytes': len(compressed), 'ratio': len(body) / len(compressed),
+                     'latency': latency})
+        print(f"{'':>17}{encoding:>6}: p50 {latency['p50_ms']:7.1f} ms  {'':>15}{len(compressed) / 1024:7.0f} KiB "
+              f"({len(body) / len(compressed):.1f}x smaller)")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reports', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    app, workdir = setup_app()
+    driver_id, _ = create_driver(app)
+    populate(app, driver_id, args.reports)
+
+    import serializers
+    from models import MaintenanceReport
+    from serializers import REPORT_DETAIL_OPTIONS, REPORT_LIST_OPTIONS, JSONProvider, report_detail, report_summary
+
+    before, after = DefaultJSONProvider(app), JSONProvider(app)
+    results = {'reports': args.reports, 'orjson': serializers.orjson is not None, 'shapes': []}
+    shapes = (
+        ('summary', REPORT_LIST_OPTIONS, legacy_summary, report_summary),
+        ('detail', REPORT_DETAIL_OPTIONS, legacy_detail, report_detail),
+    )
+    with app.app_context():
+        for shape, options, legacy, current in shapes:
+            reports = MaintenanceReport.query.options(*options).limit(args.reports).all()
+
+            def render(provider, serialize):
+                return lambda: provider.response({'data': [serialize(r) for r in reports]}).get_data()
+
+            encoders = [('before', render(before, legacy)), ('schema', without_orjson(render(after, current)))]
+            if serializers.orjson is not None:
+                encoders.append(('after', render(after, current)))
+            bodies, row = {}, {'shape': shape, 'reports': len(reports), 'encoders': []}
+            for name, encode in encoders:
+                samples, bodies[name] = time_rounds(encode, args.repeat)
+                latency = percentiles(samples)
+                row['encoders'].append({'name': name, 'latency': latency, 'bytes': len(bodies[name])})
+                print(f"{shape:>7} x {len(reports)} {name:>6}: p50 {latency['p50_ms']:7.1f} ms  "
+                      f"p95 {latency['p95_ms']:7.1f} ms  {len(bodies[name]) / 1024:7.0f} KiB")
+            expected = json.loads(bodies['before'])
+            assert all(json.loads(body) == expected for body in bodies.values()), 'encoders disagree'
+            row['compression'] = compression(bodies[encoders[-1][0]], max(3, args.repeat // 4))
+            results['shapes'].append(row)
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Measure the concurrency one gunicorn worker sustains in the threaded
+(gthread) and the green (gevent, see green.py) serving mode.
+
+Each mode runs as a single worker on a fresh copy of the same fleet (pass
+--fleet DIR, or one of --drivers and --reports is generated first). Every
+SQL statement waits --db-latency-ms before it runs, standing in for the
+round trip to a database server; 0 measures plain SQLite.
+
+For each of --concurrency, that many clients (each a random fleet driver)
+list their reports, open one of them and, for --upload-share of the
+requests, file a report with a photo, for --duration seconds. Then
+--streams clients open event streams (/api/v1/events) and keep them open
+while --stream-clients clients repeat the mix: a threaded worker spends a
+thread per stream, a green one a greenlet. Requests that fail or take
+longer than --timeout seconds count as errors.
+
+    python -m benchmarks.serving --fleet /tmp/fleet --concurrency 8 32 128 --streams 200 --output serving.json
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+import requests
+from benchmarks.common import setup_app, percentiles, write_results
+from benchmarks.fleet import load_manifest
+from benchmarks.load import make_photos, prepare_fleet
+from benchmarks.search import describe
+
+# Worker classes, chosen through gunicorn.conf.py so preloading follows
+MODES = {
+    'threaded': 'gthread',
+    'green': 'gevent',
+}
+
+
+def bench_app(workdir, db_latency_ms):
+    """gunicorn app factory: the run's copy of the fleet, each statement db_latency_ms late"""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    app, _ = setup_app(workdir, IMAGE_WORKERS=1, PASSWORD_WORKERS=1, EVENT_MAX_SUBSCRIBERS=100000,
+                       METRICS_DIR=os.path.join(workdir, 'metrics'),
+                       EVENT_SOCKET_DIR=os.path.join(workdir, 'events'))
+    if db_latency_ms:
+        delay = db_latency_ms / 1000
+
+        @event.listens_for(Engine, 'before_cursor_execute')
+        def round_trip(conn, cursor, statement, parameters, context, executemany):
+            # A plain sleep: it yields under gevent like a socket wait would
+            time.sleep(delay)
+    return app
+
+
+def start_server(workdir, mode, args):
+    factory = f"benchmarks.serving:bench_app({workdir!r}, {args.db_latency_ms!r})"
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', factory, '--bind', f'127.0.0.1:{args.port}', '--workers', '1',
+         '--threads', str(args.threads), '--worker-connections', '10000', '--timeout', '120'],
+        env=dict(os.environ, GUNICORN_WORKER_CLASS=MODES[mode]), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline and server.poll() is None:
+        try:
+            requests.get(f'http://127.0.0.1:{args.port}/login', timeout=5)
+            return server
+        except requests.RequestException:
+            time.sleep(0.2)
+    server.terminate()
+    server.wait()
+    raise RuntimeError(f"gunicorn ({mode}) did not start on port {args.port}")
+
+
+def driver_tokens(app, count, seed):
+    """Auth headers for count random fleet drivers, signed with the server's JWT key"""
+    from flask_jwt_extended import create_access_token
+    from extensions import db
+    from models import Driver
+
+    with app.app_context():
+        ids = [driver_id for (driver_id,) in db.session.query(Driver.id)]
+        rng = random.Random(seed)
+        return [{'Authorization': f'Bearer {create_access_token(identity=rng.choice(ids))}'}
+                for _ in range(count)]
+
+
+def run_client(base, headers, photos, seed, args, deadline, samples, statuses):
+    rng = random.Random(seed)
+    session = requests.Session()
+    report_ids = []
+    while time.monotonic() < deadline:
+        roll = rng.random()
+        start = time.perf_counter()
+        try:
+            if roll < args.upload_share:
+                with open(rng.choice(photos), 'rb') as photo:
+                    rv = session.post(f'{base}/api/v1/reports', headers=headers, timeout=args.timeout,
+                                      data={'truck_id': f'TRK{rng.randrange(100000):05d}',
+                                            'issue_description': describe(rng)},
+                                      files={'image': ('photo.jpg', photo, 'image/jpeg')})
+            elif report_ids and roll < args.upload_share + 0.4:
+                rv = session.get(f'{base}/api/v1/reports/{rng.choice(report_ids)}', headers=headers,
+                                 timeout=args.timeout)
+            else:
+                rv = session.get(f'{base}/api/v1/reports', headers=headers, params={'per_page': 20},
+                                 timeout=args.timeout)
+                if rv.status_code == 200:
+                    report_ids = [report['id'] for report in rv.json()['data']] or report_ids
+        except requests.RequestException as e:
+            statuses[type(e).__name__] += 1
+            continue
+        statuses[rv.status_code] += 1
+        if rv.status_code < 400:
+            samples.append(time.perf_counter() - start)
+
+
+def measure(base, tokens, photos, clients, duration, args, seed):
+    samples, statuses = [], Counter()
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=run_client, args=(base, tokens[i % len(tokens)], photos, seed + i, args,
+                                                          deadline, samples, statuses))
+               for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    errors = sum(n for status, n in statuses.items() if not isinstance(status, int) or status >= 400)
+    return {
+        'clients': clients,
+        'requests': len(samples),
+        'throughput_rps': len(samples) / seconds,
+        'errors': errors,
+        'statuses': {str(status): n for status, n in statuses.items()},
+        'latency': percentiles(samples) if samples else None,
+    }
+
+
+def hold_stream(base, headers, args, opened, stop):
+    """Open an event stream, count it once its first bytes arrive, and hold it until stop"""
+    try:
+        with requests.get(f'{base}/api/v1/events', headers=headers, stream=True,
+                          timeout=(args.timeout, args.duration + 30)) as rv:
+            if rv.status_code == 200 and next(rv.iter_content(chunk_size=None), None):
+                opened.append(1)
+                stop.wait()
+    except requests.RequestException:
+        pass
+
+
+def run_mode(mode, fleet, args):
+    workdir = tempfile.mkdtemp(prefix=f'serepairs-serving-{mode}-')
+    shutil.copyfile(os.path.join(fleet, 'bench.db'), os.path.join(workdir, 'bench.db'))
+    app, _ = setup_app(workdir)
+    photos = make_photos(workdir, args.photo_kb)
+    tokens = driver_tokens(app, max(args.concurrency + [args.streams, args.stream_clients]), args.seed)
+    server = start_server(workdir, mode, args)
+    base = f'http://127.0.0.1:{args.port}'
+    rows = []
+    try:
+        # Warm up: imports, pools and the first connections
+        measure(base, tokens, photos, 2, 2, args, args.seed)
+        for clients in args.concurrency:
+            row = measure(base, tokens, photos, clients, args.duration, args, args.seed)
+            rows.append(row)
+            report(mode, f'{clients} clients', row)
+
+        opened, stop = [], threading.Event()
+        holders = [threading.Thread(target=hold_stream, args=(base, tokens[i], args, opened, stop), daemon=True)
+                   for i in range(args.streams)]
+        for holder in holders:
+            holder.start()
+        time.sleep(min(args.timeout, 5))
+        streams = measure(base, tokens, photos, args.stream_clients, args.duration, args, args.seed + 1)
+        streams['streams_requested'] = args.streams
+        streams['streams_open'] = len(opened)
+        report(mode, f'{len(opened)}/{args.streams} streams + {args.stream_clients}', streams)
+        stop.set()
+    finally:
+        server.terminate()
+        server.wait()
+    return {'mode': mode, 'sweep': rows, 'streams': streams}
+
+
+def report(mode, label, row):
+    latency = row['latency']
+    timing = (f"p50 {latency['p50_ms']:7.1f} ms  p99 {latency['p99_ms']:7.1f} ms" if latency
+              else f"{'no successful requests':>30}")
+    print(f"{mode:>8} {label:>28}: {row['throughput_rps']:6.1f} req/s  {timing}  {row['errors']} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fleet', help='directory written by benchmarks.fleet')
+    parser.add_argument('--drivers', type=int, default=500)
+    parser.add_argument('--reports', type=int, default=20000)
+    parser.add_argument('--workshops', type=int, default=200)
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 32, 128])
+    parser.add_argument('--streams', type=int, default=200)
+    parser.add_argument('--stream-clients', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=8, help='threads of the threaded worker')
+    parser.add_argument('--db-latency-ms', type=float, default=2)
+    parser.add_argument('--upload-share', type=float, default=0.05)
+    parser.add_argument('--photo-kb', type=int, default=300)
+    parser.add_argument('--duration', type=float, default=15, help='seconds per measurement')
+    parser.add_argument('--timeout', type=float, default=10, help='seconds before a request counts as failed')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=5058)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    if 'green' in args.modes:
+        try:
+            import gevent  # noqa: F401
+        except ImportError:
+            parser.error("the green mode needs gevent (pip install gevent)")
+    fleet = prepare_fleet(args)
+    print(f"One worker per mode, {args.threads} threads when threaded, "
+          f"{args.db_latency_ms:g} ms per statement, {args.duration:.0f}s per measurement")
+    results = {
+        'fleet': load_manifest(fleet),
+        'config': {name: value for name, value in vars(args).items() if name not in ('output', 'fleet')},
+        'modes': [run_mode(mode, fleet, args) for mode in args.modes],
+    }
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Measure how long a worker takes to start and what it costs in memory.
+
+Imports: `python -X importtime -c "import app"` is run --repeat times and
+the self time of every imported module is summed per top-level package
+(the app's own modules count one by one), with the app module that first
+imported it. Interpreter startup (site) is reported on its own.
+
+Cold start: fresh interpreters import app, build it with create_app and
+serve the first request (GET /login) through the test client, each phase
+timed, --repeat times.
+
+gunicorn: --workers gthread workers serve app:app as deployed (Procfile,
+gunicorn.conf.py), once building the app in every worker and once
+preloading it in the master. Reported are the seconds from launch to the
+first response and, after --warmup requests, the resident (RSS),
+proportional (PSS, shared pages split between the processes sharing them)
+and private memory of the master and each worker.
+
+    python -m benchmarks.startup --repeat 5 --workers 4 --output startup.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+import requests
+from benchmarks.common import setup_app, write_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_MODULES = {name[:-3] for name in os.listdir(ROOT) if name.endswith('.py')}
+
+COLD_START = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+built = time.perf_counter()
+with application.test_client() as client:
+    status = client.get('/login').status_code
+served = time.perf_counter()
+print(json.dumps({'status': status, 'import_ms': (imported - started) * 1000,
+                  'create_app_ms': (built - imported) * 1000, 'first_request_ms': (served - built) * 1000}))
+"""
+
+
+def server_env(workdir, **extra):
+    """The deployed configuration, on the benchmark's database"""
+    return dict(os.environ, FLASK_ENV='production', SECRET_KEY='benchmark',
+                DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+                METRICS_DIR=os.path.join(workdir, 'metrics'),
+                EVENT_SOCKET_DIR=os.path.join(workdir, 'events'), **extra)
+
+
+def parse_importtime(output):
+    """-X importtime lines as a forest of (name, self_us, children), in import order"""
+    pending = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        timing, _, name = line.split('|')
+        self_us = int(timing.split(':')[1])
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        children = []
+        while pending and pending[-1][0] > depth:
+            children.append(pending.pop()[1])
+        pending.append((depth, (name.strip(), self_us, children[::-1])))
+    return [node for _, node in pending]
+
+
+def import_costs(env):
+    """Milliseconds per package of one `import app`, and of interpreter startup"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+    costs, importers, startup_ms = defaultdict(float), {}, 0.0
+
+    def walk(node, importer, under_site):
+        nonlocal startup_ms
+        name, self_us, children = node
+        package = name.split('.')[0]
+        if under_site:
+            startup_ms += self_us / 1000
+        else:
+            costs[package] += self_us / 1000
+            importers.setdefault(package, importer)
+        for child in children:
+            walk(child, package if package in APP_MODULES else importer, under_site)
+
+    for root in parse_importtime(proc.stderr):
+        walk(root, None, root[0] == 'site')
+    return costs, importers, startup_ms
+
+
+def measure_imports(env, repeat):
+    runs = [import_costs(env) for _ in range(repeat)]
+    importers = runs[0][1]
+    packages = {package for costs, _, _ in runs for package in costs}
+    modules = [{'module': package,
+                'ms': statistics.median(costs.get(package, 0.0) for costs, _, _ in runs),
+                'app_module': package in APP_MODULES,
+                'imported_by': importers.get(package)}
+               for package in packages]
+    modules.sort(key=lambda row: -row['ms'])
+    return {
+        'interpreter_startup_ms': statistics.median(startup for _, _, startup in runs),
+        'import_app_ms': statistics.median(sum(costs.values()) for costs, _, _ in runs),
+        'modules': modules,
+    }
+
+
+def measure_cold_start(env, repeat):
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-c', COLD_START], cwd=ROOT, env=env,
+                              capture_output=True, text=True, check=True)
+        run = json.loads(proc.stdout.strip().splitlines()[-1])
+        run['process_ms'] = (time.perf_counter() - started) * 1000
+        runs.append(run)
+    return {key: statistics.median(run[key] for run in runs)
+            for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'process_ms')}
+
+
+def memory_kb(pid):
+    """Rss, Pss and private (Private_Clean + Private_Dirty) memory of a process in kB"""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {'rss_kb': fields['Rss'], 'pss_kb': fields['Pss'],
+            'private_kb': fields['Private_Clean'] + fields['Private_Dirty']}
+
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def measure_gunicorn(workdir, preload, args):
+    env = server_env(workdir, GUNICORN_WORKER_CLASS='gthread', GUNICORN_PRELOAD=str(preload))
+    base = f'http://127.0.0.1:{args.port}'
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{args.port}',
+         '--workers', str(args.workers)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        first_response = None
+        while time.perf_counter() - started < 60 and server.poll() is None:
+            try:
+                requests.get(f'{base}/login', timeout=5)
+                first_response = time.perf_counter() - started
+                break
+            except requests.RequestException:
+                time.sleep(0.02)
+        if first_response is None:
+            raise RuntimeError(f"gunicorn did not start on port {args.port}")
+        # Every worker has booted and served a few requests
+        while len(children(server.pid)) < args.workers and time.perf_counter() - started < 60:
+            time.sleep(0.1)
+        for _ in range(args.warmup):
+            requests.get(f'{base}/login', timeout=10)
+        workers = [memory_kb(pid) for pid in children(server.pid)]
+        master = memory_kb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        'preload': preload,
+        'first_response_s': first_response,
+        'master': master,
+        'workers': workers,
+        'worker_pss_kb': statistics.mean(worker['pss_kb'] for worker in workers),
+        'total_pss_kb': master['pss_kb'] + sum(worker['pss_kb'] for worker in workers),
+    }
+
+
+def report(results, top):
+    imports = results['imports']
+    print(f"Interpreter startup {imports['interpreter_startup_ms']:.1f} ms, "
+          f"import app {imports['import_app_ms']:.1f} ms; most expensive imports:")
+    for row in imports['modules'][:top]:
+        origin = 'app module' if row['app_module'] else f"imported by {row['imported_by'] or '-'}"
+        print(f"  {row['module']:>24} {row['ms']:7.1f} ms  {origin}")
+    cold = results['cold_start']
+    print(f"Cold start: import {cold['import_ms']:.0f} ms, create_app {cold['create_app_ms']:.0f} ms, "
+          f"first request {cold['first_request_ms']:.0f} ms, whole process {cold['process_ms']:.0f} ms")
+    for run in results['gunicorn']:
+        print(f"gunicorn {'preloaded' if run['preload'] else 'per worker':>10}: first response "
+              f"{run['first_response_s']:.2f} s, worker RSS {statistics.mean(w['rss_kb'] for w in run['workers']) / 1024:.1f} MB "
+              f"PSS {run['worker_pss_kb'] / 1024:.1f} MB private "
+              f"{statistics.mean(w['private_kb'] for w in run['workers']) / 1024:.1f} MB, "
+              f"all processes PSS {run['total_pss_kb'] / 1024:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='runs of the import and cold start measurements')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--warmup', type=int, default=20, help='requests before memory is read')
+    parser.add_argument('--top', type=int, default=15, help='imports listed')
+    parser.add_argument('--port', type=int, default=5059)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    _, workdir = setup_app()
+    env = server_env(workdir)
+    results = {
+        'config': {name: value for name, value in vars(args).items() if name != 'output'},
+        'imports': measure_imports(env, args.repeat),
+        'cold_start': measure_cold_start(env, args.repeat),
+        'gunicorn': [measure_gunicorn(workdir, preload, args) for preload in (False, True)],
+    }
+    report(results, args.top)
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
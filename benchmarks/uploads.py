@@ -0,0 +1,105 @@
+"""
+Compare report uploads sent as multipart/form-data against base64 in JSON.
+
+For each mode a fresh server process is started, the same photo is posted
+--requests times over HTTP, and the client-side latency and the server's
+peak RSS are reported (Linux only).
+
+    python -m benchmarks.uploads --size-mb 6 --requests 20 --output uploads.json
+"""
+import os
+import sys
+import time
+import base64
+import argparse
+import tempfile
+import subprocess
+import requests
+from benchmarks.common import setup_app, create_driver, percentiles, peak_rss_kb, write_results
+
+
+def make_photo(path, size_mb):
+    """Write a noisy JPEG of roughly size_mb, which compresses poorly like a real photo"""
+    from PIL import Image
+    side = int((size_mb * 1024 * 1024 / 1.2) ** 0.5)
+    Image.effect_noise((side, side), 64).convert('RGB').save(path, 'JPEG', quality=95)
+    return os.path.getsize(path)
+
+
+def serve(port, workdir):
+    from werkzeug.serving import make_server
+    # Keep image processing off the request path, as in production
+    app, _ = setup_app(workdir, IMAGE_WORKERS=1)
+    _, headers = create_driver(app)
+    server = make_server('127.0.0.1', port, app, threaded=False)
+    print(f"READY {headers['Authorization']}", flush=True)
+    server.serve_forever()
+
+
+def run_mode(mode, photo_path, count, port):
+    workdir = tempfile.mkdtemp(prefix=f'serepairs-upload-{mode}-')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.uploads', '--serve', str(port), workdir],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    try:
+        line = server.stdout.readline().strip()
+        if not line.startswith('READY '):
+            raise RuntimeError(f"Server failed to start: {line}")
+        headers = {'Authorization': line[len('READY '):]}
+        url = f'http://127.0.0.1:{port}/api/v1/reports'
+        idle_rss = peak_rss_kb(server.pid)
+        samples = []
+        for i in range(count):
+            fields = {'truck_id': f'TRK{i}', 'issue_description': 'Benchmark upload'}
+            with open(photo_path, 'rb') as photo:
+                start = time.perf_counter()
+                if mode == 'multipart':
+                    rv = requests.post(url, headers=headers, data=fields,
+                                       files={'image': ('photo.jpg', photo, 'image/jpeg')})
+                else:
+                    fields['image'] = 'data:image/jpeg;base64,' + base64.b64encode(photo.read()).decode()
+                    start = time.perf_counter()
+                    rv = requests.post(url, headers=headers, json=fields)
+                samples.append(time.perf_counter() - start)
+            rv.raise_for_status()
+        return {
+            'mode': mode,
+            'latency': percentiles(samples),
+            'idle_rss_kb': idle_rss,
+            'peak_rss_kb': peak_rss_kb(server.pid),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=4)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--output')
+    parser.add_argument('--serve', nargs=2, metavar=('PORT', 'WORKDIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(int(args.serve[0]), args.serve[1])
+
+    photo_path = os.path.join(tempfile.mkdtemp(prefix='serepairs-photo-'), 'photo.jpg')
+    size = make_photo(photo_path, args.size_mb)
+    print(f"Photo: {size / 1024 / 1024:.1f} MB, {args.requests} uploads per mode")
+
+    results = {'photo_bytes': size, 'modes': []}
+    for mode in ('multipart', 'base64'):
+        result = run_mode(mode, photo_path, args.requests, args.port)
+        results['modes'].append(result)
+        latency = result['latency']
+        print(f"{mode:>9}: p50 {latency['p50_ms']:.1f} ms  p95 {latency['p95_ms']:.1f} ms  "
+              f"peak RSS {result['peak_rss_kb'] / 1024:.1f} MB "
+              f"(+{(result['peak_rss_kb'] - result['idle_rss_kb']) / 1024:.1f} MB over idle)")
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
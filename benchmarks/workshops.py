@@ -0,0 +1,115 @@
+"""
+Measure the nearest-workshop lookup over a large synthetic workshop table.
+
+Workshops are clustered around cities, as garages are, with a sparse
+scattering in between, and inserted through the workshop table so the
+spatial index triggers run as in production. For random truck positions
+the spatially indexed lookup is timed against a full scan ranking every
+workshop by haversine distance, the results are checked to be identical,
+and GET /api/v1/workshops/nearest is timed end to end.
+
+    python -m benchmarks.workshops --workshops 100000 --output workshops.json
+"""
+import time
+import random
+import argparse
+from benchmarks.common import setup_app, create_driver, percentiles, write_results
+
+# (lat, lon) of cities the workshops cluster around
+CITIES = [
+    (59.33, 18.07), (57.71, 11.97), (55.60, 13.00), (59.91, 10.75), (55.68, 12.57),
+    (60.17, 24.94), (52.52, 13.40), (53.55, 9.99), (48.14, 11.58), (50.11, 8.68),
+    (52.37, 4.90), (50.85, 4.35), (48.86, 2.35), (45.76, 4.84), (51.51, -0.13),
+    (53.48, -2.24), (40.42, -3.70), (41.39, 2.17), (45.46, 9.19), (41.90, 12.50),
+    (52.23, 21.01), (50.08, 14.44), (48.21, 16.37), (47.50, 19.04), (44.43, 26.10),
+]
+# Box the scattered workshops and the truck positions are drawn from
+REGION = ((36.0, 70.0), (-10.0, 30.0))
+
+
+def populate(app, count, batch_size=10000, city_share=0.8, seed=1):
+    from extensions import db
+    from models import Workshop
+
+    rng = random.Random(seed)
+    with app.app_context():
+        for offset in range(0, count, batch_size):
+            rows = []
+            for i in range(offset, min(offset + batch_size, count)):
+                if rng.random() < city_share:
+                    lat, lon = rng.choice(CITIES)
+                    lat, lon = rng.gauss(lat, 0.3), rng.gauss(lon, 0.5)
+                else:
+                    lat, lon = rng.uniform(*REGION[0]), rng.uniform(*REGION[1])
+                rows.append({'name': f'Workshop {i:06d}', 'location': f'Site {i}', 'contact': '555-0100',
+                             'latitude': lat, 'longitude': lon})
+            db.session.execute(Workshop.__table__.insert(), rows)
+            db.session.commit()
+
+
+def full_scan(lat, lon, limit):
+    """The unindexed baseline: rank every located workshop by distance"""
+    from extensions import db
+    from models import Workshop
+    from geo import haversine_km
+
+    rows = db.session.query(Workshop.id, Workshop.latitude, Workshop.longitude).filter(
+        Workshop.latitude.isnot(None), Workshop.longitude.isnot(None)
+    )
+    ranked = sorted((haversine_km(lat, lon, w_lat, w_lon), workshop_id) for workshop_id, w_lat, w_lon in rows)
+    return [workshop_id for _, workshop_id in ranked[:limit]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workshops', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--scan-queries', type=int, default=20, help='full scans to time (they are slow)')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    app, workdir = setup_app()
+    _, headers = create_driver(app)
+    started = time.perf_counter()
+    populate(app, args.workshops)
+    load_seconds = time.perf_counter() - started
+    print(f"Inserted {args.workshops} workshops in {load_seconds:.1f}s ({workdir})")
+
+    from geo import nearest_workshops
+    rng = random.Random(2)
+    points = [(rng.uniform(*REGION[0]), rng.uniform(*REGION[1])) for _ in range(args.queries)]
+    results = {'workshops': args.workshops, 'load_seconds': load_seconds, 'lookups': []}
+    client = app.test_client()
+    with app.app_context():
+        for limit in (1, 5, 50):
+            indexed, scanned, mismatches = [], [], 0
+            for i, (lat, lon) in enumerate(points):
+                start = time.perf_counter()
+                found = [workshop.id for workshop, _ in nearest_workshops(lat, lon, limit)]
+                indexed.append(time.perf_counter() - start)
+                if i < args.scan_queries:
+                    start = time.perf_counter()
+                    expected = full_scan(lat, lon, limit)
+                    scanned.append(time.perf_counter() - start)
+                    mismatches += found != expected
+            index_latency, scan_latency = percentiles(indexed), percentiles(scanned)
+            results['lookups'].append({'limit': limit, 'indexed': index_latency, 'full_scan': scan_latency,
+                                       'mismatches': mismatches})
+            print(f"nearest {limit:>2}: indexed p50 {index_latency['p50_ms']:6.2f} ms  "
+                  f"p95 {index_latency['p95_ms']:6.2f} ms | full scan p50 {scan_latency['p50_ms']:7.1f} ms "
+                  f"| {mismatches} mismatches")
+
+    samples = []
+    for lat, lon in points:
+        start = time.perf_counter()
+        rv = client.get('/api/v1/workshops/nearest', headers=headers, query_string={'lat': lat, 'lon': lon})
+        samples.append(time.perf_counter() - start)
+        assert rv.status_code == 200, rv.get_json()
+    results['endpoint'] = percentiles(samples)
+    print(f"GET /workshops/nearest: p50 {results['endpoint']['p50_ms']:.2f} ms  "
+          f"p95 {results['endpoint']['p95_ms']:.2f} ms")
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+Bulk report ingestion for fleet telematics gateways.
+
+Rows are validated as they are read and inserted with one executemany per
+chunk, each chunk in its own transaction, so a bad chunk never undoes the
+ones already committed. Every row carries an idempotency key (generated if
+the gateway sent none); keys already stored come back as 'duplicate' with
+the original report id, which makes resending a whole batch safe.
+"""
+import json
+import uuid
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from extensions import db
+from models import ArchivedReport, Driver, MaintenanceReport
+from pagination import REPORT_STATUSES
+from stats import StatsDelta
+from events import publish, report_event
+from geo import LocationError, parse_point
+
+MAX_KEY_LENGTH = 100
+
+
+def iter_ndjson(stream):
+    """Yield one parsed object (or a ValueError) per non-blank line"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f'Invalid JSON: {e}')
+
+
+def validate_row(row, default_driver_id):
+    """Return (values, errors) for one incoming report row"""
+    if isinstance(row, ValueError):
+        return None, [str(row)]
+    if not isinstance(row, dict):
+        return None, ['Row must be a JSON object']
+
+    errors = []
+    truck_id = row.get('truck_id')
+    if not isinstance(truck_id, str) or not truck_id.strip():
+        errors.append('truck_id is required')
+    elif len(truck_id) > 50:
+        errors.append('truck_id must be at most 50 characters')
+
+    issue_description = row.get('issue_description')
+    if not isinstance(issue_description, str) or not issue_description.strip():
+        errors.append('issue_description is required')
+
+    driver_id = row.get('driver_id', default_driver_id)
+    if not isinstance(driver_id, int) or isinstance(driver_id, bool):
+        errors.append('driver_id must be an integer')
+
+    status = row.get('status', 'reported')
+    if status not in REPORT_STATUSES:
+        errors.append(f'Invalid status: {status}')
+
+    reported_date = row.get('reported_date')
+    if reported_date is not None:
+        try:
+            reported_date = datetime.fromisoformat(reported_date)
+        except (TypeError, ValueError):
+            errors.append('reported_date must be an ISO 8601 date')
+
+    latitude, longitude = row.get('latitude'), row.get('longitude')
+    if latitude is not None or longitude is not None:
+        try:
+            latitude, longitude = parse_point(latitude, longitude)
+        except LocationError:
+            errors.append('latitude and longitude must be numbers within [-90, 90] and [-180, 180]')
+
+    key = row.get('idempotency_key')
+    if key is not None and (not isinstance(key, str) or not key or len(key) > MAX_KEY_LENGTH):
+        errors.append(f'idempotency_key must be a string of 1-{MAX_KEY_LENGTH} characters')
+
+    if errors:
+        return None, errors
+    return {
+        'truck_id': truck_id,
+        'issue_description': issue_description,
+        'driver_id': driver_id,
+        'status': status,
+        'reported_date': reported_date or datetime.utcnow(),
+        'latitude': latitude,
+        'longitude': longitude,
+        'idempotency_key': key or uuid.uuid4().hex,
+    }, []
+
+
+def submitted_key(row):
+    """The idempotency key a row was sent with, echoed in results it has no values for"""
+    return row.get('idempotency_key') if isinstance(row, dict) else None
+
+
+class BulkIngest:
+    """Accumulates validated rows and flushes them in chunked transactions"""
+
+    def __init__(self, default_driver_id, chunk_size):
+        self.default_driver_id = default_driver_id
+        self.chunk_size = chunk_size
+        self.results = []
+        self._chunk = []  # (result, values)
+        self._known_drivers = set()
+
+    def add(self, row):
+        result = {'index': len(self.results)}
+        self.results.append(result)
+        values, errors = validate_row(row, self.default_driver_id)
+        if errors:
+            result.update(idempotency_key=submitted_key(row), status='invalid', errors=errors)
+            return
+        # Every result carries the row's key, generated or sent, so clients
+        # can match results to rows by key as well as by index
+        result['idempotency_key'] = values['idempotency_key']
+        self._chunk.append((result, values))
+        if len(self._chunk) >= self.chunk_size:
+            self.flush()
+
+    def _check_drivers(self, chunk):
+        wanted = {values['driver_id'] for _, values in chunk} - self._known_drivers
+        if wanted:
+            found = db.session.query(Driver.id).filter(Driver.id.in_(wanted)).all()
+            self._known_drivers.update(driver_id for driver_id, in found)
+        valid = []
+        for result, values in chunk:
+            if values['driver_id'] in self._known_drivers:
+                valid.append((result, values))
+            else:
+                result.update(status='invalid', errors=[f"Unknown driver_id: {values['driver_id']}"])
+        return valid
+
+    def _split_duplicates(self, chunk):
+        keys = [values['idempotency_key'] for _, values in chunk]
+        existing = dict(
+            db.session.query(MaintenanceReport.idempotency_key, MaintenanceReport.id)
+            .filter(MaintenanceReport.idempotency_key.in_(keys)).all()
+        )
+        missing = [key for key in keys if key not in existing]
+        if missing:
+            # A retry can come after the report was archived
+            existing.update(
+                db.session.query(ArchivedReport.idempotency_key, ArchivedReport.id)
+                .filter(ArchivedReport.idempotency_key.in_(missing)).all()
+            )
+        fresh, seen = [], {}
+        for result, values in chunk:
+            key = values['idempotency_key']
+            if key in existing:
+                result.update(status='duplicate', report_id=existing[key])
+            elif key in seen:
+                # Repeated within this batch: resolved once the first copy is stored
+                seen[key].append(result)
+            else:
+                seen[key] = []
+                fresh.append((result, values))
+        return fresh, seen
+
+    def flush(self):
+        chunk, self._chunk = self._chunk, []
+        if not chunk:
+            return
+        try:
+            chunk = self._check_drivers(chunk)
+            fresh, repeats = self._split_duplicates(chunk)
+            if fresh:
+                db.session.execute(MaintenanceReport.__table__.insert(), [values for _, values in fresh])
+                # Core inserts skip the ORM flush hooks that maintain the stats
+                delta = StatsDelta()
+                for _, values in fresh:
+                    delta.add_report(values['status'], values['truck_id'], values['reported_date'])
+                delta.apply(db.session.connection())
+            ids = dict(
+                db.session.query(MaintenanceReport.idempotency_key, MaintenanceReport.id)
+                .filter(MaintenanceReport.idempotency_key.in_([v['idempotency_key'] for _, v in fresh])).all()
+            ) if fresh else {}
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.error(f"Bulk ingest chunk failed: {str(e)}")
+            for result, _ in chunk:
+                if 'status' not in result:
+                    result.update(status='error', errors=['Database error, retry this row'])
+            return
+        for result, values in fresh:
+            key = values['idempotency_key']
+            result.update(status='created', report_id=ids[key])
+            for repeat in repeats[key]:
+                repeat.update(status='duplicate', report_id=ids[key])
+        # Core inserts bypass the session hooks that announce new reports
+        publish([
+            report_event(ids[values['idempotency_key']], values['driver_id'], values['truck_id'],
+                         values['status'], kind='report.created')
+            for _, values in fresh
+        ])
+
+    def summary(self):
+        counts = {'received': len(self.results)}
+        for result in self.results:
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+        return counts
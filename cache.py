@@ -0,0 +1,405 @@
+"""
+Response cache for read-mostly endpoints.
+
+Views wrapped in @cached_response store their 200 responses keyed by
+endpoint, URL arguments, query string and, for per-driver data, the
+driver. While building a response a view tags it with the rows it shows
+(tag_response('report:7', 'workshop:2')). When a change to a report,
+repair, workshop or driver commits, exactly the entries carrying the
+affected tags are dropped; a read that raced the change is not stored,
+since every invalidation bumps a generation counter the store checks.
+
+RESPONSE_CACHE_BACKEND picks where entries live:
+
+- 'memory': a bounded LRU per worker process. The worker that made a
+  change sends its invalidations to the others over the event sockets in
+  EVENT_SOCKET_DIR (events.py), which each worker holding a memory cache
+  listens on. A datagram dropped on a full socket leaves that worker
+  serving its entries until RESPONSE_CACHE_TTL runs out.
+- 'sqlite': a SQLite file shared by every worker on the host, at
+  RESPONSE_CACHE_PATH (instance/response-cache.db by default; put it
+  under /dev/shm to keep it in shared memory).
+- 'none', or a 'module:Class' import path for another backend.
+
+The cache never fails a request: backend errors are logged and count as
+misses.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from functools import wraps
+from collections import OrderedDict, defaultdict
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from werkzeug.utils import import_string
+
+logger = logging.getLogger(__name__)
+
+# Response headers kept with a cached body; the rest are added per request
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control')
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class MemoryBackend:
+    """Bounded LRU of entries in this process, with a tag index for invalidation"""
+
+    # Other workers have their own entries, invalidations must reach them too
+    shared = False
+
+    def __init__(self, maxsize=2048, **options):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.tags = defaultdict(set)
+        self.lock = threading.Lock()
+        self._generation = 0
+
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            expires, entry, _ = item
+            if expires <= now:
+                self._drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, tags, ttl, generation):
+        with self.lock:
+            if generation != self._generation:
+                return False
+            self._drop(key)
+            self.entries[key] = (time.time() + ttl, entry, tags)
+            for tag in tags:
+                self.tags[tag].add(key)
+            while len(self.entries) > self.maxsize:
+                self._drop(next(iter(self.entries)))
+            return True
+
+    def invalidate(self, tags):
+        with self.lock:
+            self._generation += 1
+            keys = set().union(*(self.tags.get(tag, ()) for tag in tags))
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def _drop(self, key):
+        item = self.entries.pop(key, None)
+        if item is None:
+            return
+        for tag in item[2]:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def size(self):
+        return len(self.entries)
+
+
+class SqliteBackend:
+    """Entries in a SQLite file shared by all workers on the host"""
+
+    shared = True
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, status INTEGER, "
+        "headers TEXT, body BLOB, expires REAL, stored REAL)",
+        "CREATE INDEX IF NOT EXISTS ix_entries_stored ON entries (stored)",
+        "CREATE TABLE IF NOT EXISTS entry_tags (tag TEXT, key TEXT, PRIMARY KEY (tag, key)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS ix_entry_tags_key ON entry_tags (key)",
+        "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)",
+        "INSERT OR IGNORE INTO meta VALUES ('generation', 0)",
+    ]
+
+    def __init__(self, path, maxsize=2048, **options):
+        self.path = path
+        self.maxsize = maxsize
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=2, isolation_level=None, check_same_thread=False)
+        # Losing the cache in a crash is harmless
+        conn.execute("PRAGMA synchronous = OFF")
+        return conn
+
+    @property
+    def conn(self):
+        conn = getattr(self.local, 'conn', None)
+        # One connection per thread, and a new one after fork
+        if conn is None or self.local.pid != os.getpid():
+            conn = self.local.conn = self._connect()
+            self.local.pid = os.getpid()
+        return conn
+
+    def generation(self):
+        return self.conn.execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()[0]
+
+    def get(self, key):
+        row = self.conn.execute(
+            "SELECT status, headers, body FROM entries WHERE key = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return {'status': row[0], 'headers': json.loads(row[1]), 'body': row[2]}
+
+    def set(self, key, entry, tags, ttl, generation):
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.generation() != generation:
+                return False
+            now = time.time()
+            conn.execute("DELETE FROM entry_tags WHERE key = ?", (key,))
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (key, entry['status'], json.dumps(entry['headers']), entry['body'], now + ttl, now)
+            )
+            conn.executemany("INSERT OR IGNORE INTO entry_tags VALUES (?, ?)", [(tag, key) for tag in tags])
+            excess = conn.execute("SELECT count(*) FROM entries").fetchone()[0] - self.maxsize
+            if excess > 0:
+                # Evict the oldest tenth at once so most stores skip this
+                self._delete(conn, "SELECT key FROM entries ORDER BY stored LIMIT ?",
+                             (max(excess, self.maxsize // 10),))
+            return True
+        finally:
+            conn.execute("COMMIT")
+
+    def invalidate(self, tags):
+        conn = self.conn
+        marks = ', '.join('?' * len(tags))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE meta SET value = value + 1 WHERE name = 'generation'")
+            return self._delete(conn, f"SELECT key FROM entry_tags WHERE tag IN ({marks})", tuple(tags))
+        finally:
+            conn.execute("COMMIT")
+
+    def _delete(self, conn, select, params):
+        keys = [(key,) for key, in conn.execute(select, params).fetchall()]
+        conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+        conn.executemany("DELETE FROM entry_tags WHERE key = ?", keys)
+        return len(keys)
+
+    def size(self):
+        return self.conn.execute("SELECT count(*) FROM entries").fetchone()[0]
+
+
+BACKENDS = {'memory': MemoryBackend, 'sqlite': SqliteBackend}
+
+
+class ResponseCache:
+    """A backend plus the TTL and this process's hit and miss counters"""
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        self.pid = os.getpid()
+        self.hits = self.misses = self.stores = self.invalidations = self.errors = 0
+
+    def _call(self, method, *args, default=None):
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Response cache {method} failed: {e}")
+            return default
+
+    def get(self, key):
+        entry = self._call('get', key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def generation(self):
+        return self._call('generation')
+
+    def set(self, key, entry, tags, generation):
+        if generation is not None and self._call('set', key, entry, sorted(tags), self.ttl, generation):
+            self.stores += 1
+
+    def invalidate(self, tags):
+        if tags:
+            self.invalidations += self._call('invalidate', sorted(tags), default=0)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'size': self._call('size'),
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+            'stores': self.stores,
+            'invalidated': self.invalidations,
+            'errors': self.errors,
+        }
+
+
+def get_cache(app=None):
+    """The response cache of this process, or None when disabled"""
+    global _cache
+    app = app or current_app._get_current_object()
+    name = app.config.get('RESPONSE_CACHE_BACKEND', 'memory')
+    if not name or name == 'none':
+        return None
+    with _cache_lock:
+        if _cache is None or _cache.pid != os.getpid():
+            backend_class = BACKENDS.get(name) or import_string(name.replace(':', '.'))
+            path = app.config.get('RESPONSE_CACHE_PATH') or os.path.join(app.instance_path, 'response-cache.db')
+            backend = backend_class(path=path, maxsize=app.config.get('RESPONSE_CACHE_SIZE', 2048))
+            _cache = ResponseCache(backend, app.config.get('RESPONSE_CACHE_TTL', 300))
+            if not getattr(backend, 'shared', False):
+                from events import get_bus
+                get_bus(app).listen()
+        return _cache
+
+
+def tag_response(*tags):
+    """Mark the response being built as showing these rows"""
+    tags_seen = g.get('response_cache_tags')
+    if tags_seen is not None:
+        tags_seen.update(tags)
+
+
+def report_tags(report):
+    """Tags for a report serialized with its driver, repairs and workshops"""
+    tags = [f'report:{report.id}', f'driver:{report.driver_id}']
+    if report.image_hash:
+        tags.append(f'image:{report.image_hash}')
+    tags += [f'workshop:{repair.workshop_id}' for repair in report.repairs]
+    return tags
+
+
+def _cache_key(identity):
+    args = sorted(request.args.items(multi=True))
+    view_args = sorted((request.view_args or {}).items())
+    return json.dumps([request.endpoint, view_args, args, identity], default=str)
+
+
+def _cached(entry):
+    response = current_app.response_class(entry['body'], status=entry['status'], headers=entry['headers'])
+    response.headers['X-Cache'] = 'HIT'
+    # Answer If-None-Match / If-Modified-Since without touching the database
+    return response.make_conditional(request)
+
+
+def cached_response(identity=None):
+    """
+    Cache a GET view's 200 responses. identity is a callable returning the
+    driver the response belongs to; leave it out for data shared by all.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            if cache is None or request.method != 'GET':
+                return view(*args, **kwargs)
+            key = _cache_key(identity() if identity else None)
+            entry = cache.get(key)
+            if entry is not None:
+                return _cached(entry)
+            generation = cache.generation()
+            g.response_cache_tags = set()
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                headers = {name: response.headers[name] for name in STORED_HEADERS if name in response.headers}
+                entry = {'status': 200, 'headers': headers, 'body': response.get_data()}
+                cache.set(key, entry, g.response_cache_tags, generation)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate(*tags):
+    """Drop cached responses carrying any of tags, e.g. after a bulk UPDATE"""
+    cache = get_cache()
+    if cache is None:
+        return
+    tags = set(tags)
+    cache.invalidate(tags)
+    if tags and not getattr(cache.backend, 'shared', False):
+        from events import get_bus
+        try:
+            get_bus().invalidate(tags)
+        except Exception as e:
+            # The change is committed; the other workers catch up at the TTL
+            logger.error(f"Failed to send {len(tags)} cache invalidation(s) to other workers: {e}")
+
+
+def invalidate_local(tags):
+    """Drop tags from this process's cache only, as sent by another worker"""
+    cache = _cache
+    # Nothing is cached yet in this process
+    if cache is not None and cache.pid == os.getpid():
+        cache.invalidate(set(tags))
+
+
+def _changed_tags(obj):
+    from models import Driver, MaintenanceReport, Repair, Workshop
+    if isinstance(obj, MaintenanceReport):
+        return [f'report:{obj.id}']
+    if isinstance(obj, Repair):
+        # A repair moved to another report changes both
+        moved_from = inspect(obj).attrs.report_id.history.deleted
+        return [f'report:{report_id}' for report_id in [obj.report_id, *moved_from] if report_id]
+    if isinstance(obj, Workshop):
+        return [f'workshop:{obj.id}', 'workshops']
+    if isinstance(obj, Driver):
+        return [f'driver:{obj.id}']
+    return []
+
+
+def _collect(session, flush_context):
+    tags = session.info.setdefault('response_cache_tags', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        tags.update(_changed_tags(obj))
+
+
+def _invalidate(session):
+    if session.in_nested_transaction():
+        return
+    tags = session.info.pop('response_cache_tags', None)
+    # The backend is chosen by app config; sessions always commit inside an
+    # app context, scripts working on raw connections are not cached anyway
+    if tags and has_app_context():
+        invalidate(*tags)
+
+
+def _discard(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('response_cache_tags', None)
+
+
+def init_cache():
+    """Invalidate cached responses once changes to the rows they show commit"""
+    if event.contains(Session, 'after_flush', _collect):
+        return
+    event.listen(Session, 'after_flush', _collect)
+    event.listen(Session, 'after_commit', _invalidate)
+    event.listen(Session, 'after_soft_rollback', _discard)
@@ -0,0 +1,63 @@
+"""
+Negotiated response compression.
+
+Responses with a compressible content type and a body of at least
+COMPRESS_MIN_SIZE bytes are compressed with brotli (when the brotli package
+is installed) or gzip, whichever the client's Accept-Encoding prefers.
+Streamed responses (exports, event streams) and files sent from disk are
+left alone, and so are responses that are already encoded.
+
+The response cache stores bodies before this runs, so a cached response is
+shared by clients asking for any encoding.
+"""
+import gzip
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'application/x-ndjson', 'application/javascript', 'text/html', 'text/plain',
+    'text/css', 'text/csv', 'text/javascript', 'image/svg+xml',
+}
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(data, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config.get('COMPRESS_BROTLI_QUALITY', 4))
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(data, compresslevel=config.get('COMPRESS_GZIP_LEVEL', 6), mtime=0)
+
+
+def _compress_response(response):
+    config = current_app.config
+    min_size = config.get('COMPRESS_MIN_SIZE', 1024)
+    if (not min_size or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers
+            or 'no-transform' in response.headers.get('Cache-Control', '')):
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.content_length or 0) < min_size:
+        return response
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+    response.set_data(compress(response.get_data(), encoding, config))
+    response.headers['Content-Encoding'] = encoding
+    # The compressed body is another representation of the same resource
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    app.after_request(_compress_response)
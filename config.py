@@ -1,8 +1,23 @@
 import os
-from dotenv import load_dotenv
+
+def _load_dotenv():
+    """Load environment variables from the nearest .env file, if there is one"""
+    # The same search load_dotenv() does from here, without importing
+    # python-dotenv on deployments that configure the environment directly
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        path = os.path.join(directory, '.env')
+        if os.path.isfile(path):
+            from dotenv import load_dotenv
+            load_dotenv(path)
+            return
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return
+        directory = parent
 
 # Load environment variables from .env file
-load_dotenv()
+_load_dotenv()
 
 class Config:
     # Secret key for session management and CSRF protection
@@ -12,18 +27,167 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', '').replace('postgres://', 'postgresql://') or 'sqlite:///truck_maintenance.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Read replicas (database.py): comma separated URLs. Endpoints marked
+    # @read_replica read from a replica at most REPLICA_MAX_LAG_SECONDS
+    # behind, measured every REPLICA_CHECK_SECONDS, and from the primary
+    # otherwise. Keep the lag below SYNC_OVERLAP_SECONDS.
+    DATABASE_REPLICA_URLS = [
+        url.strip().replace('postgres://', 'postgresql://')
+        for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+    ]
+    REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 2))
+    REPLICA_CHECK_SECONDS = 1
+    
+    # Connection pool per gunicorn worker (and per replica): one connection
+    # per request thread, with all WEB_CONCURRENCY workers together staying
+    # under DB_MAX_CONNECTIONS. gunicorn reads WEB_CONCURRENCY itself; pass
+    # --threads $GUNICORN_THREADS. On the gevent worker (green.py) the pool
+    # caps how many of a worker's requests use the database at once.
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 2))
+    GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 8))
+    DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', 90))
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or
+                       max(1, min(GUNICORN_THREADS, DB_MAX_CONNECTIONS // WEB_CONCURRENCY)))
+    # A little headroom for background threads (image results, replica checks)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or
+                          max(0, min(2, DB_MAX_CONNECTIONS // WEB_CONCURRENCY - DB_POOL_SIZE)))
+    DB_POOL_TIMEOUT = 10  # seconds a request waits for a free connection
+    # Statements run for requests are cancelled after this (Postgres, 0 = off);
+    # CLI jobs and background work are not limited
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+    
     # PostgreSQL specific settings
     if SQLALCHEMY_DATABASE_URI.startswith('postgresql://'):
         SQLALCHEMY_ENGINE_OPTIONS = {
             'pool_pre_ping': True,
             'pool_recycle': 300,
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT,
         }
     
+    # SQLite (the default truck_maintenance.db): write-ahead logging lets
+    # requests read while another writes; a writer waits up to
+    # SQLITE_BUSY_TIMEOUT_MS for the lock instead of failing
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', 'True') == 'True'
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_SYNCHRONOUS = 'NORMAL'  # safe with WAL; only the last commits may be lost on power failure
+    
     # Application settings
     DEBUG = os.environ.get('FLASK_DEBUG', 'False') == 'True'
     
+    # Report photo processing (IMAGE_WORKERS = 0 processes inline)
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+    IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'JPEG')  # JPEG or WEBP
+    # Longest edge in px per rendition; 'full' is the report's image_url
+    IMAGE_RENDITIONS = {'thumb': 128, 'medium': 512, 'full': 2048}
+    IMAGE_QUALITY = 85
+    # A blob still pending this long after it was queued is presumed lost
+    # with its worker and may be re-queued (python images.py requeue)
+    IMAGE_CLAIM_TIMEOUT_SECONDS = int(os.environ.get('IMAGE_CLAIM_TIMEOUT_SECONDS', 600))
+    
+    # Per-request memory ceilings. Multipart file parts stream to disk; only
+    # the text fields count against MAX_FORM_MEMORY_SIZE, checked once parsed
+    # (MAX_CONTENT_LENGTH bounds them until then). JSON bodies carrying
+    # a base64 image are held in memory together with the decoded bytes.
+    MAX_FORM_MEMORY_SIZE = 512 * 1024
+    MAX_JSON_BODY_SIZE = 8 * 1024 * 1024
+    
+    # Bulk report ingestion
+    BULK_CHUNK_SIZE = 500
+    BULK_MAX_ROWS = 10000
+    
+    # Rows fetched per server-side cursor batch by the report export
+    EXPORT_BATCH_SIZE = 1000
+
+    # Unfiltered searches rank only this many of the newest matching reports
+    SEARCH_RANK_WINDOW = int(os.environ.get('SEARCH_RANK_WINDOW', 5000))
+
+    # Delta sync re-sends changes this recent, covering writes still being
+    # committed; tombstones for deleted reports are kept this long
+    SYNC_OVERLAP_SECONDS = 5
+    SYNC_TOMBSTONE_DAYS = 30
+
+    # Server-Sent Events (events.py). Each open stream holds a worker thread,
+    # so serve with gunicorn's gthread worker class, or a greenlet on the
+    # gevent worker, where EVENT_MAX_SUBSCRIBERS can be raised a lot
+    EVENT_SOCKET_DIR = os.environ.get('EVENT_SOCKET_DIR')  # default: instance/events
+    EVENT_MAX_SUBSCRIBERS = int(os.environ.get('EVENT_MAX_SUBSCRIBERS', 100))  # per worker
+    EVENT_QUEUE_SIZE = 100
+    EVENT_HEARTBEAT_SECONDS = 15
+    EVENT_STREAM_SECONDS = 3600
+    EVENT_RETRY_MS = 3000
+
+    # Requests a gevent worker runs at once (green.py); the others queue
+    GREEN_MAX_ACTIVE_REQUESTS = int(os.environ.get('GREEN_MAX_ACTIVE_REQUESTS') or GUNICORN_THREADS)
+
+    # Password hashing pool (passwords.py), per web worker. PASSWORD_METHOD
+    # is spelled as werkzeug stores it; older hashes are upgraded on login.
+    # Keep PASSWORD_MAX_PENDING below gunicorn's --threads so a login storm
+    # always leaves threads free for other requests
+    PASSWORD_METHOD = os.environ.get('PASSWORD_METHOD', 'pbkdf2:sha256:600000')
+    PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', 2))  # 0 hashes inline
+    PASSWORD_MAX_PENDING = int(os.environ.get('PASSWORD_MAX_PENDING', 4))
+    PASSWORD_TIMEOUT = 10
+    PASSWORD_RETRY_AFTER = 2
+
+    # Per-process cache of driver identity records (identity.py)
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 1024))
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 300))
+
+    # Cached GET responses (cache.py): 'memory' per worker (invalidated across
+    # workers through EVENT_SOCKET_DIR), 'sqlite' shared by the workers on a
+    # host (RESPONSE_CACHE_PATH, default instance/), or 'none'
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+    RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH')
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 2048))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+    
+    # Nearest-workshop lookup (geo.py): the first search radius, grown as
+    # needed, and the most workshops one query returns
+    NEAREST_INITIAL_RADIUS_KM = 25
+    NEAREST_MAX_LIMIT = 50
+
+    # Repair scheduler (scheduler.py): reports planned per run, nearest
+    # workshops considered for each, how far a workshop may be, and the
+    # detour in km worth one full queue at a workshop
+    SCHEDULER_BATCH_SIZE = int(os.environ.get('SCHEDULER_BATCH_SIZE', 5000))
+    SCHEDULER_CANDIDATES = 8
+    SCHEDULER_MAX_DISTANCE_KM = float(os.environ.get('SCHEDULER_MAX_DISTANCE_KM', 300))
+    SCHEDULER_QUEUE_KM = float(os.environ.get('SCHEDULER_QUEUE_KM', 50))
+    SCHEDULER_INTERVAL_SECONDS = int(os.environ.get('SCHEDULER_INTERVAL_SECONDS', 60))
+
+    # Outbox (outbox.py): how often each web worker picks up the events and
+    # cache invalidations of jobs like the scheduler (0 turns polling off),
+    # and how long delivered messages are kept
+    OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', 1))
+    OUTBOX_RETENTION_SECONDS = int(os.environ.get('OUTBOX_RETENTION_SECONDS', 3600))
+
+    # Archival (archive.py): completed and cancelled reports untouched for
+    # ARCHIVE_AFTER_DAYS move to the archive tables, ARCHIVE_BATCH_SIZE
+    # reports per transaction
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 180))
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000))
+
+    # Request metrics (metrics.py). Workers share them through snapshot files
+    # in METRICS_DIR (default instance/metrics); set METRICS_TOKEN to require
+    # it as a bearer token on /metrics
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_SECONDS = 1
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 1.0))
+    SLOW_REQUEST_STATEMENTS = 10  # slowest SQL statements logged per slow request
+
+    # Response compression (compression.py): gzip, or brotli when the
+    # package is installed, for compressible bodies of at least
+    # COMPRESS_MIN_SIZE bytes. COMPRESS_MIN_SIZE = 0 turns it off.
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 4
+    
     # Pagination
     ITEMS_PER_PAGE = 10
+    MAX_ITEMS_PER_PAGE = 100
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -31,6 +195,9 @@ class DevelopmentConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    IMAGE_WORKERS = 0
+    PASSWORD_WORKERS = 0
+    OUTBOX_POLL_SECONDS = 0
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
 
@@ -0,0 +1,212 @@
+"""
+Database connections: SQLite tuning, request statement timeouts, and
+routing reads to replicas.
+
+Every SQLite connection is switched to write-ahead logging with a busy
+timeout (SQLITE_WAL, SQLITE_BUSY_TIMEOUT_MS). On Postgres, statements run
+on behalf of a request are cancelled after DB_STATEMENT_TIMEOUT_MS.
+
+Views decorated with @read_replica run their queries on one of the
+DATABASE_REPLICA_URLS, as long as it is no more than REPLICA_MAX_LAG_SECONDS
+behind the primary; otherwise, and for every flush or INSERT/UPDATE/DELETE,
+the primary is used. Lag is measured per worker every REPLICA_CHECK_SECONDS
+by a background thread: the primary's replication_heartbeat row is compared
+with each replica's copy of it, then bumped. Any replication that copies the
+primary's tables works, including two SQLite files where the replica is a
+copy of the primary.
+
+    python database.py lag   # print each replica's lag as seen from here
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from functools import wraps
+from flask import current_app, g, has_app_context, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm, text
+
+logger = logging.getLogger(__name__)
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+class RoutingSession(SignallingSession):
+    """Sends the reads of @read_replica requests to the replica picked for the request"""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica = g.get('db_replica') if has_app_context() else None
+        if replica is not None and not self._flushing and not getattr(clause, 'is_dml', False):
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        # Tune the connections of each engine with its own app's settings;
+        # the listeners live and go with the engine's pool
+        options['pool_events'] = [(_on_connect(app), 'connect'), (_on_checkout(app), 'checkout')]
+        return sa_url, options
+
+
+class ReplicaMonitor:
+    """This process's view of how far behind each replica is"""
+
+    def __init__(self, app, keys, start=True):
+        self.app = app
+        self.keys = keys
+        self.pid = os.getpid()
+        # bind key -> lag in seconds, None while unknown or unreachable
+        self.lag = {key: None for key in keys}
+        if start:
+            threading.Thread(target=self._check_periodically, name='replica-monitor', daemon=True).start()
+
+    def check(self):
+        from extensions import db
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                primary = _heartbeat(conn)
+            for key in self.keys:
+                try:
+                    with db.get_engine(self.app, bind=key).connect() as conn:
+                        replica = _heartbeat(conn)
+                    lag = max(0.0, (primary - replica).total_seconds()) if primary and replica else None
+                except Exception as e:
+                    if self.lag[key] is not None:
+                        logger.warning(f"Replica {key} unavailable, reading from the primary: {e}")
+                    lag = None
+                self.lag[key] = lag
+            with db.engine.begin() as conn:
+                conn.execute(text("UPDATE replication_heartbeat SET beat_at = :now WHERE id = 1"),
+                             {'now': datetime.utcnow()})
+
+    def _check_periodically(self):
+        interval = self.app.config.get('REPLICA_CHECK_SECONDS', 1)
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                logger.warning(f"Replica lag check failed: {e}")
+                self.lag = {key: None for key in self.keys}
+            time.sleep(interval)
+
+    def pick(self):
+        """Bind key of a replica within REPLICA_MAX_LAG_SECONDS, or None for the primary"""
+        max_lag = self.app.config.get('REPLICA_MAX_LAG_SECONDS', 2)
+        fresh = [key for key, lag in self.lag.items() if lag is not None and lag <= max_lag]
+        return random.choice(fresh) if fresh else None
+
+
+def _heartbeat(conn):
+    value = conn.execute(text("SELECT beat_at FROM replication_heartbeat WHERE id = 1")).scalar()
+    # SQLite hands back the stored string
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def replica_keys(app):
+    """Register DATABASE_REPLICA_URLS as SQLAlchemy binds; returns their keys"""
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    keys = []
+    for i, url in enumerate(app.config.get('DATABASE_REPLICA_URLS') or ()):
+        key = f'replica{i}'
+        binds[key] = url
+        keys.append(key)
+    app.config['SQLALCHEMY_BINDS'] = binds
+    return keys
+
+
+def get_monitor(app=None):
+    """The replica monitor of this process, or None without replicas"""
+    global _monitor
+    app = app or current_app._get_current_object()
+    with _monitor_lock:
+        if _monitor is None or _monitor.pid != os.getpid():
+            keys = replica_keys(app)
+            if not keys:
+                return None
+            _monitor = ReplicaMonitor(app, keys)
+        return _monitor
+
+
+def read_replica(view):
+    """Serve a read-only view from a replica when one is fresh enough"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        from extensions import db
+        monitor = get_monitor()
+        key = monitor.pick() if monitor else None
+        if key is not None:
+            g.db_replica = db.get_engine(current_app._get_current_object(), bind=key)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def on_replica():
+    """Whether this request reads from a replica, which may be slightly behind"""
+    return has_app_context() and g.get('db_replica') is not None
+
+
+def _on_connect(app):
+    def listener(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        # The busy timeout first: switching to WAL needs the lock once
+        cursor.execute(f"PRAGMA busy_timeout = {int(app.config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}")
+        if app.config.get('SQLITE_WAL', True):
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute(f"PRAGMA synchronous = {app.config.get('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+        cursor.close()
+    return listener
+
+
+def _on_checkout(app):
+    def listener(dbapi_connection, connection_record, connection_proxy):
+        if not type(dbapi_connection).__module__.startswith('psycopg2'):
+            return
+        timeout = app.config.get('DB_STATEMENT_TIMEOUT_MS', 0) if has_request_context() else 0
+        if connection_record.info.get('statement_timeout') == timeout:
+            return
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"SET statement_timeout = {int(timeout)}")
+        cursor.close()
+        # Outside the transaction the request is about to start, so a rollback keeps it
+        dbapi_connection.commit()
+        connection_record.info['statement_timeout'] = timeout
+    return listener
+
+
+def dispose_engines(app):
+    """
+    Forget the pooled connections of app's engines without closing them,
+    in a worker forked from the process that opened them (gunicorn.conf.py).
+    """
+    from extensions import db
+    for key in [None] + replica_keys(app):
+        db.get_engine(app, bind=key).dispose(close=False)
+
+
+if __name__ == '__main__':
+    from app import app
+    if sys.argv[1:] != ['lag']:
+        print("usage: python database.py lag")
+        sys.exit(2)
+    keys = replica_keys(app)
+    if not keys:
+        print("[INFO] No DATABASE_REPLICA_URLS configured")
+        sys.exit(0)
+    monitor = ReplicaMonitor(app, keys, start=False)
+    monitor.check()
+    for key, url in zip(keys, app.config['DATABASE_REPLICA_URLS']):
+        lag = monitor.lag[key]
+        status = 'unavailable' if lag is None else f'{lag:.1f}s behind'
+        print(f"{key}: {status} ({url})")
@@ -0,0 +1,344 @@
+"""
+Server-Sent Events for report and repair status changes.
+
+Status changes are collected while a session flushes and published only
+once it commits, so rolled back changes are never announced. Publishing
+delivers to the streams open in this process and sends one datagram per
+batch to every other worker through a Unix socket in EVENT_SOCKET_DIR;
+each worker with open streams binds a socket there and a listener thread
+hands incoming events to its subscribers. No broker process is needed.
+The same sockets carry response cache invalidations (cache.py) and
+driver identity invalidations (identity.py) to the workers that keep
+cached responses or identities in their own memory.
+
+Nothing waits on a slow consumer. Sends to another worker are
+non-blocking and a full socket buffer drops the datagram. Each stream has
+a bounded queue and a client that falls behind loses its backlog and gets
+a 'resync' event, telling it to catch up through delta sync
+(GET /api/v1/reports?updated_since=...). Idle streams get a comment line
+every EVENT_HEARTBEAT_SECONDS so proxies keep them open and dead clients
+are noticed, and streams close after EVENT_STREAM_SECONDS so clients
+reconnect and spread across workers.
+"""
+import os
+import json
+import glob
+import time
+import queue
+import errno
+import atexit
+import socket
+import logging
+import threading
+from datetime import datetime
+from flask import Response, current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Events, cache tags or driver ids per datagram, keeping each well under the default socket buffer
+BATCH_SIZE = 100
+MAX_DATAGRAM = 256 * 1024
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+class EventStreamFull(Exception):
+    """Raised when this worker already serves EVENT_MAX_SUBSCRIBERS streams"""
+
+
+class Subscription:
+    """One open stream: a bounded queue of events for a driver, or the fleet"""
+
+    def __init__(self, driver_id=None, maxsize=100):
+        self.driver_id = driver_id
+        self.queue = queue.Queue(maxsize)
+        self.overflows = 0
+
+    def wants(self, event):
+        return self.driver_id is None or event.get('driver_id') == self.driver_id
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A client this far behind is better off refetching than
+            # receiving a stale backlog
+            with self.queue.mutex:
+                self.queue.queue.clear()
+                self.queue.queue.append({'type': 'resync'})
+                self.queue.not_empty.notify()
+            self.overflows += 1
+
+
+class EventBus:
+    """Subscribers in this process plus the socket other workers publish to"""
+
+    def __init__(self, socket_dir, max_subscribers):
+        self.socket_dir = socket_dir
+        self.max_subscribers = max_subscribers
+        self.pid = os.getpid()
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.path = os.path.join(socket_dir, f'{os.getpid()}.sock')
+        self.sock = None
+        self.sender = None
+
+    def subscribe(self, driver_id=None, maxsize=100):
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                raise EventStreamFull()
+            if self.sock is None:
+                self._listen()
+            subscription = Subscription(driver_id, maxsize)
+            self.subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def listen(self):
+        """Receive what other workers send from now on, without subscribing"""
+        with self.lock:
+            if self.sock is None:
+                self._listen()
+
+    def _listen(self):
+        os.makedirs(self.socket_dir, exist_ok=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        sock.bind(self.path)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * MAX_DATAGRAM)
+        self.sock = sock
+        atexit.register(self.close)
+        threading.Thread(target=self._receive, name='event-listener', daemon=True).start()
+
+    def _receive(self):
+        while True:
+            try:
+                data = self.sock.recv(MAX_DATAGRAM)
+            except OSError:
+                return
+            try:
+                message = json.loads(data)
+                if 'invalidate' in message:
+                    from cache import invalidate_local
+                    invalidate_local(message['invalidate'])
+                elif 'identities' in message:
+                    from identity import invalidate_local
+                    invalidate_local(message['identities'])
+                else:
+                    self.dispatch(message['events'])
+            except (ValueError, KeyError, TypeError):
+                logger.warning("Ignoring malformed event datagram")
+
+    def dispatch(self, events):
+        """Hand events to the matching subscribers in this process"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            for event in events:
+                if subscription.wants(event):
+                    subscription.offer(event)
+
+    def publish(self, events):
+        """Deliver events locally and to every other worker's socket"""
+        if not events:
+            return
+        self.dispatch(events)
+        self._send('events', events)
+
+    def invalidate(self, tags):
+        """Have every other worker drop its cached responses carrying tags"""
+        if tags:
+            self._send('invalidate', sorted(tags))
+
+    def invalidate_identities(self, driver_ids):
+        """Have every other worker drop these drivers from its identity cache"""
+        if driver_ids:
+            self._send('identities', sorted(driver_ids))
+
+    def _send(self, kind, items):
+        peers = [path for path in glob.glob(os.path.join(self.socket_dir, '*.sock')) if path != self.path]
+        if not peers:
+            return
+        if self.sender is None:
+            self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sender.setblocking(False)
+        for start in range(0, len(items), BATCH_SIZE):
+            batch = items[start:start + BATCH_SIZE]
+            data = json.dumps({kind: batch}).encode()
+            for path in peers:
+                try:
+                    self.sender.sendto(data, path)
+                except BlockingIOError:
+                    logger.warning(f"Event socket {path} is full, dropping {len(batch)} {kind} item(s)")
+                except OSError as e:
+                    if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                        # The worker that bound it has exited
+                        _remove(path)
+                    else:
+                        logger.warning(f"Could not send {kind} to {path}: {e}")
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            _remove(self.path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def get_bus(app=None):
+    """The event bus of this process, created on first use after each fork"""
+    global _bus
+    app = app or current_app._get_current_object()
+    with _bus_lock:
+        # Sockets and listener threads do not survive fork
+        if _bus is None or _bus.pid != os.getpid():
+            _bus = EventBus(_socket_dir(app), app.config.get('EVENT_MAX_SUBSCRIBERS', 100))
+        return _bus
+
+
+def _socket_dir(app):
+    return app.config.get('EVENT_SOCKET_DIR') or os.path.join(app.instance_path, 'events')
+
+
+def report_event(report_id, driver_id, truck_id, status, previous=None, kind='report.status'):
+    return {
+        'type': kind,
+        'report_id': report_id,
+        'driver_id': driver_id,
+        'truck_id': truck_id,
+        'status': status,
+        'previous_status': previous,
+        'at': datetime.utcnow().isoformat(),
+    }
+
+
+def _previous_status(obj):
+    history = inspect(obj).attrs.status.history
+    return history.deleted[0] if history.deleted else None
+
+
+def _collect(session, flush_context):
+    from models import MaintenanceReport, Repair
+    events = session.info.setdefault('status_events', [])
+    for obj in session.new:
+        if isinstance(obj, MaintenanceReport):
+            events.append(report_event(obj.id, obj.driver_id, obj.truck_id, obj.status, kind='report.created'))
+        elif isinstance(obj, Repair):
+            events.append(_repair_event(session, obj, 'repair.created'))
+    for obj in session.dirty:
+        if not isinstance(obj, (MaintenanceReport, Repair)):
+            continue
+        if not inspect(obj).attrs.status.history.has_changes():
+            continue
+        if isinstance(obj, MaintenanceReport):
+            events.append(report_event(obj.id, obj.driver_id, obj.truck_id, obj.status, _previous_status(obj)))
+        else:
+            events.append(_repair_event(session, obj, 'repair.status'))
+
+
+def _repair_event(session, repair, kind):
+    from models import MaintenanceReport
+    report = repair.report or session.get(MaintenanceReport, repair.report_id)
+    return {
+        'type': kind,
+        'repair_id': repair.id,
+        'report_id': repair.report_id,
+        'driver_id': report.driver_id if report else None,
+        'truck_id': report.truck_id if report else None,
+        'status': repair.status,
+        'previous_status': _previous_status(repair) if kind == 'repair.status' else None,
+        'at': datetime.utcnow().isoformat(),
+    }
+
+
+def publish(events):
+    """Announce committed changes; never raises, the data is already saved"""
+    if not events:
+        return
+    try:
+        get_bus().publish(events)
+    except Exception as e:
+        # A lost notification only delays clients until their next sync
+        logger.error(f"Failed to publish {len(events)} status event(s): {e}")
+
+
+def _publish(session):
+    # Releasing a savepoint fires after_commit too; wait for the real commit
+    if session.in_nested_transaction():
+        return
+    publish(session.info.pop('status_events', None))
+
+
+def _discard(session, previous_transaction):
+    # A savepoint rolling back (images.claim racing another upload) leaves
+    # the outer transaction, and the changes it already flushed, in place
+    if previous_transaction.parent is None:
+        session.info.pop('status_events', None)
+
+
+def _keep_previous(target, value, oldvalue, initiator):
+    return value
+
+
+def init_events():
+    """Collect status changes on flush and publish them on commit"""
+    from models import MaintenanceReport, Repair
+    if event.contains(Session, 'after_flush', _collect):
+        return
+    for model in (MaintenanceReport, Repair):
+        event.listen(model.status, 'set', _keep_previous, active_history=True, retval=True)
+    event.listen(Session, 'after_flush', _collect)
+    event.listen(Session, 'after_commit', _publish)
+    event.listen(Session, 'after_soft_rollback', _discard)
+
+
+def _format(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def event_stream(driver_id=None):
+    """A text/event-stream Response of status changes for driver_id, or the whole fleet"""
+    app = current_app._get_current_object()
+    config = app.config
+    try:
+        subscription = get_bus(app).subscribe(driver_id, config.get('EVENT_QUEUE_SIZE', 100))
+    except EventStreamFull:
+        return Response('Too many open event streams, retry shortly\n', status=503,
+                        headers={'Retry-After': '5'}, mimetype='text/plain')
+    heartbeat = config.get('EVENT_HEARTBEAT_SECONDS', 15)
+    deadline = time.monotonic() + config.get('EVENT_STREAM_SECONDS', 3600)
+
+    def generate():
+        yield f"retry: {config.get('EVENT_RETRY_MS', 3000)}\n\n"
+        while time.monotonic() < deadline:
+            try:
+                event = subscription.queue.get(timeout=min(heartbeat, max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            # Send whatever else is already waiting in the same write
+            events = [event]
+            for _ in range(subscription.queue.qsize()):
+                try:
+                    events.append(subscription.queue.get_nowait())
+                except queue.Empty:
+                    break
+            yield ''.join(_format(event) for event in events)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    response = Response(generate(), mimetype='text/event-stream', headers=headers)
+    # Runs when the server closes the stream, whether it ended or the client went away
+    response.call_on_close(lambda: get_bus(app).unsubscribe(subscription))
+    return response
@@ -0,0 +1,134 @@
+"""
+Streaming export of report and repair history.
+
+Rows come from an outer join of maintenance_report, repair and workshop,
+read from a server-side cursor in EXPORT_BATCH_SIZE batches and written to
+the response in ~64KB chunks, so memory stays flat however many reports
+there are. Reports with several repairs produce one row per repair.
+
+Archived reports are part of the history: the same join over
+archived_report and archived_repair is UNION ALLed in and the database
+sorts both into report order. include_archived=false exports the hot
+tables alone, which skips that sort.
+"""
+import io
+import csv
+import json
+import zlib
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import select, union_all
+from extensions import db
+from models import ArchivedRepair, ArchivedReport, MaintenanceReport, Repair, Workshop
+from pagination import PaginationError, filter_reports
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+CHUNK_SIZE = 64 * 1024
+
+# (field, source, column); the source is the report, its repair or the workshop
+COLUMNS = (
+    ('report_id', 'report', 'id'),
+    ('truck_id', 'report', 'truck_id'),
+    ('issue_description', 'report', 'issue_description'),
+    ('reported_date', 'report', 'reported_date'),
+    ('status', 'report', 'status'),
+    ('driver_id', 'report', 'driver_id'),
+    ('repair_id', 'repair', 'id'),
+    ('repair_status', 'repair', 'status'),
+    ('repair_start_date', 'repair', 'start_date'),
+    ('repair_end_date', 'repair', 'end_date'),
+    ('repair_notes', 'repair', 'notes'),
+    ('workshop_id', 'workshop', 'id'),
+    ('workshop_name', 'workshop', 'name'),
+)
+FIELDS = [name for name, _, _ in COLUMNS]
+ORDER = ('reported_date', 'report_id', 'repair_id')
+BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+
+
+def _history(report, repair, args):
+    """Export rows of one pair of report and repair tables, filtered by args"""
+    sources = {'report': report, 'repair': repair, 'workshop': Workshop}
+    stmt = (
+        select(*[getattr(sources[source], column).label(name) for name, source, column in COLUMNS])
+        .select_from(report)
+        .outerjoin(repair, repair.report_id == report.id)
+        .outerjoin(Workshop, Workshop.id == repair.workshop_id)
+    )
+    return filter_reports(stmt, args, report)
+
+
+def build_export_query(args):
+    """Select export rows in report order; raises PaginationError on bad filters"""
+    include_archived = BOOLEANS.get(args.get('include_archived', 'true').lower())
+    if include_archived is None:
+        raise PaginationError('include_archived must be true or false')
+    stmt = _history(MaintenanceReport, Repair, args)
+    if include_archived:
+        stmt = union_all(stmt, _history(ArchivedReport, ArchivedRepair, args))
+    return stmt.order_by(*[stmt.selected_columns[name] for name in ORDER])
+
+
+def _format_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _iter_rows(stmt, batch_size):
+    result = db.session.execute(stmt.execution_options(stream_results=True, yield_per=batch_size))
+    for partition in result.partitions():
+        for row in partition:
+            yield [_format_value(value) for value in row]
+
+
+def _iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def _iter_ndjson(rows):
+    buffer = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(FIELDS, row))) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer).encode()
+            buffer, size = [], 0
+    yield ''.join(buffer).encode()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_response(args, fmt, compress=False):
+    """Build a streaming Response exporting the reports matched by args"""
+    stmt = build_export_query(args)
+    batch_size = current_app.config.get('EXPORT_BATCH_SIZE', 1000)
+    rows = _iter_rows(stmt, batch_size)
+    body = _iter_csv(rows) if fmt == 'csv' else _iter_ndjson(rows)
+
+    headers = {
+        'Content-Disposition': f'attachment; filename=reports.{fmt}',
+        'Vary': 'Accept-Encoding',
+    }
+    if compress:
+        body = _gzip(body)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(body), content_type=EXPORT_FORMATS[fmt], headers=headers)
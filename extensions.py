@@ -0,0 +1,10 @@
+"""
+The Flask extensions, created unbound. Models, blueprints and CLI jobs
+import db from here rather than from app, so importing them does not build
+the app; create_app (app.py) binds them to it.
+"""
+from flask_jwt_extended import JWTManager
+from database import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
+jwt = JWTManager()
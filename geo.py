@@ -0,0 +1,171 @@
+"""
+Workshop locations and the nearest-workshop lookup.
+
+Workshops with a latitude and longitude are indexed spatially: on SQLite an
+R*Tree virtual table (workshop_location) kept in sync by triggers, on
+Postgres a GiST index on point(longitude, latitude).
+
+nearest_workshops() never scans every workshop. It asks the index for the
+workshops inside a bounding box around the point, ranks them by great
+circle distance and keeps those within the box's radius, which are exactly
+the nearest ones. If that leaves fewer than limit, the radius grows (scaled
+by the density seen so far) and the box is searched again.
+
+    python geo.py rebuild   # re-index every workshop from the workshop table
+"""
+import sys
+import math
+from flask import current_app
+from sqlalchemy import text
+from extensions import db
+from models import Workshop
+
+EARTH_RADIUS_KM = 6371.0088
+# Beyond this every point on Earth is within range
+MAX_RADIUS_KM = math.pi * EARTH_RADIUS_KM
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS workshop_location USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    """
+    CREATE TRIGGER IF NOT EXISTS workshop_location_insert AFTER INSERT ON workshop
+    WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+        INSERT INTO workshop_location VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS workshop_location_update AFTER UPDATE OF latitude, longitude ON workshop BEGIN
+        DELETE FROM workshop_location WHERE id = old.id;
+        INSERT INTO workshop_location
+        SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+        WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS workshop_location_delete AFTER DELETE ON workshop BEGIN
+        DELETE FROM workshop_location WHERE id = old.id;
+    END
+    """,
+]
+
+POSTGRES_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_workshop_location ON workshop USING GIST (point(longitude, latitude))",
+]
+
+SQLITE_BOX = (
+    "SELECT w.id, w.latitude, w.longitude FROM workshop_location l JOIN workshop w ON w.id = l.id "
+    "WHERE l.max_lat >= :min_lat AND l.min_lat <= :max_lat "
+    "AND l.max_lon >= :min_lon AND l.min_lon <= :max_lon"
+)
+
+POSTGRES_BOX = (
+    "SELECT id, latitude, longitude FROM workshop "
+    "WHERE point(longitude, latitude) <@ box(point(:min_lon, :min_lat), point(:max_lon, :max_lat))"
+)
+
+
+class LocationError(ValueError):
+    """Raised when coordinates or nearest-workshop parameters are invalid"""
+
+
+def create_spatial_index(conn):
+    """Create the spatial index (and on SQLite its triggers), then index existing workshops"""
+    statements = POSTGRES_DDL if conn.dialect.name == 'postgresql' else SQLITE_DDL
+    for statement in statements:
+        conn.execute(text(statement))
+    rebuild(conn)
+
+
+def rebuild(conn):
+    """Re-index every located workshop; the Postgres index maintains itself"""
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("REINDEX INDEX ix_workshop_location"))
+        return
+    conn.execute(text("DELETE FROM workshop_location"))
+    conn.execute(text(
+        "INSERT INTO workshop_location "
+        "SELECT id, latitude, latitude, longitude, longitude FROM workshop "
+        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+    ))
+
+
+def parse_point(lat, lon):
+    """Validate a latitude/longitude pair from request arguments"""
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        raise LocationError('lat and lon must be numbers')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise LocationError('lat must be within [-90, 90] and lon within [-180, 180]')
+    return lat, lon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_boxes(lat, lon, radius_km):
+    """
+    (min_lat, max_lat, min_lon, max_lon) boxes covering every point within
+    radius_km of (lat, lon); two boxes when the area crosses the antimeridian.
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    min_lat, max_lat = lat - math.degrees(angle), lat + math.degrees(angle)
+    if min_lat <= -90 or max_lat >= 90 or angle >= math.pi / 2:
+        # The circle contains a pole, so it spans every longitude
+        return [(max(min_lat, -90), min(max_lat, 90), -180, 180)]
+    # Widest longitude reached by the circle (tangent point, not lat's parallel)
+    delta_lon = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(lat)))))
+    min_lon, max_lon = lon - delta_lon, lon + delta_lon
+    if min_lon < -180:
+        return [(min_lat, max_lat, min_lon + 360, 180), (min_lat, max_lat, -180, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, max_lat, min_lon, 180), (min_lat, max_lat, -180, max_lon - 360)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+
+def _in_boxes(boxes):
+    sql = POSTGRES_BOX if db.engine.dialect.name == 'postgresql' else SQLITE_BOX
+    rows = {}
+    for min_lat, max_lat, min_lon, max_lon in boxes:
+        params = {'min_lat': min_lat, 'max_lat': max_lat, 'min_lon': min_lon, 'max_lon': max_lon}
+        for workshop_id, latitude, longitude in db.session.execute(text(sql), params):
+            rows[workshop_id] = (latitude, longitude)
+    return rows
+
+
+def nearest_workshops(lat, lon, limit=5, max_km=None):
+    """Return [(workshop, distance_km)] for the limit workshops nearest (lat, lon), closest first"""
+    radius = current_app.config.get('NEAREST_INITIAL_RADIUS_KM', 25)
+    if max_km is not None:
+        radius = min(radius, max_km)
+    while True:
+        candidates = _in_boxes(bounding_boxes(lat, lon, radius))
+        ranked = sorted(
+            (haversine_km(lat, lon, latitude, longitude), workshop_id)
+            for workshop_id, (latitude, longitude) in candidates.items()
+        )
+        within = [(distance, workshop_id) for distance, workshop_id in ranked if distance <= radius]
+        done = radius >= MAX_RADIUS_KM or (max_km is not None and radius >= max_km)
+        if len(within) >= limit or done:
+            break
+        # Grow so the area is expected to hold limit workshops, at least doubling
+        radius *= max(2.0, math.sqrt(limit / max(len(within), 1)))
+        if max_km is not None:
+            radius = min(radius, max_km)
+    within = within[:limit]
+    workshops = {w.id: w for w in Workshop.query.filter(Workshop.id.in_([i for _, i in within]))}
+    return [(workshops[workshop_id], distance) for distance, workshop_id in within if workshop_id in workshops]
+
+
+if __name__ == '__main__':
+    from app import app
+    if sys.argv[1:] != ['rebuild']:
+        print("usage: python geo.py rebuild")
+        sys.exit(2)
+    with app.app_context():
+        with db.engine.begin() as conn:
+            rebuild(conn)
+        print("[SUCCESS] Workshop locations re-indexed")
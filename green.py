@@ -0,0 +1,184 @@
+"""
+Cooperative serving mode on gevent.
+
+By default gunicorn serves each request on a thread of the gthread worker,
+so a worker handles at most --threads requests at a time and every open
+event stream takes one of them for its whole life. Started with
+
+    GUNICORN_WORKER_CLASS=gevent gunicorn app:app --worker-connections 1000
+
+each request runs on a greenlet instead. gunicorn monkey patches the worker
+before the app is imported, so the views, the event streams and the
+background threads stay as they are: waiting on a socket, a queue or a
+sleep switches to another request. On top of that this module
+
+- makes psycopg2 wait for Postgres through gevent, so database round
+  trips no longer block the worker;
+- gives upload file writes to gevent's thread pool (offload), so disk
+  I/O runs beside the other requests;
+- serializes SQLite writes within the worker with a gevent lock, held by
+  a connection from its first write until its transaction ends. SQLite
+  waits for a write lock inside C, where no other greenlet can run, so a
+  greenlet waiting on another one in the same worker would stall it for
+  SQLITE_BUSY_TIMEOUT_MS. Workers still wait for each other's writes. A
+  greenlet never waits for itself (a second connection writing is left to
+  SQLite's busy timeout), and a request that ends still holding the lock
+  invalidates the connection holding it, which rolls its write
+  transaction back, and then gives the lock back;
+- lets at most GREEN_MAX_ACTIVE_REQUESTS requests per worker run their
+  view at once; the rest wait their turn. A busy worker otherwise splits
+  its CPU between every request it has accepted, and a request that waits
+  on the database several times waits for all of them each time. The slot
+  is given back when the view returns, so open event streams do not hold
+  one.
+
+DB_POOL_SIZE still bounds the database connections of a worker; requests
+beyond it wait for a connection without holding a thread. The process
+pools for photos and passwords are unchanged. gthread stays the default
+(gunicorn.conf.py: GUNICORN_WORKER_CLASS), and gevent is only needed for this mode.
+"""
+import sys
+import logging
+import threading
+from flask import g
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+logger = logging.getLogger(__name__)
+
+WRITE_VERBS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Created in init_green, once threading is patched
+_sqlite_write_lock = None
+_active_requests = None
+
+
+class WriteLock:
+    """One SQLite writer per worker, held by a connection until its transaction ends"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.holder = None      # info dict of the connection holding it
+        self.connection = None  # and the connection itself, if known
+        self.owner = None       # the greenlet (thread) that took it
+
+    def acquire(self, info, connection=None):
+        if info.get('sqlite_write_lock'):
+            return
+        if self.owner == threading.get_ident():
+            # Another connection of this greenlet holds it and cannot let go
+            # before this one is done; SQLite's busy timeout decides instead
+            return
+        self.lock.acquire()
+        self.holder, self.connection, self.owner = info, connection, threading.get_ident()
+        info['sqlite_write_lock'] = True
+
+    def release(self, info):
+        if info.pop('sqlite_write_lock', False):
+            self.holder = self.connection = self.owner = None
+            self.lock.release()
+
+    def release_owned(self):
+        """
+        Release the lock if the current greenlet still holds it; returns
+        whether it did. Its connection is invalidated first: the write
+        transaction it leaves open would otherwise keep SQLite's own lock,
+        and the next writer would wait for it inside C.
+        """
+        if self.owner != threading.get_ident():
+            return False
+        holder, connection = self.holder, self.connection
+        try:
+            if connection is not None:
+                # Closes the DBAPI connection, rolling the transaction back
+                connection.invalidate()
+        finally:
+            self.release(holder)
+        return True
+
+
+def is_green():
+    """Whether this process runs on gevent's monkey patched standard library"""
+    # Patching imports gevent.monkey first; without it there is nothing to
+    # check, and the threaded mode need not pay for importing gevent
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('socket')
+
+
+def offload(fn):
+    """fn, run on gevent's thread pool in the green mode and called directly otherwise"""
+    if not is_green():
+        return fn
+    import gevent
+
+    def wrapper(*args, **kwargs):
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    return wrapper
+
+
+def _wait_psycopg2(conn, timeout=None):
+    from gevent.socket import wait_read, wait_write
+    from psycopg2 import OperationalError, extensions
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+        if state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError(f"Bad result from poll: {state!r}")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if conn.dialect.name != 'sqlite' or conn.info.get('sqlite_write_lock'):
+        return
+    if statement.lstrip()[:7].upper().startswith(WRITE_VERBS):
+        _sqlite_write_lock.acquire(conn.info, conn)
+
+
+def _on_end(conn, *args):
+    _sqlite_write_lock.release(conn.info)
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    # Returned to the pool (and rolled back there) without an explicit end
+    _sqlite_write_lock.release(connection_record.info)
+
+
+def _admit():
+    _active_requests.acquire()
+    g.green_slot = True
+
+
+def _leave(exc):
+    try:
+        if _sqlite_write_lock.release_owned():
+            logger.warning("A request ended inside a SQLite write transaction; rolled it back and released its write lock")
+    finally:
+        if g.pop('green_slot', False):
+            _active_requests.release()
+
+
+def init_green(app):
+    """Hook the database and app's requests up to gevent when serving on it"""
+    global _sqlite_write_lock, _active_requests
+    if not is_green() or _sqlite_write_lock is not None:
+        return
+    _sqlite_write_lock = WriteLock()
+    _active_requests = threading.BoundedSemaphore(app.config.get('GREEN_MAX_ACTIVE_REQUESTS', 8))
+    app.before_request(_admit)
+    app.teardown_request(_leave)
+    try:
+        from psycopg2 import extensions
+    except ImportError:
+        pass
+    else:
+        extensions.set_wait_callback(_wait_psycopg2)
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'commit', _on_end)
+    event.listen(Engine, 'rollback', _on_end)
+    event.listen(Pool, 'checkin', _on_checkin)
+    logger.info("Serving on gevent: cooperative database waits and upload writes")
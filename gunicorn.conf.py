@@ -0,0 +1,28 @@
+"""
+gunicorn settings, read from the environment; gunicorn loads this file
+from the working directory, so `gunicorn app:app` is the whole command.
+WEB_CONCURRENCY (workers) and PORT are read by gunicorn itself.
+
+The master imports and builds the app once and forks the workers from it
+(preload_app): a worker starts serving without importing anything, and the
+workers share the imported code and the app copy-on-write. The gevent
+worker (green.py) monkey patches the standard library after the fork, so
+it builds the app in each worker instead; choose it with
+GUNICORN_WORKER_CLASS rather than --worker-class so preloading follows.
+"""
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+preload_app = os.environ.get('GUNICORN_PRELOAD', str(worker_class != 'gevent')) == 'True'
+
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    if 'gevent' in server.cfg.worker_class_str:
+        server.log.warning("gevent worker with a preloaded app: the app was built before "
+                           "patching; set GUNICORN_WORKER_CLASS=gevent or GUNICORN_PRELOAD=False")
+    # Connections the master opened (migrations, a warm-up query) stay its own
+    from database import dispose_engines
+    dispose_engines(server.app.wsgi())
@@ -0,0 +1,188 @@
+"""
+Driver identity records, cached per process.
+
+Tokens carry the driver's name and email as claims next to the id, so
+handlers that only need to know who is calling, like the profile, read
+them from get_jwt() (claimed_identity) and never load the driver row. The
+claims are as old as the access token; a refresh issues current ones.
+Tokens without them, and handlers that need a current record (token
+refresh), go through get_identity(), an LRU cache of plain dicts with a
+TTL of IDENTITY_CACHE_TTL seconds.
+
+A committed change to a driver invalidates its entry in this process at
+once and is sent to the other workers on the host over the event sockets
+(events.py), which every worker holding an identity cache listens on.
+Hit, miss, eviction and invalidation counters are kept for monitoring.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from database import on_replica
+
+logger = logging.getLogger(__name__)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class IdentityCache:
+    """Thread-safe LRU of driver records whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        # Bumped by every invalidation so a load that raced one is not stored
+        self.version = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, version=None):
+        with self.lock:
+            if version is not None and version != self.version:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.version += 1
+            self.invalidations += 1
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+def get_cache(app=None):
+    """The identity cache of this process, created on first use after each fork"""
+    global _cache
+    app = app or current_app._get_current_object()
+    with _cache_lock:
+        if _cache is None or _cache.pid != os.getpid():
+            _cache = IdentityCache(app.config.get('IDENTITY_CACHE_SIZE', 1024),
+                                   app.config.get('IDENTITY_CACHE_TTL', 300))
+            from events import get_bus
+            get_bus(app).listen()
+        return _cache
+
+
+def identity_record(driver):
+    return {'id': driver.id, 'name': driver.name, 'email': driver.email}
+
+
+def identity_claims(record):
+    """Extra JWT claims from an identity record, enough for handlers to skip loading the driver"""
+    return {'name': record['name'], 'email': record['email']}
+
+
+def claimed_identity(driver_id, claims):
+    """The identity record carried in a token's claims, or None for tokens issued without them"""
+    if 'name' not in claims or 'email' not in claims:
+        return None
+    return {'id': int(driver_id), 'name': claims['name'], 'email': claims['email']}
+
+
+def get_identity(driver_id):
+    """The driver's identity record as a dict, or None if there is no such driver"""
+    from models import Driver
+    driver_id = int(driver_id)
+    cache = get_cache()
+    record = cache.get(driver_id)
+    if record is not None:
+        return record
+    version = cache.version
+    driver = Driver.query.get(driver_id)
+    if driver is None:
+        return None
+    record = identity_record(driver)
+    # A lagging replica could cache a version an invalidation already dropped
+    if not on_replica():
+        cache.put(driver_id, record, version)
+    return record
+
+
+def _collect(session, flush_context):
+    from models import Driver
+    changed = session.info.setdefault('identity_invalidations', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Driver):
+            changed.add(obj.id)
+
+
+def invalidate_local(driver_ids):
+    """Drop drivers from this process's cache only, as sent by another worker"""
+    cache = _cache
+    # Nothing is cached yet in this process
+    if cache is not None and cache.pid == os.getpid():
+        for driver_id in driver_ids:
+            cache.invalidate(driver_id)
+
+
+def _invalidate(session):
+    if session.in_nested_transaction():
+        return
+    changed = session.info.pop('identity_invalidations', None)
+    if not changed:
+        return
+    invalidate_local(changed)
+    # Sessions commit inside an app context, which locates the sockets
+    if has_app_context():
+        from events import get_bus
+        try:
+            get_bus().invalidate_identities(changed)
+        except Exception as e:
+            # The change is committed; the other workers catch up at the TTL
+            logger.error(f"Failed to send {len(changed)} identity invalidation(s) to other workers: {e}")
+
+
+def _discard(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('identity_invalidations', None)
+
+
+def init_identity():
+    """Drop cached drivers once changes to them commit"""
+    if event.contains(Session, 'after_flush', _collect):
+        return
+    event.listen(Session, 'after_flush', _collect)
+    event.listen(Session, 'after_commit', _invalidate)
+    event.listen(Session, 'after_soft_rollback', _discard)
@@ -0,0 +1,452 @@
+"""
+Background processing and content-addressed storage for report photos.
+
+The request path only writes the raw upload to a pending folder, hashing it
+as it goes, and records an ImageBlob for that hash. Identical bytes uploaded
+again reuse the existing blob and its files, so a retried submission costs
+no decode or encode work. New blobs are queued on a process pool that does
+the CPU-heavy work (decode, EXIF orientation, downscale, re-encode into each
+configured rendition size) and flips the blob and every report pointing at
+it from 'pending' to 'ready' or 'failed'.
+
+A failed blob is not final. The raw upload is only deleted when Pillow
+cannot decode it; after any other error (a full disk, a killed pool
+worker) it stays in the pending folder and `requeue` retries the blob.
+Uploading the same bytes again also sets a failed blob back to pending and
+processes it once more. Reports that gave up on it get their image once it
+is ready.
+
+Renditions live under static/uploads/<folder>/<hash[:2]>/<hash[2:4]>/ so no
+single directory grows unbounded.
+
+This module does not import Pillow or the app at import time so that pool
+workers start quickly.
+
+    python images.py requeue        # resume blobs left pending or failed by a restart
+    python images.py gc [--dry-run] # delete images no report references
+"""
+import os
+import sys
+import time
+import uuid
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from cache import invalidate
+from metrics import get_registry, observe
+from green import offload
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Unreferenced blobs younger than this may belong to a request that has
+# not committed its report yet, so gc leaves them alone
+GC_GRACE_PERIOD = timedelta(hours=1)
+
+_executor = None
+_executor_pid = None
+
+
+class PendingImage:
+    """A hashed raw upload and the rendition files it maps to"""
+
+    def __init__(self, raw_path, sha256, size, folder, renditions):
+        self.raw_path = raw_path
+        self.sha256 = sha256
+        self.size = size
+        self.folder = folder
+        # name -> (output_path, url, max_dimension)
+        self.renditions = renditions
+        # Set by claim(): blob status, and whether this upload must be processed
+        self.status = 'pending'
+        self.is_new = True
+
+    @property
+    def url(self):
+        """URL of the largest rendition, stored as the report's image_url"""
+        return self.renditions['full'][1] if self.status != 'failed' else None
+
+    @property
+    def urls(self):
+        if self.status == 'failed':
+            return None
+        return {name: url for name, (_, url, _) in self.renditions.items()}
+
+
+def _pending_folder(app):
+    folder = app.config.get('IMAGE_PENDING_FOLDER') or os.path.join(app.instance_path, 'pending_uploads')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def _shard_folder(app, folder, sha256):
+    return os.path.join(app.static_folder, 'uploads', folder, sha256[:2], sha256[2:4])
+
+
+def _renditions(app, folder, sha256):
+    extension = IMAGE_EXTENSIONS[app.config.get('IMAGE_FORMAT', 'JPEG')]
+    shard = _shard_folder(app, folder, sha256)
+    renditions = {}
+    for rendition, max_dimension in app.config['IMAGE_RENDITIONS'].items():
+        # The full size keeps the bare name so image_url stays stable
+        suffix = '' if rendition == 'full' else f"_{max_dimension}"
+        filename = f"{sha256}{suffix}.{extension}"
+        renditions[rendition] = (
+            os.path.join(shard, filename),
+            f"/static/uploads/{folder}/{sha256[:2]}/{sha256[2:4]}/{filename}",
+            max_dimension,
+        )
+    return renditions
+
+
+def stage_upload(data, folder='reports'):
+    """
+    Write a raw upload to the pending folder and return a PendingImage.
+    data is either bytes or a file-like object, which is copied in chunks
+    and hashed on the way through.
+    """
+    app = current_app._get_current_object()
+    digest = hashlib.sha256()
+    size = 0
+    # A unique name until claim() knows whether this content is new
+    raw_path = os.path.join(_pending_folder(app), f"{uuid.uuid4()}.part")
+    with open(raw_path, 'wb') as f:
+        write = offload(f.write)
+        if isinstance(data, bytes):
+            digest.update(data)
+            size = len(data)
+            write(data)
+        else:
+            while True:
+                chunk = data.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                write(chunk)
+    sha256 = digest.hexdigest()
+    return PendingImage(raw_path, sha256, size, folder, _renditions(app, folder, sha256))
+
+
+def claim(pending):
+    """
+    Take a reference on the blob for a staged upload, inside the caller's
+    transaction. A new blob, or a failed one set back to pending, keeps the
+    raw file for processing; any other known one drops it and takes over
+    the blob's status. Returns the ImageBlob.
+    """
+    from extensions import db
+    from models import ImageBlob
+
+    app = current_app._get_current_object()
+    blob = ImageBlob.query.filter_by(sha256=pending.sha256).first()
+    if blob is None:
+        try:
+            with db.session.begin_nested():
+                blob = ImageBlob(sha256=pending.sha256, folder=pending.folder, size=pending.size,
+                                 status='pending', ref_count=1, renditions=pending.urls,
+                                 claimed_at=datetime.utcnow())
+                db.session.add(blob)
+        except IntegrityError:
+            # Another request stored the same bytes first
+            blob = ImageBlob.query.filter_by(sha256=pending.sha256).first()
+        else:
+            _keep_raw(app, pending)
+            return blob
+
+    # Only one request wins a failed blob back; it processes this upload
+    retried = ImageBlob.query.filter_by(sha256=pending.sha256, status='failed').update(
+        {ImageBlob.ref_count: ImageBlob.ref_count + 1, ImageBlob.status: 'pending',
+         ImageBlob.claimed_at: datetime.utcnow()}, synchronize_session=False
+    )
+    if retried:
+        db.session.expire(blob)
+        _keep_raw(app, pending)
+        return blob
+    ImageBlob.query.filter_by(sha256=pending.sha256).update(
+        {ImageBlob.ref_count: ImageBlob.ref_count + 1}, synchronize_session=False
+    )
+    os.remove(pending.raw_path)
+    pending.is_new = False
+    pending.status = blob.status
+    return blob
+
+
+def _keep_raw(app, pending):
+    """Move a claimed upload's raw file to where processing and requeue find it"""
+    raw_path = os.path.join(_pending_folder(app), pending.sha256)
+    os.replace(pending.raw_path, raw_path)
+    pending.raw_path = raw_path
+
+
+def is_undecodable(error):
+    """Whether error means Pillow can never decode the upload, as opposed to failed I/O"""
+    from PIL import Image
+    if isinstance(error, (Image.DecompressionBombError, SyntaxError, ValueError)):
+        return True
+    # Pillow's decoder errors (UnidentifiedImageError, truncated data) carry
+    # no errno; the operating system's I/O errors do
+    return isinstance(error, OSError) and error.errno is None
+
+
+def discard(pending):
+    """Remove the raw file of a staged upload whose report was not committed"""
+    if pending.is_new and os.path.exists(pending.raw_path):
+        os.remove(pending.raw_path)
+
+
+def process_image(raw_path, outputs, image_format='JPEG', quality=85):
+    """
+    Decode and orient one image, then write it at each (output_path,
+    max_dimension) in outputs. Runs in a pool worker.
+
+    Renditions are produced largest first, each downscaled from the previous
+    one rather than from the original. Every file is written to a temporary
+    name and renamed into place so it never appears half written. The raw
+    upload is deleted once processed or found undecodable; after any other
+    error it is kept for a retry.
+    """
+    from PIL import Image, ImageOps
+
+    outputs = sorted(outputs, key=lambda output: output[1], reverse=True)
+    options = {'quality': quality}
+    if image_format == 'JPEG':
+        options.update(optimize=True, progressive=True)
+    decoded = False
+    try:
+        with Image.open(raw_path) as img:
+            largest = outputs[0][1]
+            # Let the JPEG decoder skip detail we would throw away anyway
+            img.draft('RGB', (largest, largest))
+            img.load()
+            decoded = True
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            for output_path, max_dimension in outputs:
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                img.thumbnail((max_dimension, max_dimension), reducing_gap=3.0)
+                tmp_path = f"{output_path}.tmp"
+                img.save(tmp_path, image_format, **options)
+                os.replace(tmp_path, output_path)
+    except Exception as e:
+        # Undecodable uploads are not worth retrying
+        if not decoded and is_undecodable(e):
+            os.remove(raw_path)
+        raise
+    os.remove(raw_path)
+    return [output_path for output_path, _ in outputs]
+
+
+def _get_executor(app):
+    global _executor, _executor_pid
+    # Pools do not survive fork, so each gunicorn worker builds its own
+    if _executor is None or _executor_pid != os.getpid():
+        # spawn rather than fork: the web worker may hold DB connections
+        # and threads that must not be duplicated into the children
+        context = multiprocessing.get_context('spawn')
+        _executor = ProcessPoolExecutor(max_workers=app.config['IMAGE_WORKERS'], mp_context=context)
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _set_image_status(app, sha256, status):
+    """
+    Mark a blob that is still pending, and every report waiting on it, as
+    ready or failed; once ready, reports that gave up on an earlier attempt
+    get the image too. Returns False when another job settled the blob
+    first; its outcome stands.
+    """
+    from extensions import db
+    from models import ImageBlob, MaintenanceReport
+    values = {'image_status': status}
+    if status == 'failed':
+        values['image_url'] = None
+        values['image_renditions'] = None
+    # Pool callbacks run on a bare thread; inline processing already has the
+    # request's context and must not tear down its session
+    context = app.app_context() if not has_app_context() else nullcontext()
+    with context:
+        settled = ImageBlob.query.filter_by(sha256=sha256, status='pending').update(
+            {'status': status}, synchronize_session=False
+        )
+        if not settled:
+            db.session.rollback()
+            return False
+        MaintenanceReport.query.filter_by(image_hash=sha256, image_status='pending').update(
+            values, synchronize_session=False
+        )
+        renditions = status == 'ready' and db.session.query(ImageBlob.renditions).filter_by(sha256=sha256).scalar()
+        if renditions:
+            MaintenanceReport.query.filter_by(image_hash=sha256, image_status='failed').update(
+                {'image_status': 'ready', 'image_url': renditions['full'], 'image_renditions': renditions},
+                synchronize_session=False
+            )
+        db.session.commit()
+        # A bulk UPDATE skips the ORM events that invalidate cached reports
+        invalidate(f'image:{sha256}')
+    return True
+
+
+def _finish(app, sha256, future, queued):
+    error = future.exception()
+    status = 'ready' if error is None else 'failed'
+    get_registry(app).observe('image_process_seconds', time.perf_counter() - queued, status)
+    if error is not None:
+        logger.error(f"Error processing image {sha256}: {error}")
+    _set_image_status(app, sha256, status)
+
+
+def enqueue(pending):
+    """
+    Queue processing of a claimed upload once its report is committed.
+    Duplicates of a known blob need no work and are skipped.
+
+    With IMAGE_WORKERS = 0 the image is processed inline, which keeps tests
+    and single-process debugging deterministic.
+    """
+    if not pending.is_new:
+        return None
+    app = current_app._get_current_object()
+    args = (
+        pending.raw_path,
+        [(path, max_dimension) for path, _, max_dimension in pending.renditions.values()],
+        app.config.get('IMAGE_FORMAT', 'JPEG'),
+        app.config.get('IMAGE_QUALITY', 85),
+    )
+    queued = time.perf_counter()
+    if not app.config.get('IMAGE_WORKERS'):
+        try:
+            process_image(*args)
+        except Exception as e:
+            logger.error(f"Error processing image {pending.sha256}: {str(e)}")
+            observe('image_process_seconds', time.perf_counter() - queued, 'failed')
+            _set_image_status(app, pending.sha256, 'failed')
+        else:
+            observe('image_process_seconds', time.perf_counter() - queued, 'ready')
+            _set_image_status(app, pending.sha256, 'ready')
+        return None
+    future = _get_executor(app).submit(process_image, *args)
+    future.add_done_callback(lambda f: _finish(app, pending.sha256, f, queued))
+    return future
+
+
+def _stale_claim(cutoff):
+    from models import ImageBlob
+    stale = (ImageBlob.status == 'pending') & (func.coalesce(ImageBlob.claimed_at, ImageBlob.created_at) < cutoff)
+    return stale | (ImageBlob.status == 'failed')
+
+
+def requeue_pending():
+    """
+    Re-queue blobs left pending by a restart, or failed for a reason other
+    than their content, whose raw upload still exists. Only pending blobs
+    queued more than IMAGE_CLAIM_TIMEOUT_SECONDS ago are taken, so a job
+    still running on a live worker's pool is not started twice.
+    """
+    from extensions import db
+    from models import ImageBlob
+    app = current_app._get_current_object()
+    folder = _pending_folder(app)
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config.get('IMAGE_CLAIM_TIMEOUT_SECONDS', 600))
+    stale = db.session.query(ImageBlob.sha256, ImageBlob.size, ImageBlob.folder, ImageBlob.status).filter(
+        _stale_claim(cutoff)
+    ).all()
+    count = 0
+    for sha256, size, blob_folder, status in stale:
+        raw_path = os.path.join(folder, sha256)
+        if status == 'failed' and not os.path.exists(raw_path):
+            # Undecodable; nothing to retry
+            continue
+        # Renew the claim; whoever renews it first processes the blob
+        claimed = ImageBlob.query.filter(ImageBlob.sha256 == sha256, _stale_claim(cutoff)).update(
+            {'claimed_at': datetime.utcnow(), 'status': 'pending'}, synchronize_session=False
+        )
+        db.session.commit()
+        if not claimed:
+            continue
+        if not os.path.exists(raw_path):
+            _set_image_status(app, sha256, 'failed')
+            continue
+        enqueue(PendingImage(raw_path, sha256, size, blob_folder, _renditions(app, blob_folder, sha256)))
+        count += 1
+    return count
+
+
+def collect_garbage(dry_run=False):
+    """
+    Recount blob references from the reports and archived reports, then
+    delete blobs that no report references along with their files.
+    Returns the number of blobs removed.
+    """
+    from extensions import db
+    from models import ArchivedReport, ImageBlob, MaintenanceReport
+
+    app = current_app._get_current_object()
+    # Counts maintained on upload can drift if a report row is removed by
+    # hand, so rebuild them before trusting them
+    hot, archived = [
+        db.session.query(db.func.count(report.id))
+        .filter(report.image_hash == ImageBlob.sha256)
+        .scalar_subquery()
+        for report in (MaintenanceReport, ArchivedReport)
+    ]
+    ImageBlob.query.update({ImageBlob.ref_count: hot + archived}, synchronize_session=False)
+
+    cutoff = datetime.utcnow() - GC_GRACE_PERIOD
+    garbage = ImageBlob.query.filter(
+        ImageBlob.ref_count == 0,
+        ImageBlob.created_at < cutoff,
+        ImageBlob.status != 'pending'
+    ).all()
+    pending_folder = _pending_folder(app)
+    for blob in garbage:
+        # A failed blob may have kept its raw upload for a retry
+        paths = [path for path, _, _ in _renditions(app, blob.folder, blob.sha256).values()]
+        paths.append(os.path.join(pending_folder, blob.sha256))
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            logger.info(f"{'Would remove' if dry_run else 'Removing'} {path}")
+            if not dry_run:
+                os.remove(path)
+        if not dry_run:
+            db.session.delete(blob)
+
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+        _remove_stale_parts(app, time.time() - GC_GRACE_PERIOD.total_seconds())
+    return len(garbage)
+
+
+def _remove_stale_parts(app, threshold):
+    """Delete staged uploads abandoned by requests that failed before claim()"""
+    folder = _pending_folder(app)
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name.endswith('.part') and os.path.getmtime(path) < threshold:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        command = sys.argv[1:2]
+        if command == ['requeue']:
+            print(f"Re-queued {requeue_pending()} image(s)")
+        elif command == ['gc']:
+            dry_run = '--dry-run' in sys.argv[2:]
+            removed = collect_garbage(dry_run=dry_run)
+            print(f"{'Would remove' if dry_run else 'Removed'} {removed} unreferenced image(s)")
+        else:
+            print(__doc__)
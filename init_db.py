@@ -1,13 +1,16 @@
-from app import app, db, Driver, MaintenanceReport, Workshop, Repair
+from app import app
+from extensions import db
+from models import Driver, MaintenanceReport, Workshop, Repair
 from datetime import datetime, timedelta
 import os
 from werkzeug.security import generate_password_hash
+from migrations import upgrade
 
 def init_db():
     """Initialize the database with sample data."""
     with app.app_context():
-        # Create all tables
-        db.create_all()
+        # Create or upgrade tables through versioned migrations
+        upgrade()
         
         # Only add sample data in development
         if os.environ.get('FLASK_ENV') != 'production':
@@ -38,13 +41,17 @@ def _add_sample_data():
         workshop1 = Workshop(
             name='City Center Garage', 
             location='123 Main St', 
-            contact='555-0101'
+            contact='555-0101',
+            latitude=59.3326,
+            longitude=18.0649
         )
         
         workshop2 = Workshop(
             name='Northside Auto', 
             location='456 Oak Ave', 
-            contact='555-0202'
+            contact='555-0202',
+            latitude=59.3690,
+            longitude=18.0084
         )
         
         db.session.add(workshop1)
@@ -0,0 +1,316 @@
+"""
+Request metrics in the Prometheus text format.
+
+Every request records, per endpoint: its latency, the number of SQL
+statements it ran and their total time (timed with SQLAlchemy cursor
+events), and the sizes of the request and response bodies. Staging an
+uploaded photo and processing it are timed as well. All of these are
+histograms.
+
+Each process keeps its histograms in memory and a background thread
+writes them to METRICS_DIR/worker-<pid>.json every METRICS_FLUSH_SECONDS
+when they have changed.
+GET /metrics adds up the snapshots of every gunicorn worker, so any worker
+can answer for all of them. The totals of workers that have exited are
+folded into retired.json, which keeps the sums monotonic across restarts.
+
+Requests slower than SLOW_REQUEST_SECONDS are logged on the slow_requests
+logger with their slowest SQL statements.
+
+    python metrics.py clear   # forget all recorded metrics, e.g. on deploy
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import atexit
+import logging
+import threading
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger('slow_requests')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+HTTP_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+# name -> (help, label names, bucket upper bounds)
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Time to handle a request, until the response is returned',
+                                      ('endpoint', 'method', 'status'), LATENCY_BUCKETS),
+    'http_request_sql_queries': ('SQL statements run per request', ('endpoint',), QUERY_BUCKETS),
+    'http_request_sql_seconds': ('Time spent in SQL statements per request', ('endpoint',), LATENCY_BUCKETS),
+    'http_request_size_bytes': ('Request body sizes', ('endpoint',), SIZE_BUCKETS),
+    'http_response_size_bytes': ('Response body sizes, streamed responses excluded', ('endpoint',),
+                                 SIZE_BUCKETS),
+    'image_stage_seconds': ('Time to hash and store an uploaded photo on the request path', ('source',),
+                            LATENCY_BUCKETS),
+    'image_process_seconds': ('Time from queueing a photo until its renditions are written',
+                              ('status',), LATENCY_BUCKETS + (30, 60)),
+}
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+class Registry:
+    """This process's histograms: {name: {labels: [bucket counts..., sum, count]}}"""
+
+    def __init__(self, directory, flush_seconds):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.series = {name: {} for name in HISTOGRAMS}
+        self.dirty = False
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True).start()
+
+    def observe(self, name, value, *labels):
+        buckets = HISTOGRAMS[name][2]
+        with self.lock:
+            series = self.series[name].get(labels)
+            if series is None:
+                series = self.series[name][labels] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+            self.dirty = True
+
+    def snapshot(self):
+        with self.lock:
+            return {name: [[list(labels), list(values)] for labels, values in series.items()]
+                    for name, series in self.series.items()}
+
+    def flush(self):
+        """Write this process's snapshot for the other workers to read"""
+        if not self.directory or os.getpid() != self.pid:
+            return
+        self.dirty = False
+        _write_json(os.path.join(self.directory, f'worker-{self.pid}.json'), self.snapshot())
+
+    def _flush_periodically(self):
+        # Off the request path, and idle workers still publish their last requests
+        while True:
+            time.sleep(self.flush_seconds)
+            if self.dirty:
+                try:
+                    self.flush()
+                except OSError as e:
+                    logger.warning(f"Could not write metrics snapshot: {e}")
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge(snapshots):
+    """Add up snapshots into {name: {labels: values}}"""
+    merged = {name: {} for name in HISTOGRAMS}
+    for snapshot in snapshots:
+        for name, series in snapshot.items():
+            if name not in merged:
+                continue
+            width = len(HISTOGRAMS[name][2]) + 2
+            for labels, values in series:
+                if len(values) != width:
+                    # Recorded with other buckets by an older deploy
+                    continue
+                total = merged[name].setdefault(tuple(labels), [0] * width)
+                for i, value in enumerate(values):
+                    total[i] += value
+    return merged
+
+
+def collect(registry):
+    """
+    The merged histograms of every worker sharing registry's directory.
+    Snapshots of workers that have exited are folded into retired.json.
+    """
+    registry.flush()
+    if not registry.directory:
+        return merge([registry.snapshot()])
+    directory = registry.directory
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        retired_path = os.path.join(directory, 'retired.json')
+        retired = _read_json(retired_path)
+        live, dead = [], []
+        for filename in os.listdir(directory):
+            if not (filename.startswith('worker-') and filename.endswith('.json')):
+                continue
+            path = os.path.join(directory, filename)
+            if _alive(int(filename[len('worker-'):-len('.json')])):
+                live.append(_read_json(path))
+            else:
+                dead.append(_read_json(path))
+                os.remove(path)
+        if dead:
+            merged = merge([retired] + dead)
+            retired = {name: [[list(labels), values] for labels, values in series.items()]
+                       for name, series in merged.items()}
+            _write_json(retired_path, retired)
+    return merge([retired] + live)
+
+
+def _labels(pairs):
+    return '{' + ','.join('%s="%s"' % (key, _escape(value)) for key, value in pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render(merged):
+    """Prometheus text exposition format 0.0.4"""
+    lines = []
+    for name, (help_text, label_names, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, values in sorted(merged[name].items()):
+            pairs = list(zip(label_names, labels))
+            cumulative = 0
+            for bound, count in zip(buckets, values):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(pairs + [("le", float(bound))])} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(pairs + [("le", "+Inf")])} {values[-1]}')
+            lines.append(f'{name}_sum{_labels(pairs)} {float(values[-2])!r}')
+            lines.append(f'{name}_count{_labels(pairs)} {values[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def get_registry(app=None):
+    """The metrics registry of this process, created on first use after each fork"""
+    global _registry
+    app = app or current_app._get_current_object()
+    with _registry_lock:
+        if _registry is None or _registry.pid != os.getpid():
+            directory = app.config.get('METRICS_DIR')
+            if directory is None:
+                directory = os.path.join(app.instance_path, 'metrics')
+            _registry = Registry(directory or None, app.config.get('METRICS_FLUSH_SECONDS', 1))
+            atexit.register(_registry.flush)
+        return _registry
+
+
+def observe(name, value, *labels):
+    """Record one observation; a no-op outside an app context"""
+    try:
+        get_registry().observe(name, value, *labels)
+    except RuntimeError:
+        pass
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context():
+        context.metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_started', None)
+    if started is None or not has_request_context():
+        return
+    elapsed = time.perf_counter() - started
+    sql = g.get('metrics_sql')
+    if sql is None:
+        sql = g.metrics_sql = []
+    sql.append((elapsed, statement))
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+
+
+def _record_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    app = current_app._get_current_object()
+    registry = get_registry(app)
+    endpoint = request.endpoint or 'unmatched'
+    # Clients choose the method, so only known ones become label values
+    method = request.method if request.method in HTTP_METHODS else 'other'
+    sql = g.pop('metrics_sql', [])
+    sql_seconds = sum(seconds for seconds, _ in sql)
+    registry.observe('http_request_duration_seconds', elapsed, endpoint, method, str(response.status_code))
+    registry.observe('http_request_sql_queries', len(sql), endpoint)
+    registry.observe('http_request_sql_seconds', sql_seconds, endpoint)
+    if request.content_length is not None:
+        registry.observe('http_request_size_bytes', request.content_length, endpoint)
+    if not response.is_streamed and response.content_length is not None:
+        registry.observe('http_response_size_bytes', response.content_length, endpoint)
+    if elapsed >= app.config.get('SLOW_REQUEST_SECONDS', 1.0):
+        _log_slow(app, elapsed, response, sql, sql_seconds)
+    return response
+
+
+def _log_slow(app, elapsed, response, sql, sql_seconds):
+    limit = app.config.get('SLOW_REQUEST_STATEMENTS', 10)
+    slowest = sorted(sql, key=lambda item: item[0], reverse=True)[:limit]
+    lines = [f"Slow request: {request.method} {request.full_path.rstrip('?')} -> {response.status_code} "
+             f"in {elapsed * 1000:.0f} ms, {len(sql)} SQL statements in {sql_seconds * 1000:.0f} ms"]
+    lines += [f"  {seconds * 1000:8.1f} ms  {' '.join(statement.split())[:500]}" for seconds, statement in slowest]
+    slow_logger.warning('\n'.join(lines))
+
+
+def metrics_response():
+    """The /metrics response body and headers, merged across workers"""
+    body = render(collect(get_registry()))
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def init_metrics(app):
+    """Time every request of app and the SQL it runs"""
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+
+
+def _clear(app):
+    directory = app.config.get('METRICS_DIR') or os.path.join(app.instance_path, 'metrics')
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            if filename.endswith('.json'):
+                os.remove(os.path.join(directory, filename))
+
+
+if __name__ == '__main__':
+    from app import app
+    if sys.argv[1:] != ['clear']:
+        print("usage: python metrics.py clear")
+        sys.exit(2)
+    _clear(app)
+    print("[SUCCESS] Metrics cleared")
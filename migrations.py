@@ -0,0 +1,333 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once per database, in version order, and is recorded in
+the schema_migrations table. Migrations create objects with checkfirst so
+that databases originally built by db.create_all() upgrade cleanly.
+
+    python migrations.py            # apply pending migrations
+    python migrations.py status     # list applied and pending versions
+    python migrations.py verify     # EXPLAIN the hot queries, check index use
+"""
+import sys
+import logging
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+# Advisory lock serializing upgrades on Postgres
+MIGRATION_LOCK_KEY = 0x6d696772
+
+
+def migration(version, description):
+    """Register a migration function taking a connection"""
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def _create_tables(conn, *names):
+    for name in names:
+        db.metadata.tables[name].create(conn, checkfirst=True)
+
+
+def _add_columns(conn, table_name, *names):
+    table = db.metadata.tables[table_name]
+    existing = {column['name'] for column in inspect(conn).get_columns(table_name)}
+    for name in names:
+        if name in existing:
+            continue
+        column_type = table.c[name].type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {column_type}"))
+
+
+def _create_indexes(conn, *names):
+    indexes = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+    for name in names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+@migration(1, 'Baseline schema')
+def _baseline(conn):
+    _create_tables(conn, 'driver', 'workshop', 'maintenance_report', 'repair')
+
+
+@migration(2, 'Composite indexes for report listings and repair joins')
+def _report_indexes(conn):
+    _create_indexes(
+        conn,
+        'ix_maintenance_report_driver_reported',
+        'ix_maintenance_report_reported',
+        'ix_maintenance_report_truck_reported',
+        'ix_maintenance_report_status_reported',
+        'ix_repair_report_id',
+        'ix_repair_workshop_id',
+    )
+
+
+@migration(3, 'Track background image processing status on reports')
+def _report_image_status(conn):
+    _add_columns(conn, 'maintenance_report', 'image_status')
+
+
+@migration(4, 'Store image rendition URLs on reports')
+def _report_image_renditions(conn):
+    _add_columns(conn, 'maintenance_report', 'image_renditions')
+
+
+@migration(5, 'Content-addressed image storage')
+def _image_blobs(conn):
+    _create_tables(conn, 'image_blob')
+    _add_columns(conn, 'maintenance_report', 'image_hash')
+    _create_indexes(conn, 'ix_maintenance_report_image_hash')
+
+
+@migration(6, 'Idempotency keys for bulk report ingestion')
+def _report_idempotency_key(conn):
+    _add_columns(conn, 'maintenance_report', 'idempotency_key')
+    _create_indexes(conn, 'ux_maintenance_report_idempotency_key')
+
+
+@migration(7, 'Summary tables for fleet statistics')
+def _fleet_stats(conn):
+    from stats import rebuild
+    _create_tables(conn, 'stats_report_status', 'stats_truck_open_issues',
+                   'stats_workshop_repairs', 'stats_weekly_reports')
+    rebuild(conn)
+
+
+@migration(8, 'Full-text search over issue descriptions and repair notes')
+def _full_text_search(conn):
+    from search import create_search_index
+    create_search_index(conn)
+
+
+@migration(9, 'Row versions and tombstones for conditional GET and delta sync')
+def _report_versions(conn):
+    _add_columns(conn, 'maintenance_report', 'updated_at')
+    conn.execute(text("UPDATE maintenance_report SET updated_at = reported_date WHERE updated_at IS NULL"))
+    _create_tables(conn, 'deleted_report')
+    _create_indexes(conn, 'ix_maintenance_report_driver_updated')
+
+
+@migration(10, 'Workshop coordinates with a spatial index')
+def _workshop_locations(conn):
+    from geo import create_spatial_index
+    _add_columns(conn, 'workshop', 'latitude', 'longitude')
+    _create_indexes(conn, 'ix_workshop_name')
+    create_spatial_index(conn)
+
+
+@migration(11, 'Report positions and workshop capacity for the repair scheduler')
+def _scheduler_inputs(conn):
+    _add_columns(conn, 'maintenance_report', 'latitude', 'longitude')
+    _add_columns(conn, 'workshop', 'capacity')
+    conn.execute(text("UPDATE workshop SET capacity = 5 WHERE capacity IS NULL"))
+
+
+@migration(12, 'Replication heartbeat for replica lag checks')
+def _replication_heartbeat(conn):
+    _create_tables(conn, 'replication_heartbeat')
+    if conn.execute(text("SELECT count(*) FROM replication_heartbeat")).scalar() == 0:
+        conn.execute(text("INSERT INTO replication_heartbeat (id, beat_at) VALUES (1, :now)"),
+                     {'now': datetime.utcnow()})
+
+
+@migration(13, 'Archive tables for closed reports and their repairs')
+def _report_archive(conn):
+    _create_tables(conn, 'archived_report', 'archived_repair')
+    _create_indexes(conn, 'ix_archived_repair_report_id')
+
+
+@migration(14, 'Processing claims on image blobs')
+def _image_claims(conn):
+    _add_columns(conn, 'image_blob', 'claimed_at')
+
+
+@migration(15, 'Outbox of changes made outside the web workers')
+def _outbox(conn):
+    _create_tables(conn, 'outbox_message')
+    _create_indexes(conn, 'ix_outbox_message_created_at')
+
+
+def _rebuild_autoincrement(conn, name, archive):
+    """Recreate a SQLite table as declared (AUTOINCREMENT), numbering on after its archive"""
+    created = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                           {'name': name}).scalar()
+    if 'AUTOINCREMENT' not in created.upper():
+        # Indexes and triggers go with the old table and are created again
+        dependents = conn.execute(text(
+            "SELECT sql FROM sqlite_master WHERE tbl_name = :name AND type IN ('index', 'trigger') "
+            "AND sql IS NOT NULL"), {'name': name}).scalars().all()
+        table = db.metadata.tables[name]
+        create = str(CreateTable(table).compile(dialect=conn.dialect))
+        conn.execute(text(create.replace(f'CREATE TABLE {name} ', f'CREATE TABLE {name}_rebuild ', 1)))
+        columns = ', '.join(column.name for column in table.c)
+        conn.execute(text(f"INSERT INTO {name}_rebuild ({columns}) SELECT {columns} FROM {name}"))
+        conn.execute(text(f"DROP TABLE {name}"))
+        conn.execute(text(f"ALTER TABLE {name}_rebuild RENAME TO {name}"))
+        for sql in dependents:
+            conn.execute(text(sql))
+    conn.execute(text("INSERT INTO sqlite_sequence (name, seq) SELECT :name, 0 "
+                      "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"), {'name': name})
+    conn.execute(text(f"UPDATE sqlite_sequence SET seq = max(seq, (SELECT coalesce(max(id), 0) FROM {name}), "
+                      f"(SELECT coalesce(max(id), 0) FROM {archive})) WHERE name = :name"), {'name': name})
+
+
+@migration(16, 'Keep the ids and idempotency keys of archived reports taken')
+def _archive_keys(conn):
+    _create_indexes(conn, 'ix_archived_report_idempotency_key')
+    # Postgres sequences never go back; SQLite reuses the highest ids freed
+    # unless the table is AUTOINCREMENT, which takes rebuilding it
+    if conn.dialect.name != 'sqlite':
+        return
+    # Triggers of other tables name these; let the rename leave them be
+    conn.execute(text("PRAGMA legacy_alter_table = ON"))
+    try:
+        _rebuild_autoincrement(conn, 'maintenance_report', 'archived_report')
+        _rebuild_autoincrement(conn, 'repair', 'archived_repair')
+    finally:
+        conn.execute(text("PRAGMA legacy_alter_table = OFF"))
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " version INTEGER PRIMARY KEY,"
+        " description VARCHAR(200) NOT NULL,"
+        " applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def applied_versions(engine=None):
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def upgrade(engine=None):
+    """Apply all pending migrations, each in its own transaction"""
+    engine = engine or db.engine
+    done = applied_versions(engine)
+    applied = []
+    for version, description, fn in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            if conn.dialect.name == 'sqlite':
+                # pysqlite runs DDL outside a transaction unless one is open:
+                # take the write lock first, so a migration applies whole or
+                # not at all and a process upgrading alongside waits its turn
+                conn.execute(text("BEGIN IMMEDIATE"))
+            elif conn.dialect.name == 'postgresql':
+                conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+            if conn.execute(text("SELECT 1 FROM schema_migrations WHERE version = :version"),
+                            {'version': version}).first():
+                continue
+            fn(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) "
+                     "VALUES (:version, :description, :applied_at)"),
+                {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+            )
+        logger.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+# Hot query shapes and the index each one must use. Keep these in step with
+# pagination.py and serializers.py.
+HOT_QUERIES = [
+    ('ix_maintenance_report_driver_reported',
+     "SELECT id FROM maintenance_report WHERE driver_id = :driver_id "
+     "ORDER BY reported_date DESC, id DESC LIMIT 11",
+     {'driver_id': 1}),
+    ('ix_maintenance_report_reported',
+     "SELECT id FROM maintenance_report "
+     "WHERE reported_date < :reported_date "
+     "ORDER BY reported_date DESC, id DESC LIMIT 11",
+     {'reported_date': datetime(2100, 1, 1)}),
+    ('ix_maintenance_report_truck_reported',
+     "SELECT id FROM maintenance_report WHERE truck_id = :truck_id "
+     "ORDER BY reported_date DESC, id DESC LIMIT 11",
+     {'truck_id': 'TRK101'}),
+    ('ix_maintenance_report_status_reported',
+     "SELECT id FROM maintenance_report WHERE status = :status "
+     "ORDER BY reported_date DESC, id DESC LIMIT 11",
+     {'status': 'reported'}),
+    ('ix_repair_report_id',
+     "SELECT id FROM repair WHERE report_id IN (1, 2, 3)",
+     {}),
+    ('ix_repair_workshop_id',
+     "SELECT id FROM repair WHERE workshop_id = :workshop_id",
+     {'workshop_id': 1}),
+]
+
+
+def explain(conn, sql, params):
+    """Return the query plan for sql as a single string"""
+    if conn.dialect.name == 'sqlite':
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params)
+        return '\n'.join(str(row[-1]) for row in rows)
+    rows = conn.execute(text(f"EXPLAIN {sql}"), params)
+    return '\n'.join(str(row[0]) for row in rows)
+
+
+def verify_indexes(engine=None):
+    """
+    EXPLAIN each hot query and return a list of (index, plan) pairs where the
+    expected index was not used. An empty list means every query is covered.
+    """
+    engine = engine or db.engine
+    failures = []
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            if conn.dialect.name == 'postgresql':
+                # Small or empty tables make sequential scans cheapest; we
+                # only want to know whether the index is usable.
+                conn.execute(text("SET LOCAL enable_seqscan = off"))
+            for index, sql, params in HOT_QUERIES:
+                plan = explain(conn, sql, params)
+                if index not in plan:
+                    failures.append((index, plan))
+        finally:
+            trans.rollback()
+    return failures
+
+
+def _main(argv):
+    from app import app
+    command = argv[0] if argv else 'upgrade'
+    with app.app_context():
+        if command == 'upgrade':
+            applied = upgrade()
+            print(f"Applied {len(applied)} migration(s)" if applied else "Database is up to date")
+        elif command == 'status':
+            done = applied_versions()
+            for version, description, _ in MIGRATIONS:
+                print(f"{'[x]' if version in done else '[ ]'} {version:04d} {description}")
+        elif command == 'verify':
+            failures = verify_indexes()
+            for index, plan in failures:
+                print(f"[FAIL] {index} not used:\n{plan}")
+            if failures:
+                return 1
+            print(f"[OK] {len(HOT_QUERIES)} hot queries use their indexes "
+                  f"on {db.engine.dialect.name}")
+        else:
+            print(__doc__)
+            return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv[1:]))
@@ -1,5 +1,5 @@
 from datetime import datetime
-from app import db
+from extensions import db
 
 class Driver(db.Model):
     __tablename__ = 'driver'
@@ -14,15 +14,13 @@ class Driver(db.Model):
     reports = db.relationship('MaintenanceReport', back_populates='driver')
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'email': self.email,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+        from serializers import DRIVER
+        return DRIVER.dump(self)
 
 class MaintenanceReport(db.Model):
     __tablename__ = 'maintenance_report'
+    # SQLite would otherwise hand the ids of archived reports out again
+    __table_args__ = {'sqlite_autoincrement': True}
     
     id = db.Column(db.Integer, primary_key=True)
     truck_id = db.Column(db.String(50), nullable=False)
@@ -30,6 +28,13 @@ class MaintenanceReport(db.Model):
     reported_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     status = db.Column(db.String(20), default='reported')  # reported, in_progress, completed, cancelled
     image_url = db.Column(db.String(500), nullable=True)
+    image_status = db.Column(db.String(20), nullable=True)  # pending, ready, failed
+    image_renditions = db.Column(db.JSON, nullable=True)  # {'thumb': url, 'medium': url, 'full': url}
+    image_hash = db.Column(db.String(64), nullable=True)  # sha256 of the upload, see ImageBlob
+    idempotency_key = db.Column(db.String(100), nullable=True)  # client supplied, makes retries safe
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)  # row version for sync
+    latitude = db.Column(db.Float, nullable=True)  # where the truck was, used by scheduler.py
+    longitude = db.Column(db.Float, nullable=True)
     driver_id = db.Column(db.Integer, db.ForeignKey('driver.id'), nullable=False)
     
     # Relationships
@@ -37,16 +42,72 @@ class MaintenanceReport(db.Model):
     repairs = db.relationship('Repair', back_populates='report')
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'truck_id': self.truck_id,
-            'issue_description': self.issue_description,
-            'reported_date': self.reported_date.isoformat() if self.reported_date else None,
-            'status': self.status,
-            'image_url': self.image_url,
-            'driver_id': self.driver_id,
-            'repair': self.repairs[0].to_dict() if self.repairs else None
-        }
+        # Eager load repairs and their workshops (serializers.REPORT_DETAIL_OPTIONS)
+        # before calling this on more than one report
+        from serializers import report_summary, repair_detail
+        data = report_summary(self)
+        data['repair'] = repair_detail(self.repairs[0]) if self.repairs else None
+        return data
+
+# Composite indexes for the hot report query shapes: per-driver and
+# dashboard keyset listings (newest first) and the truck/status filters.
+# Lookups by (id, driver_id) are served by the primary key.
+db.Index('ix_maintenance_report_driver_reported', MaintenanceReport.driver_id,
+         MaintenanceReport.reported_date.desc(), MaintenanceReport.id.desc())
+db.Index('ix_maintenance_report_reported', MaintenanceReport.reported_date.desc(),
+         MaintenanceReport.id.desc())
+db.Index('ix_maintenance_report_truck_reported', MaintenanceReport.truck_id,
+         MaintenanceReport.reported_date)
+db.Index('ix_maintenance_report_status_reported', MaintenanceReport.status,
+         MaintenanceReport.reported_date)
+
+db.Index('ix_maintenance_report_image_hash', MaintenanceReport.image_hash)
+db.Index('ux_maintenance_report_idempotency_key', MaintenanceReport.idempotency_key, unique=True)
+db.Index('ix_maintenance_report_driver_updated', MaintenanceReport.driver_id,
+         MaintenanceReport.updated_at, MaintenanceReport.id)
+
+class DeletedReport(db.Model):
+    """Tombstone left by a deleted report so delta sync can tell clients"""
+    __tablename__ = 'deleted_report'
+    
+    report_id = db.Column(db.Integer, primary_key=True)
+    driver_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+db.Index('ix_deleted_report_driver_deleted', DeletedReport.driver_id, DeletedReport.deleted_at)
+
+class ReplicationHeartbeat(db.Model):
+    """One row the primary keeps bumping; how old it is on a replica is its lag (database.py)"""
+    __tablename__ = 'replication_heartbeat'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
+class OutboxMessage(db.Model):
+    """Status events and cache tags a background job committed, for the web workers (outbox.py)"""
+    __tablename__ = 'outbox_message'
+    # Relays track the last id they delivered, so ids must never be reused
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    events = db.Column(db.JSON, nullable=True)
+    tags = db.Column(db.JSON, nullable=True)
+
+db.Index('ix_outbox_message_created_at', OutboxMessage.created_at)
+
+class ImageBlob(db.Model):
+    """One stored photo, addressed by the sha256 of its uploaded bytes"""
+    __tablename__ = 'image_blob'
+    
+    sha256 = db.Column(db.String(64), primary_key=True)
+    folder = db.Column(db.String(50), nullable=False, default='reports')
+    size = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, ready, failed
+    renditions = db.Column(db.JSON, nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # reports using this image
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime, nullable=True)  # last queued for processing, see images.requeue_pending
 
 class Workshop(db.Model):
     __tablename__ = 'workshop'
@@ -55,22 +116,24 @@ class Workshop(db.Model):
     name = db.Column(db.String(100), nullable=False)
     location = db.Column(db.String(200), nullable=True)
     contact = db.Column(db.String(50), nullable=True)
+    latitude = db.Column(db.Float, nullable=True)  # WGS84 degrees, indexed by geo.py
+    longitude = db.Column(db.Float, nullable=True)
+    capacity = db.Column(db.Integer, nullable=True, default=5)  # open repairs it takes on, 0 opts out of scheduling
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     repairs = db.relationship('Repair', back_populates='workshop')
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'location': self.location,
-            'contact': self.contact,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+        from serializers import WORKSHOP
+        return WORKSHOP.dump(self)
+
+# Keyset pagination of the workshop list
+db.Index('ix_workshop_name', Workshop.name, Workshop.id)
 
 class Repair(db.Model):
     __tablename__ = 'repair'
+    __table_args__ = {'sqlite_autoincrement': True}
     
     id = db.Column(db.Integer, primary_key=True)
     report_id = db.Column(db.Integer, db.ForeignKey('maintenance_report.id'), nullable=False)
@@ -87,15 +150,82 @@ class Repair(db.Model):
     workshop = db.relationship('Workshop', back_populates='repairs')
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'report_id': self.report_id,
-            'workshop_id': self.workshop_id,
-            'workshop_name': self.workshop.name if self.workshop else None,
-            'start_date': self.start_date.isoformat() if self.start_date else None,
-            'end_date': self.end_date.isoformat() if self.end_date else None,
-            'status': self.status,
-            'notes': self.notes,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
+        from serializers import repair_detail
+        return repair_detail(self)
+
+db.Index('ix_repair_report_id', Repair.report_id)
+db.Index('ix_repair_workshop_id', Repair.workshop_id)
+
+# Cold storage for closed reports and their repairs, moved out of the hot
+# tables by archive.py. Same columns, read only, and indexed for lookups by
+# id alone so the archive costs nothing on the listing paths.
+class ArchivedReport(db.Model):
+    __tablename__ = 'archived_report'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    truck_id = db.Column(db.String(50), nullable=False)
+    issue_description = db.Column(db.Text, nullable=False)
+    reported_date = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20))
+    image_url = db.Column(db.String(500), nullable=True)
+    image_status = db.Column(db.String(20), nullable=True)
+    image_renditions = db.Column(db.JSON, nullable=True)
+    image_hash = db.Column(db.String(64), nullable=True)
+    idempotency_key = db.Column(db.String(100), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    driver_id = db.Column(db.Integer, db.ForeignKey('driver.id'), nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Relationships
+    driver = db.relationship('Driver')
+    repairs = db.relationship('ArchivedRepair', back_populates='report', order_by='ArchivedRepair.id')
+
+class ArchivedRepair(db.Model):
+    __tablename__ = 'archived_repair'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    report_id = db.Column(db.Integer, db.ForeignKey('archived_report.id'), nullable=False)
+    workshop_id = db.Column(db.Integer, db.ForeignKey('workshop.id'), nullable=True)
+    start_date = db.Column(db.DateTime, nullable=True)
+    end_date = db.Column(db.DateTime, nullable=True)
+    status = db.Column(db.String(20))
+    notes = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+
+    # Relationships
+    report = db.relationship('ArchivedReport', back_populates='repairs')
+    workshop = db.relationship('Workshop')
+
+db.Index('ix_archived_repair_report_id', ArchivedRepair.report_id)
+# Retried bulk rows of archived reports are still duplicates (bulk.py)
+db.Index('ix_archived_report_idempotency_key', ArchivedReport.idempotency_key)
+
+# Summary tables behind the fleet statistics endpoint. They are kept up to
+# date by stats.py as reports and repairs change; never write them directly.
+class ReportStatusCount(db.Model):
+    __tablename__ = 'stats_report_status'
+    
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class TruckOpenIssues(db.Model):
+    __tablename__ = 'stats_truck_open_issues'
+    
+    truck_id = db.Column(db.String(50), primary_key=True)
+    open_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+class WorkshopRepairStats(db.Model):
+    __tablename__ = 'stats_workshop_repairs'
+    
+    workshop_id = db.Column(db.Integer, primary_key=True)
+    completed_count = db.Column(db.Integer, nullable=False, default=0)  # repairs with start and end dates
+    total_repair_seconds = db.Column(db.Float, nullable=False, default=0)
+
+class WeeklyReportCount(db.Model):
+    __tablename__ = 'stats_weekly_reports'
+    
+    week_start = db.Column(db.Date, primary_key=True)  # Monday of the ISO week
+    count = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,121 @@
+"""
+Status events and response cache invalidations from processes that serve
+no requests, such as the repair scheduler.
+
+The scheduler runs as its own service, possibly on another host, where
+neither the event sockets nor a memory cache of the web workers can be
+reached. Instead it adds an outbox_message row holding the events to
+publish and the cache tags to invalidate, in the same transaction as the
+change itself, so a message exists exactly when its change committed.
+
+Every web worker polls the table every OUTBOX_POLL_SECONDS from a
+background thread, started by its first request, and hands the messages
+committed since its last poll to its own event streams and response
+cache. A worker starts from the newest message at that point; what came
+before cannot be in its cache. Writers delete messages older than
+OUTBOX_RETENTION_SECONDS. Messages are read in id order, which is commit
+order as long as one job writes at a time (the scheduler runs once).
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, select
+from extensions import db
+from models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# Messages delivered per poll; the rest follow on the next one
+POLL_LIMIT = 500
+
+_relay = None
+_relay_lock = threading.Lock()
+
+
+def add(events=(), tags=()):
+    """Queue events and cache tags in the session's transaction, sent once it commits"""
+    events, tags = list(events), sorted(set(tags))
+    if not events and not tags:
+        return
+    now = datetime.utcnow()
+    retention = timedelta(seconds=current_app.config.get('OUTBOX_RETENTION_SECONDS', 3600))
+    OutboxMessage.query.filter(OutboxMessage.created_at < now - retention).delete(synchronize_session=False)
+    db.session.add(OutboxMessage(created_at=now, events=events or None, tags=tags or None))
+
+
+class OutboxRelay:
+    """Delivers outbox messages to this process's event streams and response cache"""
+
+    def __init__(self, app, start=True):
+        self.app = app
+        self.pid = os.getpid()
+        self.last_id = None
+        try:
+            self.last_id = self._newest()
+        except Exception as e:
+            # Never fail the request that starts the relay; the first poll retries
+            logger.warning(f"Outbox unavailable: {e}")
+        if start:
+            threading.Thread(target=self._poll_periodically, name='outbox-relay', daemon=True).start()
+
+    def _newest(self):
+        table = OutboxMessage.__table__
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                return conn.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar()
+
+    def poll(self):
+        """Deliver the messages committed since the last poll; returns how many"""
+        from cache import get_cache
+        from events import get_bus
+        if self.last_id is None:
+            self.last_id = self._newest()
+            return 0
+        table = OutboxMessage.__table__
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                rows = conn.execute(
+                    select(table.c.id, table.c.events, table.c.tags)
+                    .where(table.c.id > self.last_id).order_by(table.c.id).limit(POLL_LIMIT)
+                ).fetchall()
+        for message_id, events, tags in rows:
+            if tags:
+                cache = get_cache(self.app)
+                if cache is not None:
+                    cache.invalidate(set(tags))
+            if events:
+                get_bus(self.app).dispatch(events)
+            self.last_id = message_id
+        return len(rows)
+
+    def _poll_periodically(self):
+        interval = self.app.config['OUTBOX_POLL_SECONDS']
+        while True:
+            time.sleep(interval)
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Outbox poll failed: {e}")
+
+
+def start_relay():
+    """Poll the outbox from this worker, once per process"""
+    global _relay
+    relay = _relay
+    if relay is not None and relay.pid == os.getpid():
+        return
+    app = current_app._get_current_object()
+    if not app.config.get('OUTBOX_POLL_SECONDS'):
+        return
+    with _relay_lock:
+        # Threads do not survive fork
+        if _relay is None or _relay.pid != os.getpid():
+            _relay = OutboxRelay(app)
+
+
+def init_outbox(app):
+    """Have each worker of app relay outbox messages, from its first request on"""
+    app.before_request(start_relay)
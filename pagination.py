@@ -0,0 +1,150 @@
+import base64
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, or_
+from models import MaintenanceReport, Workshop
+
+REPORT_STATUSES = ('reported', 'pending', 'in_progress', 'completed', 'cancelled')
+REPORT_FILTERS = ('status', 'truck_id', 'start_date', 'end_date')
+
+
+class PaginationError(ValueError):
+    """Raised when pagination or filter query parameters are invalid"""
+
+
+def encode_cursor(report):
+    """Encode the (reported_date, id) keyset position of a report"""
+    raw = f"{report.reported_date.isoformat()}|{report.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor into (reported_date, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        reported_date, report_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(reported_date), int(report_id)
+    except (ValueError, UnicodeDecodeError):
+        raise PaginationError('Invalid cursor')
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise PaginationError(f'Invalid {name}, expected ISO 8601 date')
+
+
+def get_page_size(args):
+    """Resolve per_page from the request, capped at MAX_ITEMS_PER_PAGE"""
+    default = current_app.config.get('ITEMS_PER_PAGE', 10)
+    maximum = current_app.config.get('MAX_ITEMS_PER_PAGE', 100)
+    try:
+        per_page = int(args.get('per_page', default))
+    except (TypeError, ValueError):
+        raise PaginationError('per_page must be an integer')
+    if per_page < 1:
+        raise PaginationError('per_page must be positive')
+    return min(per_page, maximum)
+
+
+def filter_reports(query, args, model=MaintenanceReport):
+    """Apply status, truck_id and date range filters to a report query on model"""
+    status = args.get('status')
+    if status:
+        if status not in REPORT_STATUSES:
+            raise PaginationError(f'Invalid status: {status}')
+        query = query.filter(model.status == status)
+
+    truck_id = args.get('truck_id')
+    if truck_id:
+        query = query.filter(model.truck_id == truck_id)
+
+    start_date = args.get('start_date')
+    if start_date:
+        query = query.filter(model.reported_date >= _parse_date(start_date, 'start_date'))
+
+    end_date = args.get('end_date')
+    if end_date:
+        end = _parse_date(end_date, 'end_date')
+        if len(end_date) == 10:
+            # A bare date includes the whole day
+            query = query.filter(model.reported_date < end + timedelta(days=1))
+        else:
+            query = query.filter(model.reported_date <= end)
+
+    return query
+
+
+def paginate_reports(query, args):
+    """
+    Return one keyset page of reports, newest first.
+
+    Ordering is on (reported_date, id) so each page is an index range scan
+    instead of an OFFSET that grows with the page number. Returns the list
+    of reports and the pagination meta block for the response.
+    """
+    per_page = get_page_size(args)
+    query = filter_reports(query, args)
+
+    cursor = args.get('cursor')
+    if cursor:
+        reported_date, report_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            MaintenanceReport.reported_date < reported_date,
+            and_(MaintenanceReport.reported_date == reported_date,
+                 MaintenanceReport.id < report_id)
+        ))
+
+    rows = query.order_by(
+        MaintenanceReport.reported_date.desc(),
+        MaintenanceReport.id.desc()
+    ).limit(per_page + 1).all()
+
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    return items, {
+        'per_page': per_page,
+        'has_more': has_more,
+        'next_cursor': encode_cursor(items[-1]) if has_more else None
+    }
+
+
+def encode_workshop_cursor(workshop):
+    """Encode the (name, id) keyset position of a workshop"""
+    raw = f"{workshop.id}|{workshop.name}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_workshop_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        # Names may contain '|', ids never do
+        workshop_id, name = raw.split('|', 1)
+        return name, int(workshop_id)
+    except (ValueError, UnicodeDecodeError):
+        raise PaginationError('Invalid cursor')
+
+
+def paginate_workshops(query, args):
+    """One keyset page of workshops in (name, id) order, as paginate_reports"""
+    per_page = get_page_size(args)
+    cursor = args.get('cursor')
+    if cursor:
+        name, workshop_id = decode_workshop_cursor(cursor)
+        query = query.filter(or_(
+            Workshop.name > name,
+            and_(Workshop.name == name, Workshop.id > workshop_id)
+        ))
+
+    rows = query.order_by(Workshop.name, Workshop.id).limit(per_page + 1).all()
+
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    return items, {
+        'per_page': per_page,
+        'has_more': has_more,
+        'next_cursor': encode_workshop_cursor(items[-1]) if has_more else None
+    }
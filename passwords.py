@@ -0,0 +1,133 @@
+"""
+Password hashing off the request path.
+
+Hashing and checking passwords is deliberately slow, so a burst of logins
+at a shift change would otherwise tie up every request thread. The work
+runs on a small process pool instead (PASSWORD_WORKERS per web worker),
+and at most PASSWORD_MAX_PENDING hashes may be queued or running at once.
+Beyond that, or when a hash takes longer than PASSWORD_TIMEOUT seconds,
+PasswordHashingBusy is raised at once and callers answer 503 with a
+Retry-After, rather than letting logins pile up behind each other.
+
+Hashes are stored with the parameters in PASSWORD_METHOD. A successful
+login whose stored hash uses other parameters (an older iteration count,
+another algorithm) is rehashed in the same pool task and saved.
+
+PASSWORD_WORKERS = 0 hashes inline, which keeps tests deterministic.
+"""
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when the hashing pool is saturated and the request should be retried later"""
+
+
+class _Pool:
+    def __init__(self, workers, max_pending):
+        # spawn rather than fork: the web worker may hold DB connections
+        # and threads that must not be duplicated into the children
+        context = multiprocessing.get_context('spawn')
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pid = os.getpid()
+
+
+def _get_pool(app):
+    global _pool
+    with _pool_lock:
+        # Pools do not survive fork, so each gunicorn worker builds its own
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = _Pool(app.config['PASSWORD_WORKERS'], app.config.get('PASSWORD_MAX_PENDING', 4))
+        return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+
+
+def needs_rehash(stored, method=DEFAULT_METHOD):
+    """True if stored was not hashed with method, spelled as werkzeug stores it"""
+    return stored.split('$', 1)[0] != method
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _check(stored, password, method):
+    """(matches, new hash or None); runs in the pool"""
+    if not check_password_hash(stored, password):
+        return False, None
+    if needs_rehash(stored, method):
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+
+def _run(fn, *args):
+    app = current_app._get_current_object()
+    if not app.config.get('PASSWORD_WORKERS'):
+        return fn(*args)
+    pool = _get_pool(app)
+    if not pool.slots.acquire(blocking=False):
+        raise PasswordHashingBusy()
+    try:
+        future = pool.executor.submit(fn, *args)
+    except BrokenProcessPool:
+        pool.slots.release()
+        _reset_pool(pool)
+        raise PasswordHashingBusy()
+    except BaseException:
+        pool.slots.release()
+        raise
+    # The slot is held until the hash really finishes, even if the request
+    # has given up on it, so the limit tracks the pool's actual load
+    future.add_done_callback(lambda f: pool.slots.release())
+    try:
+        return future.result(timeout=app.config.get('PASSWORD_TIMEOUT', 10))
+    except FutureTimeout:
+        future.cancel()
+        raise PasswordHashingBusy()
+    except BrokenProcessPool:
+        logger.error("Password hashing pool died, starting a new one")
+        _reset_pool(pool)
+        raise PasswordHashingBusy()
+
+
+def hash_password(password):
+    """Hash a new password with PASSWORD_METHOD"""
+    return _run(_hash, password, current_app.config.get('PASSWORD_METHOD', DEFAULT_METHOD))
+
+
+def verify_password(user, password):
+    """
+    True if password matches user's stored hash. An outdated hash is
+    replaced and committed; failing to save it does not fail the login.
+    """
+    from extensions import db
+    method = current_app.config.get('PASSWORD_METHOD', DEFAULT_METHOD)
+    matches, upgraded = _run(_check, user.password, password, method)
+    if upgraded:
+        user.password = upgraded
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Could not save rehashed password for driver {user.id}: {e}")
+    return matches
@@ -0,0 +1,64 @@
+import threading
+from contextlib import contextmanager
+from flask import current_app
+from sqlalchemy import event
+from database import replica_keys
+from extensions import db
+
+
+def app_engines(app=None):
+    """The app's primary engine and one per bind, replicas included"""
+    app = app or current_app._get_current_object()
+    replica_keys(app)  # registers the replica binds
+    return [db.get_engine(app, bind=key) for key in [None] + list(app.config.get('SQLALCHEMY_BINDS') or {})]
+
+
+class QueryCounter:
+    """
+    Record every SQL statement this thread executes on the app's engines
+    (or the given one) while active. Background threads, such as replica
+    checks and image results, are not counted.
+    """
+
+    def __init__(self, engine=None):
+        self.engines = [engine] if engine is not None else None
+        self.statements = []
+        self.thread = None
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread:
+            self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        if self.engines is None:
+            self.engines = app_engines()
+        self.thread = threading.get_ident()
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self._before_cursor_execute)
+        return False
+
+
+@contextmanager
+def assert_max_queries(limit, engine=None):
+    """
+    Fail if the wrapped block runs more than `limit` SQL statements.
+
+    Use around test client calls to pin listing endpoints to a fixed query
+    budget, e.g. ``with assert_max_queries(2): client.get('/api/get-reports')``.
+    """
+    with QueryCounter(engine) as counter:
+        yield counter
+    if counter.count > limit:
+        raise AssertionError(
+            f"Expected at most {limit} queries, got {counter.count}:\n"
+            + "\n".join(counter.statements)
+        )
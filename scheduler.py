@@ -0,0 +1,322 @@
+"""
+Batch assignment of open reports to workshops.
+
+Each run takes the oldest SCHEDULER_BATCH_SIZE reports that are still
+'reported' and have no repair, and plans them all at once in memory:
+
+- Workshops are bucketed in a lat/lon grid, so each located report finds
+  its SCHEDULER_CANDIDATES nearest workshops with free capacity (within
+  SCHEDULER_MAX_DISTANCE_KM) without touching the database.
+- Reports go on one min-heap keyed by the cost of their cheapest
+  candidate: the distance plus SCHEDULER_QUEUE_KM for each full queue the
+  workshop would have (open repairs / capacity). The cheapest is popped
+  and assigned; if its candidates have filled up since it was pushed it
+  is re-costed and pushed back, so the heap stays one entry per report.
+- Reports without a position go to the least loaded workshops, taken
+  from a second heap keyed by load.
+
+A workshop's capacity is the number of open (pending or in progress)
+repairs it takes; 0 opts it out. The plan is a queue of reports per
+workshop, written as pending Repair rows with one executemany. A report
+that gained a repair since it was read is skipped by the insert itself,
+so a run never double books a report.
+
+    python scheduler.py once [--dry-run]   # plan and write one batch
+    python scheduler.py loop               # every SCHEDULER_INTERVAL_SECONDS
+"""
+import sys
+import math
+import time
+import heapq
+import logging
+from collections import defaultdict, deque
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import text, func
+from extensions import db
+from models import MaintenanceReport, Repair, Workshop
+from geo import EARTH_RADIUS_KM
+import outbox
+
+logger = logging.getLogger(__name__)
+
+OPEN_REPAIR_STATUSES = ('pending', 'in_progress')
+GRID_DEGREES = 0.25
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+INSERT_REPAIR = text(
+    "INSERT INTO repair (report_id, workshop_id, status, notes, created_at, updated_at) "
+    "SELECT :report_id, :workshop_id, 'pending', :notes, :now, :now "
+    "WHERE NOT EXISTS (SELECT 1 FROM repair WHERE report_id = :report_id) "
+    "AND EXISTS (SELECT 1 FROM maintenance_report WHERE id = :report_id AND status = 'reported')"
+)
+
+
+class WorkshopGrid:
+    """
+    Workshops bucketed in GRID_DEGREES cells. nearest() scans rings of
+    cells outwards from the report's cell, each cell once, and stops as
+    soon as nothing beyond the rings scanned can be closer than what it
+    has found.
+    """
+
+    def __init__(self, locations):
+        """locations are (index, lat, lon); index is what nearest() returns"""
+        self.columns = round(360 / GRID_DEGREES)
+        self.cell_km = GRID_DEGREES * KM_PER_DEGREE
+        self.cells = defaultdict(list)
+        for index, lat, lon in locations:
+            if lat is not None and lon is not None:
+                # Radians and cos(lat) up front, the distance runs per candidate
+                self.cells[self._cell(lat, lon)].append(
+                    (index, math.radians(lat), math.radians(lon), math.cos(math.radians(lat)))
+                )
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / GRID_DEGREES), math.floor(lon / GRID_DEGREES) % self.columns
+
+    def _beyond_km(self, lat, ring):
+        """Lower bound on the distance from a point at lat to any cell outside ring"""
+        # Cells differ by at least ring rows in latitude, or by at least
+        # ring columns in longitude: no nearer than the meridian that far off
+        offset = math.radians(min(ring * GRID_DEGREES, 90))
+        along = EARTH_RADIUS_KM * math.asin(math.sin(offset) * math.cos(math.radians(lat)))
+        return min(ring * self.cell_km, along)
+
+    def nearest(self, lat, lon, count, max_km):
+        """The count nearest workshops within max_km as [(distance, index)], closest first"""
+        row, column = self._cell(lat, lon)
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        cos1 = math.cos(lat1)
+        sin, asin, sqrt = math.sin, math.asin, math.sqrt
+        cells, columns = self.cells, self.columns
+        # Candidates are ranked by the haversine term, which orders like the
+        # distance; only the ones returned are converted to km
+        limit = math.sin(min(max_km / EARTH_RADIUS_KM, math.pi) / 2) ** 2
+        found, seen = [], set()
+        ring = 0
+        while True:
+            if ring == 0:
+                block = [(row, column)]
+            elif (2 * ring + 1) ** 2 >= len(cells):
+                # Sparse grid: the rings would cover more cells than are
+                # occupied, so finish with one pass over the occupied ones left
+                block = [key for key in cells if key not in seen]
+                ring = columns
+            else:
+                top, bottom = row - ring, row + ring
+                block = [(top, column + c) for c in range(-ring, ring + 1)]
+                block += [(bottom, column + c) for c in range(-ring, ring + 1)]
+                block += [(row + r, column - ring) for r in range(-ring + 1, ring)]
+                block += [(row + r, column + ring) for r in range(-ring + 1, ring)]
+            for r, c in block:
+                key = (r, c % columns)
+                if key in seen:
+                    # Rings wider than the globe wrap onto cells already scanned
+                    continue
+                seen.add(key)
+                for index, lat2, lon2, cos2 in cells.get(key, ()):
+                    a = sin((lat2 - lat1) / 2) ** 2 + cos1 * cos2 * sin((lon2 - lon1) / 2) ** 2
+                    if a <= limit:
+                        found.append((a, index))
+            # The report may sit on its cell's edge, so cells past ring are only ring away
+            beyond = self._beyond_km(lat, ring)
+            done = beyond >= max_km or 2 * ring + 1 >= columns
+            if done or len(found) >= count:
+                nearest = [(2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a))), index)
+                           for a, index in heapq.nsmallest(count, found)]
+                if done or nearest[-1][0] <= beyond:
+                    return nearest
+            ring += 1
+
+
+class Plan:
+    """Per-workshop queues of (report_id, distance_km or None), plus reports left over"""
+
+    def __init__(self):
+        self.queues = defaultdict(deque)
+        self.unassigned = []
+
+    @property
+    def assigned(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+
+def plan_assignments(reports, workshops, open_counts, candidates=8, max_km=300, queue_km=50):
+    """
+    Plan a batch. reports are (id, lat, lon) oldest first, workshops are
+    (id, lat, lon, capacity) and open_counts maps workshop id to its open
+    repairs. Pure computation, no database access.
+    """
+    plan = Plan()
+    capacity = [max(w[3] or 0, 0) for w in workshops]
+    queue = [open_counts.get(w[0], 0) for w in workshops]
+    free = [max(c - q, 0) for c, q in zip(capacity, queue)]
+    # Only workshops with room when the run starts are worth searching
+    grid = WorkshopGrid([(i, w[1], w[2]) for i, w in enumerate(workshops) if free[i]])
+
+    def cost(distance, index):
+        return distance + queue_km * (queue[index] + 1) / capacity[index]
+
+    def best(nearby):
+        """(cost, distance, index) of the cheapest nearby workshop with room, or None"""
+        costed = [(cost(distance, index), distance, index) for distance, index in nearby if free[index]]
+        return min(costed) if costed else None
+
+    # One heap entry per report: its cheapest candidate when pushed. Costs only
+    # rise as workshops fill, so an entry whose cost is unchanged when popped
+    # is still the cheapest assignment left; otherwise it is re-costed.
+    heap, unlocated, options = [], [], {}
+    for order, (report_id, lat, lon) in enumerate(reports):
+        if lat is None or lon is None:
+            unlocated.append(report_id)
+            continue
+        options[order] = grid.nearest(lat, lon, candidates, max_km)
+        choice = best(options[order])
+        if choice is None:
+            plan.unassigned.append(report_id)
+        else:
+            heap.append((choice[0], order, report_id))
+    heapq.heapify(heap)
+
+    while heap:
+        entry_cost, order, report_id = heapq.heappop(heap)
+        choice = best(options[order])
+        if choice is None:
+            plan.unassigned.append(report_id)
+            continue
+        if choice[0] > entry_cost:
+            heapq.heappush(heap, (choice[0], order, report_id))
+            continue
+        _, distance, index = choice
+        plan.queues[workshops[index][0]].append((report_id, distance))
+        free[index] -= 1
+        queue[index] += 1
+
+    # Least loaded first; ties go to the workshop with more free slots
+    loads = [(queue[i] / capacity[i], -free[i], i) for i in range(len(workshops)) if free[i]]
+    heapq.heapify(loads)
+    for report_id in unlocated:
+        if not loads:
+            plan.unassigned.append(report_id)
+            continue
+        _, _, index = heapq.heappop(loads)
+        plan.queues[workshops[index][0]].append((report_id, None))
+        free[index] -= 1
+        queue[index] += 1
+        if free[index]:
+            heapq.heappush(loads, (queue[index] / capacity[index], -free[index], index))
+    return plan
+
+
+def load_batch(batch_size):
+    """(reports, workshops, open_counts) for the next run, in three queries"""
+    has_repair = db.session.query(Repair.id).filter(Repair.report_id == MaintenanceReport.id).exists()
+    reports = (
+        db.session.query(MaintenanceReport.id, MaintenanceReport.latitude, MaintenanceReport.longitude)
+        .filter(MaintenanceReport.status == 'reported', ~has_repair)
+        .order_by(MaintenanceReport.reported_date, MaintenanceReport.id)
+        .limit(batch_size)
+        .all()
+    )
+    workshops = (
+        db.session.query(Workshop.id, Workshop.latitude, Workshop.longitude, Workshop.capacity)
+        .filter(Workshop.capacity > 0)
+        .all()
+    )
+    open_counts = dict(
+        db.session.query(Repair.workshop_id, func.count(Repair.id))
+        .filter(Repair.status.in_(OPEN_REPAIR_STATUSES), Repair.workshop_id.isnot(None))
+        .group_by(Repair.workshop_id)
+    )
+    return reports, workshops, open_counts
+
+
+def apply_plan(plan):
+    """Write the planned repairs in one transaction; returns the number created"""
+    now = datetime.utcnow()
+    rows = [
+        {'report_id': report_id, 'workshop_id': workshop_id, 'now': now,
+         'notes': 'Assigned by scheduler' + (f' ({distance:.1f} km away)' if distance is not None else '')}
+        for workshop_id, queue in plan.queues.items() for report_id, distance in queue
+    ]
+    if not rows:
+        return 0
+    report_ids = [row['report_id'] for row in rows]
+    db.session.execute(INSERT_REPAIR, rows)
+    created = (
+        db.session.query(Repair.id, Repair.report_id, Repair.workshop_id, MaintenanceReport.driver_id,
+                         MaintenanceReport.truck_id)
+        .join(MaintenanceReport, MaintenanceReport.id == Repair.report_id)
+        .filter(Repair.report_id.in_(report_ids), Repair.created_at == now)
+        .all()
+    )
+    # Core writes skip the session hooks that version reports for delta sync
+    MaintenanceReport.query.filter(MaintenanceReport.id.in_([r.report_id for r in created])).update(
+        {'updated_at': now}, synchronize_session=False
+    )
+    # ... and those that publish events and invalidate cached responses, which
+    # would only reach this process anyway; the web workers poll the outbox
+    outbox.add(events=[{
+        'type': 'repair.created',
+        'repair_id': r.id,
+        'report_id': r.report_id,
+        'workshop_id': r.workshop_id,
+        'driver_id': r.driver_id,
+        'truck_id': r.truck_id,
+        'status': 'pending',
+        'previous_status': None,
+        'at': now.isoformat(),
+    } for r in created], tags=[f'report:{r.report_id}' for r in created])
+    db.session.commit()
+    return len(created)
+
+
+def run_once(dry_run=False):
+    """Plan and write one batch; returns a summary dict"""
+    config = current_app.config
+    started = time.perf_counter()
+    reports, workshops, open_counts = load_batch(config['SCHEDULER_BATCH_SIZE'])
+    loaded = time.perf_counter()
+    plan = plan_assignments(
+        reports, workshops, open_counts,
+        candidates=config['SCHEDULER_CANDIDATES'],
+        max_km=config['SCHEDULER_MAX_DISTANCE_KM'],
+        queue_km=config['SCHEDULER_QUEUE_KM'],
+    )
+    planned = time.perf_counter()
+    created = 0 if dry_run else apply_plan(plan)
+    summary = {
+        'pending': len(reports),
+        'planned': plan.assigned,
+        'created': created,
+        'unassigned': len(plan.unassigned),
+        'workshops': len(plan.queues),
+        'load_ms': (loaded - started) * 1000,
+        'plan_ms': (planned - loaded) * 1000,
+        'write_ms': (time.perf_counter() - planned) * 1000,
+    }
+    logger.info(f"Scheduler run: {summary}")
+    return summary
+
+
+if __name__ == '__main__':
+    from app import app
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command not in ('once', 'loop'):
+        print("usage: python scheduler.py once [--dry-run] | loop")
+        sys.exit(2)
+    with app.app_context():
+        if command == 'once':
+            print(run_once(dry_run='--dry-run' in sys.argv))
+            sys.exit(0)
+        while True:
+            try:
+                run_once()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Scheduler run failed: {e}")
+            finally:
+                # Do not hold a session and its snapshot between runs
+                db.session.remove()
+            time.sleep(app.config['SCHEDULER_INTERVAL_SECONDS'])
@@ -0,0 +1,251 @@
+"""
+Full-text search over report issue descriptions and repair notes.
+
+Each report has one document in report_search holding its issue description
+and the notes of all its repairs. On SQLite it is an FTS5 table, on Postgres
+a weighted tsvector with a GIN index. Database triggers keep the documents
+in sync, so ORM writes, the Core inserts in bulk.py and manual SQL are all
+covered.
+
+Every search term is prefix matched ('leak' finds 'leaking', 'cool' finds
+'coolant') and all terms must match; Postgres also stems terms. Results
+are ranked with bm25 / ts_rank_cd, issue descriptions weighing more than
+repair notes.
+
+Ranking is the expensive part for common words like 'brake', which match a
+large share of the fleet's history, so an unfiltered search ranks only the
+newest SEARCH_RANK_WINDOW matching reports. Filtered searches rank every
+match, and sort=recent does not rank at all.
+
+Only the hot tables are indexed: archiving a report deletes its document
+with it, so archived reports cannot be found here. Responses say so with
+meta.includes_archived; the export and the detail endpoints still reach them.
+
+    python search.py rebuild   # rebuild every document from the source tables
+"""
+import re
+import sys
+from flask import current_app
+from sqlalchemy import text, Integer, Float
+from extensions import db
+from models import MaintenanceReport
+from pagination import REPORT_FILTERS, filter_reports, get_page_size
+
+SEARCH_SORTS = ('rank', 'recent')
+MAX_TERMS = 8
+TERM_PATTERN = re.compile(r'\w+')
+
+SQLITE_DDL = [
+    # No porter stemming: it also stems the prefix in a prefix query, so
+    # 'overheat*' would miss 'overheating' (indexed as 'overh'). The prefix
+    # indexes make short prefixes index lookups instead of term list scans
+    "CREATE VIRTUAL TABLE IF NOT EXISTS report_search USING fts5("
+    "issue_description, repair_notes, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    """
+    CREATE TRIGGER IF NOT EXISTS report_search_report_insert AFTER INSERT ON maintenance_report BEGIN
+        INSERT INTO report_search (rowid, issue_description, repair_notes)
+        VALUES (new.id, new.issue_description, '');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS report_search_report_update
+    AFTER UPDATE OF issue_description ON maintenance_report BEGIN
+        UPDATE report_search SET issue_description = new.issue_description WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS report_search_report_delete AFTER DELETE ON maintenance_report BEGIN
+        DELETE FROM report_search WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS report_search_repair_insert AFTER INSERT ON repair BEGIN
+        UPDATE report_search SET repair_notes = (
+            SELECT coalesce(group_concat(notes, ' '), '') FROM repair WHERE report_id = new.report_id
+        ) WHERE rowid = new.report_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS report_search_repair_update
+    AFTER UPDATE OF notes, report_id ON repair BEGIN
+        UPDATE report_search SET repair_notes = (
+            SELECT coalesce(group_concat(notes, ' '), '') FROM repair WHERE report_id = report_search.rowid
+        ) WHERE rowid IN (old.report_id, new.report_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS report_search_repair_delete AFTER DELETE ON repair BEGIN
+        UPDATE report_search SET repair_notes = (
+            SELECT coalesce(group_concat(notes, ' '), '') FROM repair WHERE report_id = old.report_id
+        ) WHERE rowid = old.report_id;
+    END
+    """,
+]
+
+POSTGRES_DOCUMENTS = """
+    INSERT INTO report_search (report_id, document)
+    SELECT r.id,
+           setweight(to_tsvector('english', coalesce(r.issue_description, '')), 'A') ||
+           setweight(to_tsvector('english', coalesce(string_agg(p.notes, ' '), '')), 'B')
+    FROM maintenance_report r LEFT JOIN repair p ON p.report_id = r.id
+"""
+
+POSTGRES_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS report_search (
+        report_id INTEGER PRIMARY KEY REFERENCES maintenance_report (id) ON DELETE CASCADE,
+        document TSVECTOR NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_report_search_document ON report_search USING GIN (document)",
+    f"""
+    CREATE OR REPLACE FUNCTION report_search_refresh(target INTEGER) RETURNS VOID AS $$
+        {POSTGRES_DOCUMENTS} WHERE r.id = target GROUP BY r.id
+        ON CONFLICT (report_id) DO UPDATE SET document = excluded.document
+    $$ LANGUAGE sql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION report_search_report_changed() RETURNS TRIGGER AS $$
+    BEGIN
+        PERFORM report_search_refresh(NEW.id);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION report_search_repair_changed() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM report_search_refresh(OLD.report_id);
+        END IF;
+        IF TG_OP <> 'DELETE' AND (TG_OP = 'INSERT' OR NEW.report_id IS DISTINCT FROM OLD.report_id) THEN
+            PERFORM report_search_refresh(NEW.report_id);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS report_search_report ON maintenance_report",
+    """
+    CREATE TRIGGER report_search_report AFTER INSERT OR UPDATE OF issue_description
+    ON maintenance_report FOR EACH ROW EXECUTE PROCEDURE report_search_report_changed()
+    """,
+    "DROP TRIGGER IF EXISTS report_search_repair ON repair",
+    """
+    CREATE TRIGGER report_search_repair AFTER INSERT OR UPDATE OF notes, report_id OR DELETE
+    ON repair FOR EACH ROW EXECUTE PROCEDURE report_search_repair_changed()
+    """,
+]
+
+
+class SearchError(ValueError):
+    """Raised when a search query has no usable terms or bad parameters"""
+
+
+def parse_terms(query):
+    """Split a user query into at most MAX_TERMS lowercase word terms"""
+    terms = TERM_PATTERN.findall((query or '').lower())
+    if not terms:
+        raise SearchError('q must contain at least one word')
+    return terms[:MAX_TERMS]
+
+
+def create_search_index(conn):
+    """Create the search table and its triggers, then index existing reports"""
+    statements = POSTGRES_DDL if conn.dialect.name == 'postgresql' else SQLITE_DDL
+    for statement in statements:
+        conn.execute(text(statement))
+    rebuild(conn)
+
+
+def rebuild(conn):
+    """Regenerate every search document from maintenance_report and repair"""
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("TRUNCATE report_search"))
+        conn.execute(text(f"{POSTGRES_DOCUMENTS} GROUP BY r.id"))
+        return
+    conn.execute(text("DELETE FROM report_search"))
+    conn.execute(text("""
+        INSERT INTO report_search (rowid, issue_description, repair_notes)
+        SELECT r.id, r.issue_description, coalesce(
+            (SELECT group_concat(notes, ' ') FROM repair WHERE report_id = r.id), ''
+        ) FROM maintenance_report r
+    """))
+    # Merge the index segments written above into one b-tree
+    conn.execute(text("INSERT INTO report_search (report_search) VALUES ('optimize')"))
+
+
+def _matches(dialect, terms, ranked=True, window=None):
+    """
+    Subquery of (report_id, rank) for reports matching all terms, best rank
+    lowest. With a window only the newest window matches are returned.
+    """
+    if dialect == 'postgresql':
+        rank = "-ts_rank_cd(document, query)" if ranked else "NULL"
+        sql = (f"SELECT report_id, {rank} AS rank "
+               "FROM report_search, to_tsquery('english', :match) AS query "
+               "WHERE document @@ query")
+        match = ' & '.join(f'{term}:*' for term in terms)
+        id_column = 'report_id'
+    else:
+        rank = "bm25(report_search, 2.0, 1.0)" if ranked else "NULL"
+        sql = (f"SELECT rowid AS report_id, {rank} AS rank "
+               "FROM report_search WHERE report_search MATCH :match")
+        match = ' '.join(f'"{term}"*' for term in terms)
+        id_column = 'rowid'
+    params = {'match': match}
+    if window:
+        # Matches come out of the index in id order, so the rank is only
+        # computed for the rows the limit lets through
+        sql += f" ORDER BY {id_column} DESC LIMIT :window"
+        params['window'] = window
+    stmt = text(sql).bindparams(**params)
+    return stmt.columns(report_id=Integer, rank=Float).subquery('matches')
+
+
+def search_reports(query, args, options=()):
+    """
+    Return [(report, rank)] for reports matching query, narrowed by the
+    status, truck_id and date filters in args. sort=recent orders by
+    reported date instead of relevance and leaves rank as None.
+    """
+    sort = args.get('sort', 'rank')
+    if sort not in SEARCH_SORTS:
+        raise SearchError(f'Invalid sort: {sort}')
+    window = None
+    if sort == 'rank' and not any(args.get(name) for name in REPORT_FILTERS):
+        window = current_app.config.get('SEARCH_RANK_WINDOW')
+    matches = _matches(db.engine.dialect.name, parse_terms(query), sort == 'rank', window)
+    # Pick the page from narrow (id, rank) rows and only then join in the
+    # full reports; sorting whole rows for every match is far slower
+    page = (
+        db.session.query(MaintenanceReport.id, matches.c.rank)
+        .join(matches, matches.c.report_id == MaintenanceReport.id)
+    )
+    page = filter_reports(page, args)
+    if sort == 'rank':
+        order = (matches.c.rank, MaintenanceReport.id.desc())
+    else:
+        order = (MaintenanceReport.reported_date.desc(), MaintenanceReport.id.desc())
+    page = page.order_by(*order).limit(get_page_size(args)).subquery('page')
+    results = (
+        db.session.query(MaintenanceReport, page.c.rank)
+        .options(*options)
+        .join(page, page.c.id == MaintenanceReport.id)
+    )
+    if sort == 'rank':
+        results = results.order_by(page.c.rank, MaintenanceReport.id.desc())
+    else:
+        results = results.order_by(*order)
+    return results.all()
+
+
+if __name__ == '__main__':
+    from app import app
+    if sys.argv[1:] != ['rebuild']:
+        print("usage: python search.py rebuild")
+        sys.exit(2)
+    with app.app_context():
+        with db.engine.begin() as conn:
+            rebuild(conn)
+        print("[SUCCESS] Search index rebuilt")
@@ -0,0 +1,173 @@
+"""
+Response serialization: which columns each endpoint shape renders, and the
+JSON encoder behind jsonify.
+
+A Schema lists the model columns (and computed fields) of one shape. It
+dumps objects into plain dicts with values left as they are, and gives the
+load_only() option that fetches just those columns. Datetimes are turned
+into ISO 8601 strings by JSONProvider while encoding, which uses orjson
+when it is installed and the standard library otherwise.
+"""
+import json
+import uuid
+import decimal
+import dataclasses
+from datetime import date
+from operator import attrgetter, itemgetter
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy.orm import joinedload, load_only, raiseload, selectinload
+from models import ArchivedRepair, ArchivedReport, Driver, MaintenanceReport, Repair, Workshop
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Schema:
+    """The columns of model one response shape renders, plus computed fields"""
+
+    def __init__(self, model, columns, computed=None, requires=()):
+        self.model = model
+        self.columns = tuple(columns)
+        self.computed = computed or {}
+        # Columns the computed fields read
+        self.requires = tuple(requires)
+        self._attributes = attrgetter(*self.columns)
+        self._loaded = itemgetter(*self.columns)
+
+    def load_only(self):
+        """Loader option that fetches only the columns this schema reads"""
+        names = dict.fromkeys(self.columns + self.requires)
+        return load_only(*(getattr(self.model, name) for name in names))
+
+    def dump(self, obj):
+        try:
+            # Loaded columns straight from the instance state, skipping the
+            # attribute descriptors; anything expired or deferred goes
+            # through them and loads as usual
+            values = self._loaded(obj.__dict__)
+        except KeyError:
+            values = self._attributes(obj)
+        data = dict(zip(self.columns, values if len(self.columns) > 1 else (values,)))
+        for name, compute in self.computed.items():
+            data[name] = compute(obj)
+        return data
+
+    def dump_many(self, objs):
+        return [self.dump(obj) for obj in objs]
+
+
+DRIVER = Schema(Driver, ('id', 'name', 'email', 'created_at'))
+
+WORKSHOP_SUMMARY = Schema(Workshop, ('id', 'name', 'location', 'contact', 'latitude', 'longitude'))
+
+WORKSHOP = Schema(Workshop, WORKSHOP_SUMMARY.columns + ('capacity', 'created_at'))
+
+# Expects repair.workshop to be eager loaded
+REPAIR = Schema(
+    Repair,
+    ('id', 'report_id', 'workshop_id', 'start_date', 'end_date', 'status', 'notes', 'created_at', 'updated_at'),
+    computed={
+        'workshop_name': lambda repair: repair.workshop.name if repair.workshop else None,
+        'workshop': lambda repair: WORKSHOP_SUMMARY.dump(repair.workshop) if repair.workshop else None,
+    },
+)
+
+# Column-only report fields shared by the listing endpoints
+REPORT_SUMMARY = Schema(
+    MaintenanceReport,
+    ('id', 'truck_id', 'issue_description', 'reported_date', 'status', 'driver_id', 'image_url',
+     'image_status', 'latitude', 'longitude', 'updated_at'),
+    computed={'thumbnail_url': lambda report: (report.image_renditions or {}).get('thumb')},
+    requires=('image_renditions',),
+)
+
+# Loader strategies, chosen per endpoint shape. Many-to-one links (driver,
+# workshop) are joined onto the parent row; the repairs collection is loaded
+# with one SELECT ... IN per page so it never multiplies rows. Listings only
+# render the summary columns, so they fetch nothing else and every
+# relationship raises instead of lazy loading.
+REPORT_LIST_OPTIONS = (raiseload('*'), REPORT_SUMMARY.load_only())
+
+REPORT_DETAIL_OPTIONS = (
+    joinedload(MaintenanceReport.driver),
+    selectinload(MaintenanceReport.repairs).joinedload(Repair.workshop),
+)
+
+# Archived reports have the same columns and relationships, so the report
+# schemas render them as they are
+ARCHIVED_REPORT_DETAIL_OPTIONS = (
+    joinedload(ArchivedReport.driver),
+    selectinload(ArchivedReport.repairs).joinedload(ArchivedRepair.workshop),
+)
+
+workshop_summary = WORKSHOP_SUMMARY.dump
+repair_detail = REPAIR.dump
+report_summary = REPORT_SUMMARY.dump
+
+
+def report_detail(report):
+    """Serialize a report with its driver and repairs; load with REPORT_DETAIL_OPTIONS"""
+    data = report_summary(report)
+    data['image_renditions'] = report.image_renditions
+    data['driver_name'] = report.driver.name if report.driver else 'Unknown'
+    data['repairs'] = REPAIR.dump_many(report.repairs)
+    return data
+
+
+def _default(o):
+    if isinstance(o, date):
+        return o.isoformat()
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider with datetimes as ISO 8601 instead of HTTP dates,
+    encoded by orjson when it is installed. Responses are UTF-8, not ASCII
+    escaped.
+    """
+
+    default = staticmethod(_default)
+    ensure_ascii = False
+
+    def _options(self, indent):
+        options = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def _encode(self, obj, indent=False):
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=_default, option=self._options(indent))
+            except orjson.JSONEncodeError:
+                # e.g. integers beyond 64 bits; let the standard library try
+                pass
+        separators = None if indent else (',', ':')
+        return json.dumps(obj, default=_default, ensure_ascii=self.ensure_ascii, sort_keys=self.sort_keys,
+                          indent=2 if indent else None, separators=separators).encode()
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._encode(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self._encode(obj, indent) + b'\n', mimetype=self.mimetype)
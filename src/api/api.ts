@@ -1,7 +1,7 @@
 import axios, { AxiosInstance, AxiosRequestConfig, AxiosResponse, AxiosError } from 'axios';
 import * as SecureStore from 'expo-secure-store';
 import { Platform } from 'react-native';
-import { ApiResponse, ApiError, PaginatedResponse, ReportFilterParams } from './types';
+import { ApiResponse, ApiError, PaginatedResponse, ReportFilterParams, SyncResponse } from './types';
 
 // Use environment variable for API URL with fallbacks for different environments
 const API_BASE_URL = process.env.REACT_APP_API_URL || 
@@ -116,6 +116,28 @@ const handleError = (error: AxiosError<ApiError>): never => {
   }
 };
 
+// Bodies of GETs answered with an ETag, keyed by URL and params. The next
+// request sends If-None-Match and a 304 reuses the stored body.
+const etagCache = new Map<string, { etag: string; data: any }>();
+
+const conditionalGet = async <T>(url: string, params?: object): Promise<T> => {
+  const key = `${url}?${JSON.stringify(params ?? {})}`;
+  const cached = etagCache.get(key);
+  const response = await api.get<T>(url, {
+    params,
+    headers: cached ? { 'If-None-Match': cached.etag } : undefined,
+    validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+  });
+  if (response.status === 304 && cached) {
+    return cached.data;
+  }
+  const etag = response.headers.etag;
+  if (etag) {
+    etagCache.set(key, { etag, data: response.data });
+  }
+  return response.data;
+};
+
 // Auth API
 export const authApi = {
   login: async (email: string, password: string) => {
@@ -177,8 +199,20 @@ export const authApi = {
 export const reportsApi = {
   getReports: async (params?: ReportFilterParams) => {
     try {
-      const response = await api.get<ApiResponse<PaginatedResponse<any>>>('/reports', { params });
-      return handleResponse<PaginatedResponse<any>>(response);
+      return await conditionalGet<PaginatedResponse<any>>('/reports', params);
+    } catch (error) {
+      return handleError(error as AxiosError<ApiError>);
+    }
+  },
+  
+  // Changes since a sync token; a 410 means the token expired and the
+  // list must be reloaded with getReports
+  syncReports: async (updatedSince: string, perPage = 100) => {
+    try {
+      const response = await api.get<SyncResponse<any>>('/reports', {
+        params: { updated_since: updatedSince, per_page: perPage },
+      });
+      return response.data;
     } catch (error) {
       return handleError(error as AxiosError<ApiError>);
     }
@@ -186,8 +220,7 @@ export const reportsApi = {
   
   getReport: async (id: number) => {
     try {
-      const response = await api.get<ApiResponse<any>>(`/reports/${id}`);
-      return handleResponse<any>(response);
+      return await conditionalGet<any>(`/reports/${id}`);
     } catch (error) {
       return handleError(error as AxiosError<ApiError>);
     }
@@ -236,6 +269,16 @@ export const workshopsApi = {
     }
   },
   
+  getNearestWorkshops: async (lat: number, lon: number, limit = 5, maxKm?: number) => {
+    try {
+      const params = { lat, lon, limit, ...(maxKm ? { max_km: maxKm } : {}) };
+      const response = await api.get<ApiResponse<any[]>>('/workshops/nearest', { params });
+      return handleResponse<any[]>(response);
+    } catch (error) {
+      return handleError(error as AxiosError<ApiError>);
+    }
+  },
+  
   getWorkshop: async (id: number) => {
     try {
       const response = await api.get<ApiResponse<any>>(`/workshops/${id}`);
@@ -7,6 +7,12 @@ export interface User {
 }
 
 // Report types
+export interface ImageRenditions {
+  thumb: string;
+  medium: string;
+  full: string;
+}
+
 export interface MaintenanceReport {
   id: number;
   truck_id: string;
@@ -14,6 +20,12 @@ export interface MaintenanceReport {
   reported_date: string;
   status: 'reported' | 'in_progress' | 'completed' | 'cancelled';
   image_url: string | null;
+  thumbnail_url?: string | null;
+  image_renditions?: ImageRenditions | null;
+  image_status?: 'pending' | 'ready' | 'failed' | null;
+  updated_at?: string;
+  latitude?: number | null;
+  longitude?: number | null;
   driver_id: number;
   repair?: Repair;
 }
@@ -24,6 +36,10 @@ export interface Workshop {
   name: string;
   location: string;
   contact: string;
+  latitude?: number | null;
+  longitude?: number | null;
+  capacity?: number | null;
+  distance_km?: number;
   created_at: string;
 }
 
@@ -70,6 +86,8 @@ export interface AuthResponse {
 export interface ReportFormData {
   truck_id: string;
   issue_description: string;
+  latitude?: number;
+  longitude?: number;
   image?: {
     uri: string;
     type: string;
@@ -84,16 +102,25 @@ export interface ApiError {
   errors?: Record<string, string[]>;
 }
 
-// Pagination
+// Pagination (keyset: pass meta.next_cursor back as `cursor`)
 export interface PaginatedResponse<T> {
   data: T[];
   meta: {
-    current_page: number;
-    from: number;
-    last_page: number;
     per_page: number;
-    to: number;
-    total: number;
+    has_more: boolean;
+    next_cursor: string | null;
+    // Keep the first page's token and pass it back as `updated_since`
+    sync_token?: string;
+  };
+}
+
+// Delta sync: reports changed and ids deleted since a sync token
+export interface SyncResponse<T> {
+  data: T[];
+  deleted: number[];
+  meta: {
+    has_more: boolean;
+    sync_token: string;
   };
 }
 
@@ -103,7 +130,7 @@ export interface ReportFilterParams {
   start_date?: string;
   end_date?: string;
   truck_id?: string;
-  page?: number;
+  cursor?: string;
   per_page?: number;
 }
 
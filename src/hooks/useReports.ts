@@ -1,4 +1,4 @@
-import { useState, useCallback, useEffect } from 'react';
+import { useState, useCallback, useEffect, useRef } from 'react';
 import { Alert } from 'react-native';
 import { MaintenanceReport, ReportFilterParams } from '../api/types';
 import { reportsApi } from '../api/api';
@@ -14,29 +14,85 @@ export const useReports = ({ initialFilters = {}, autoFetch = true }: UseReports
   const [refreshing, setRefreshing] = useState<boolean>(false);
   const [error, setError] = useState<string | null>(null);
   const [filters, setFilters] = useState<ReportFilterParams>({
-    page: 1,
     per_page: 20,
     ...initialFilters,
   });
   const [hasMore, setHasMore] = useState<boolean>(true);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [total, setTotal] = useState<number>(0);
+  // Set after an unfiltered first page so refreshes can fetch only changes.
+  // A ref, not state: it must not re-trigger the auto-fetch effect
+  const syncToken = useRef<string | null>(null);
+
+  // Apply the changes since the sync token to the loaded list. Returns the
+  // changed reports, or null if the token expired and a reload is needed
+  const syncChanges = useCallback(async (token: string) => {
+    let changed: MaintenanceReport[] = [];
+    let deleted: number[] = [];
+    let next = token;
+    try {
+      for (;;) {
+        const response = await reportsApi.syncReports(next);
+        changed = [...changed, ...response.data];
+        deleted = [...deleted, ...response.deleted];
+        next = response.meta.sync_token;
+        if (!response.meta.has_more) {
+          break;
+        }
+      }
+    } catch (err: any) {
+      if (err.status === 410) {
+        syncToken.current = null;
+        return null;
+      }
+      throw err;
+    }
+    
+    const byId = new Map(changed.map(report => [report.id, report]));
+    const removed = new Set(deleted);
+    setReports(prev => {
+      const loaded = new Set(prev.map(report => report.id));
+      // Changed reports replace their loaded copy; new ones go on top
+      const added = changed.filter(report => !loaded.has(report.id) && !removed.has(report.id));
+      const kept = prev
+        .filter(report => !removed.has(report.id))
+        .map(report => byId.get(report.id) ?? report);
+      return [...added.reverse(), ...kept];
+    });
+    syncToken.current = next;
+    return changed;
+  }, []);
 
   const fetchReports = useCallback(async (isRefreshing = false) => {
     try {
       if (isRefreshing) {
         setRefreshing(true);
-        setFilters(prev => ({ ...prev, page: 1 }));
+        setFilters(prev => ({ ...prev, cursor: undefined }));
       } else {
         setLoading(true);
       }
       
       setError(null);
       
-      const response = await reportsApi.getReports(filters);
+      const params = isRefreshing ? { ...filters, cursor: undefined } : filters;
+      const unfiltered = !params.status && !params.truck_id && !params.start_date && !params.end_date;
+      if (isRefreshing && unfiltered && syncToken.current) {
+        const synced = await syncChanges(syncToken.current);
+        if (synced) {
+          return synced;
+        }
+      }
       
-      setReports(prev => isRefreshing ? response.data : [...prev, ...response.data]);
-      setTotal(response.meta.total);
-      setHasMore(response.meta.current_page < response.meta.last_page);
+      const response = await reportsApi.getReports(params);
+      const isFirstPage = !params.cursor;
+      
+      setReports(prev => isFirstPage ? response.data : [...prev, ...response.data]);
+      setTotal(prev => (isFirstPage ? 0 : prev) + response.data.length);
+      setNextCursor(response.meta.next_cursor);
+      setHasMore(response.meta.has_more);
+      if (isFirstPage) {
+        syncToken.current = unfiltered ? response.meta.sync_token ?? null : null;
+      }
       
       return response.data;
     } catch (err: any) {
@@ -48,26 +104,26 @@ export const useReports = ({ initialFilters = {}, autoFetch = true }: UseReports
       setLoading(false);
       setRefreshing(false);
     }
-  }, [filters]);
+  }, [filters, syncChanges]);
 
   const refreshReports = useCallback(() => {
     return fetchReports(true);
   }, [fetchReports]);
 
   const loadMore = useCallback(() => {
-    if (!loading && !refreshing && hasMore) {
+    if (!loading && !refreshing && hasMore && nextCursor) {
       setFilters(prev => ({
         ...prev,
-        page: (prev.page || 1) + 1,
+        cursor: nextCursor,
       }));
     }
-  }, [loading, refreshing, hasMore]);
+  }, [loading, refreshing, hasMore, nextCursor]);
 
   const updateFilters = useCallback((newFilters: Partial<ReportFilterParams>) => {
     setFilters(prev => ({
       ...prev,
       ...newFilters,
-      page: 1, // Reset to first page when filters change
+      cursor: undefined, // Reset to first page when filters change
     }));
   }, []);
 
@@ -223,7 +223,7 @@ const ReportDetailScreen = () => {
             {report.image_url && (
               <View style={styles.imageContainer}>
                 <Image 
-                  source={{ uri: report.image_url }} 
+                  source={{ uri: report.image_renditions?.medium ?? report.image_url }} 
                   style={styles.issueImage} 
                   resizeMode="cover"
                 />
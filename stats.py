@@ -0,0 +1,233 @@
+"""
+Incrementally maintained fleet statistics.
+
+Every flush that inserts, updates or deletes a MaintenanceReport or Repair
+is turned into a set of deltas which are applied to the summary tables in
+models.py with upserts, inside the same transaction. Reading the stats is
+then a handful of primary-key or index-ordered lookups regardless of how
+much history the fleet has.
+
+Writes that bypass the ORM session (Core inserts in bulk.py) must build a
+StatsDelta themselves. 'python stats.py rebuild' recomputes everything
+from the source tables, archived reports and repairs included.
+"""
+import sys
+from collections import Counter, defaultdict
+from datetime import timedelta
+from sqlalchemy import event, inspect, select, func, delete
+from sqlalchemy.orm import Session
+from extensions import db
+from models import (
+    MaintenanceReport, Repair, ArchivedReport, ArchivedRepair, Workshop, ReportStatusCount,
+    TruckOpenIssues, WorkshopRepairStats, WeeklyReportCount
+)
+from pagination import REPORT_STATUSES
+
+OPEN_STATUSES = ('reported', 'pending', 'in_progress')
+REPORT_FIELDS = ('status', 'truck_id', 'reported_date')
+REPAIR_FIELDS = ('workshop_id', 'start_date', 'end_date')
+
+
+def week_start(value):
+    """Monday of the week containing value"""
+    day = value.date() if hasattr(value, 'date') else value
+    return day - timedelta(days=day.weekday())
+
+
+class StatsDelta:
+    """Pending changes to the summary tables"""
+
+    def __init__(self):
+        self.status = Counter()
+        self.truck_open = Counter()
+        self.weekly = Counter()
+        self.workshops = defaultdict(lambda: [0, 0.0])
+
+    def add_report(self, status, truck_id, reported_date, sign=1):
+        if status:
+            self.status[status] += sign
+        if status in OPEN_STATUSES and truck_id:
+            self.truck_open[truck_id] += sign
+        if reported_date:
+            self.weekly[week_start(reported_date)] += sign
+
+    def add_repair(self, workshop_id, start_date, end_date, sign=1):
+        if workshop_id is None or not start_date or not end_date or end_date < start_date:
+            return
+        totals = self.workshops[workshop_id]
+        totals[0] += sign
+        totals[1] += sign * (end_date - start_date).total_seconds()
+
+    def apply(self, conn):
+        _increment(conn, ReportStatusCount.__table__, 'status',
+                   [{'status': k, 'count': v} for k, v in self.status.items() if v])
+        _increment(conn, TruckOpenIssues.__table__, 'truck_id',
+                   [{'truck_id': k, 'open_count': v} for k, v in self.truck_open.items() if v])
+        _increment(conn, WeeklyReportCount.__table__, 'week_start',
+                   [{'week_start': k, 'count': v} for k, v in self.weekly.items() if v])
+        _increment(conn, WorkshopRepairStats.__table__, 'workshop_id',
+                   [{'workshop_id': k, 'completed_count': n, 'total_repair_seconds': s}
+                    for k, (n, s) in self.workshops.items() if n or s])
+
+
+def _increment(conn, table, key, rows):
+    """Add each row's values onto the existing row with the same key, or insert it"""
+    if not rows:
+        return
+    if conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(table)
+    columns = [name for name in rows[0] if name != key]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_={name: table.c[name] + stmt.excluded[name] for name in columns}
+    )
+    conn.execute(stmt, rows)
+
+
+def _previous(state, name):
+    """Value of an attribute as it was before this flush"""
+    history = state.attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return state.attrs[name].value
+
+
+def _changed(state, names):
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+def _after_flush(session, flush_context):
+    delta = StatsDelta()
+    for obj in session.new:
+        if isinstance(obj, MaintenanceReport):
+            delta.add_report(obj.status, obj.truck_id, obj.reported_date)
+        elif isinstance(obj, Repair):
+            delta.add_repair(obj.workshop_id, obj.start_date, obj.end_date)
+    for obj in session.dirty:
+        state = inspect(obj)
+        if isinstance(obj, MaintenanceReport) and _changed(state, REPORT_FIELDS):
+            delta.add_report(*[_previous(state, name) for name in REPORT_FIELDS], sign=-1)
+            delta.add_report(obj.status, obj.truck_id, obj.reported_date)
+        elif isinstance(obj, Repair) and _changed(state, REPAIR_FIELDS):
+            delta.add_repair(*[_previous(state, name) for name in REPAIR_FIELDS], sign=-1)
+            delta.add_repair(obj.workshop_id, obj.start_date, obj.end_date)
+    for obj in session.deleted:
+        state = inspect(obj)
+        if isinstance(obj, MaintenanceReport):
+            delta.add_report(*[_previous(state, name) for name in REPORT_FIELDS], sign=-1)
+        elif isinstance(obj, Repair):
+            delta.add_repair(*[_previous(state, name) for name in REPAIR_FIELDS], sign=-1)
+    delta.apply(session.connection())
+
+
+def _keep_previous(target, value, oldvalue, initiator):
+    return value
+
+
+def init_stats():
+    """Start maintaining the summary tables on every ORM flush"""
+    if event.contains(Session, 'after_flush', _after_flush):
+        return
+    # Attributes expired by a commit only record what they are replaced
+    # with; active history loads the old value so it can be subtracted
+    for model, names in ((MaintenanceReport, REPORT_FIELDS), (Repair, REPAIR_FIELDS)):
+        for name in names:
+            event.listen(getattr(model, name), 'set', _keep_previous, active_history=True, retval=True)
+    event.listen(Session, 'after_flush', _after_flush)
+
+
+def rebuild(conn, batch_size=5000):
+    """Recompute every summary table from the hot and archived reports and repairs"""
+    for model in (ReportStatusCount, TruckOpenIssues, WorkshopRepairStats, WeeklyReportCount):
+        conn.execute(delete(model.__table__))
+
+    reports, repairs = [MaintenanceReport], [Repair]
+    # Migrations before the archive tables rebuild too
+    if inspect(conn).has_table(ArchivedReport.__tablename__):
+        reports.append(ArchivedReport)
+        repairs.append(ArchivedRepair)
+
+    delta = StatsDelta()
+    for report in reports:
+        for status, count in conn.execute(select(report.status, func.count()).group_by(report.status)):
+            if status:
+                delta.status[status] += count
+        for truck_id, count in conn.execute(
+            select(report.truck_id, func.count())
+            .where(report.status.in_(OPEN_STATUSES))
+            .group_by(report.truck_id)
+        ):
+            delta.truck_open[truck_id] += count
+        # Week and duration arithmetic differs per database, so stream those
+        weeks = conn.execute(
+            select(report.reported_date).execution_options(stream_results=True, yield_per=batch_size)
+        )
+        for partition in weeks.partitions():
+            for (reported_date,) in partition:
+                delta.weekly[week_start(reported_date)] += 1
+    for repair in repairs:
+        rows = conn.execute(
+            select(repair.workshop_id, repair.start_date, repair.end_date)
+            .where(repair.start_date.isnot(None), repair.end_date.isnot(None))
+            .execution_options(stream_results=True, yield_per=batch_size)
+        )
+        for partition in rows.partitions():
+            for workshop_id, start_date, end_date in partition:
+                delta.add_repair(workshop_id, start_date, end_date)
+    delta.apply(conn)
+
+
+def fleet_stats(weeks=12, trucks=20):
+    """Read the fleet statistics from the summary tables"""
+    counts = {status: 0 for status in REPORT_STATUSES}
+    for row in ReportStatusCount.query.all():
+        counts[row.status] = row.count
+    counts['total'] = sum(counts.values())
+
+    open_by_truck = (
+        TruckOpenIssues.query.filter(TruckOpenIssues.open_count > 0)
+        .order_by(TruckOpenIssues.open_count.desc(), TruckOpenIssues.truck_id)
+        .limit(trucks).all()
+    )
+    workshops = (
+        db.session.query(WorkshopRepairStats, Workshop.name)
+        .outerjoin(Workshop, Workshop.id == WorkshopRepairStats.workshop_id)
+        .filter(WorkshopRepairStats.completed_count > 0)
+        .order_by(WorkshopRepairStats.workshop_id).all()
+    )
+    weekly = (
+        WeeklyReportCount.query.order_by(WeeklyReportCount.week_start.desc()).limit(weeks).all()
+    )
+    return {
+        'counts': counts,
+        'open_by_truck': [
+            {'truck_id': row.truck_id, 'open': row.open_count} for row in open_by_truck
+        ],
+        'workshops': [
+            {
+                'workshop_id': row.workshop_id,
+                'workshop_name': name,
+                'completed_repairs': row.completed_count,
+                'mean_time_to_repair_hours': round(row.total_repair_seconds / row.completed_count / 3600, 2)
+            } for row, name in workshops
+        ],
+        'weekly': [
+            {'week_start': row.week_start.isoformat(), 'reports': row.count} for row in reversed(weekly)
+        ]
+    }
+
+
+if __name__ == '__main__':
+    from app import app
+    if sys.argv[1:] != ['rebuild']:
+        print("usage: python stats.py rebuild")
+        sys.exit(2)
+    with app.app_context():
+        with db.engine.begin() as conn:
+            rebuild(conn)
+        print("[SUCCESS] Fleet statistics rebuilt")
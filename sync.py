@@ -0,0 +1,188 @@
+"""
+Conditional GET and delta sync for the report endpoints.
+
+Every report carries updated_at, bumped on each write to the report or to
+one of its repairs, and deleting a report leaves a DeletedReport tombstone.
+From those a listing gets a cheap version (row count, newest updated_at,
+newest tombstone) that is turned into a weak ETag and Last-Modified, so an
+unchanged list is answered with a bodyless 304 before the page is loaded.
+
+Delta sync hands out an opaque token, a (updated_at, id) keyset position.
+Passing it back as updated_since returns only the reports changed after it
+and the ids of reports deleted since. A caught-up token is held
+SYNC_OVERLAP_SECONDS behind the clock so rows from transactions that were
+still committing are sent again next time rather than missed; clients
+apply changes by id, so repeats are harmless.
+
+    python sync.py purge   # drop tombstones older than SYNC_TOMBSTONE_DAYS
+"""
+import sys
+import base64
+import hashlib
+from datetime import datetime, timedelta, timezone
+from flask import current_app, request
+from sqlalchemy import event, func, and_, or_
+from sqlalchemy.orm import Session
+from extensions import db
+from models import MaintenanceReport, Repair, DeletedReport
+
+# Bump when the serialized report format changes so cached copies are refetched
+ETAG_FORMAT = '1'
+
+
+class SyncError(ValueError):
+    """Raised when an updated_since token is malformed"""
+
+
+class SyncTokenExpired(SyncError):
+    """Raised when a token predates the tombstones still kept"""
+
+
+def encode_token(updated_at, report_id=0):
+    raw = f"{updated_at.isoformat()}|{report_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        updated_at, report_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(updated_at), int(report_id)
+    except (ValueError, UnicodeDecodeError):
+        raise SyncError('Invalid updated_since token')
+
+
+def current_token():
+    """Token for a client that has just loaded everything visible now"""
+    overlap = timedelta(seconds=current_app.config['SYNC_OVERLAP_SECONDS'])
+    return encode_token(datetime.utcnow() - overlap)
+
+
+def _touch_reports(session, flush_context, instances):
+    """Version reports whose repairs change and leave tombstones for deletions"""
+    now = datetime.utcnow()
+    for obj in session.deleted:
+        if isinstance(obj, MaintenanceReport):
+            session.merge(DeletedReport(report_id=obj.id, driver_id=obj.driver_id, deleted_at=now))
+    repairs = [obj for obj in session.new if isinstance(obj, Repair)]
+    repairs += [obj for obj in session.dirty if isinstance(obj, Repair) and session.is_modified(obj)]
+    repairs += [obj for obj in session.deleted if isinstance(obj, Repair)]
+    for repair in repairs:
+        report = repair.report if repair.report_id is None else session.get(MaintenanceReport, repair.report_id)
+        if report is not None and report not in session.deleted:
+            report.updated_at = now
+
+
+def init_sync():
+    """Start versioning reports and recording deletions on every flush"""
+    if not event.contains(Session, 'before_flush', _touch_reports):
+        event.listen(Session, 'before_flush', _touch_reports)
+
+
+def _make_etag(*parts):
+    digest = hashlib.sha1('|'.join(str(part) for part in (ETAG_FORMAT,) + parts).encode())
+    return digest.hexdigest()[:20]
+
+
+def _http_time(value):
+    return value.replace(microsecond=0, tzinfo=timezone.utc) if value else None
+
+
+def collection_validators(query, driver_id):
+    """
+    (etag, last_modified) for the reports matched by query, which must
+    already carry the request's filters. One aggregate query.
+    """
+    last_deleted = (
+        db.session.query(func.max(DeletedReport.deleted_at))
+        .filter(DeletedReport.driver_id == driver_id)
+        .scalar_subquery()
+    )
+    count, last_updated, last_deleted = query.with_entities(
+        func.count(MaintenanceReport.id), func.max(MaintenanceReport.updated_at), last_deleted
+    ).one()
+    # Paging and filter arguments select a different body for the same data
+    args = sorted(request.args.items(multi=True))
+    etag = _make_etag(count, last_updated, last_deleted, args)
+    last_modified = max(filter(None, (last_updated, last_deleted)), default=None)
+    return etag, _http_time(last_modified)
+
+
+def resource_validators(report):
+    return _make_etag(report.id, report.updated_at), _http_time(report.updated_at)
+
+
+def not_modified(etag, last_modified):
+    """A 304 response if the client already holds this version, else None"""
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        since = request.if_modified_since
+        fresh = bool(since and last_modified and last_modified <= since)
+    if not fresh:
+        return None
+    response = current_app.response_class(status=304)
+    return add_validators(response, etag, last_modified)
+
+
+def add_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    # Always revalidate: the data is per driver and changes at any time
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def report_changes(driver_id, token, limit, options=()):
+    """
+    Reports of driver_id changed after token, oldest change first, and ids
+    of reports deleted since. Returns (reports, deleted_ids, meta).
+    """
+    since, since_id = decode_token(token)
+    retention = timedelta(days=current_app.config['SYNC_TOMBSTONE_DAYS'])
+    if since < datetime.utcnow() - retention:
+        raise SyncTokenExpired('updated_since token has expired, reload all reports')
+
+    reports = (
+        MaintenanceReport.query.options(*options)
+        .filter(MaintenanceReport.driver_id == driver_id)
+        .filter(or_(
+            MaintenanceReport.updated_at > since,
+            and_(MaintenanceReport.updated_at == since, MaintenanceReport.id > since_id)
+        ))
+        .order_by(MaintenanceReport.updated_at, MaintenanceReport.id)
+        .limit(limit + 1)
+        .all()
+    )
+    deleted = [
+        report_id for report_id, in db.session.query(DeletedReport.report_id).filter(
+            DeletedReport.driver_id == driver_id, DeletedReport.deleted_at > since
+        ).order_by(DeletedReport.deleted_at)
+    ]
+    has_more = len(reports) > limit
+    reports = reports[:limit]
+    if has_more:
+        next_token = encode_token(reports[-1].updated_at, reports[-1].id)
+    else:
+        # Never move a token backwards
+        next_token = max(current_token(), token, key=decode_token)
+    return reports, deleted, {'has_more': has_more, 'sync_token': next_token}
+
+
+def purge_tombstones():
+    """Delete tombstones older than SYNC_TOMBSTONE_DAYS; returns the count"""
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['SYNC_TOMBSTONE_DAYS'])
+    count = DeletedReport.query.filter(DeletedReport.deleted_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+if __name__ == '__main__':
+    from app import app
+    if sys.argv[1:] != ['purge']:
+        print("usage: python sync.py purge")
+        sys.exit(2)
+    with app.app_context():
+        print(f"Removed {purge_tombstones()} tombstone(s)")
@@ -0,0 +1,97 @@
+import os
+import uuid
+import socket
+import pytest
+
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """One app for the session, on a migrated SQLite file in a scratch directory"""
+    from app import create_app
+    from config import TestingConfig
+    from migrations import upgrade
+
+    workdir = str(tmp_path_factory.mktemp('app'))
+
+    class Config(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'test.db')}"
+        IMAGE_PENDING_FOLDER = os.path.join(workdir, 'pending')
+        EVENT_SOCKET_DIR = os.path.join(workdir, 'events')
+        METRICS_DIR = os.path.join(workdir, 'metrics')
+        RESPONSE_CACHE_BACKEND = 'memory'
+
+    app = create_app(Config)
+    app.static_folder = os.path.join(workdir, 'static')
+    with app.app_context():
+        upgrade()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def logged_in(client, make_driver):
+    """A client logged in to the dashboard"""
+    driver_id, _ = make_driver()
+    with client.session_transaction() as session:
+        session['user_id'] = driver_id
+    return client
+
+
+@pytest.fixture
+def make_driver(app):
+    """Create a driver; returns (driver_id, JWT auth headers)"""
+    from flask_jwt_extended import create_access_token
+    from extensions import db
+    from identity import identity_claims, identity_record
+    from models import Driver
+
+    def make(name='Test Driver'):
+        with app.app_context():
+            driver = Driver(name=name, email=f'{uuid.uuid4().hex}@example.com', password='!')
+            db.session.add(driver)
+            db.session.commit()
+            token = create_access_token(identity=driver.id, additional_claims=identity_claims(identity_record(driver)))
+            return driver.id, {'Authorization': f'Bearer {token}'}
+    return make
+
+
+@pytest.fixture
+def make_reports(app):
+    """Create count reports for a driver, each with a repair at its own workshop; returns their ids"""
+    from extensions import db
+    from models import MaintenanceReport, Repair, Workshop
+
+    def make(driver_id, count=1, status='reported', with_repairs=True):
+        with app.app_context():
+            reports = []
+            for i in range(count):
+                report = MaintenanceReport(truck_id=f'TRK{i:03d}', issue_description=f'Brake noise {i}',
+                                           driver_id=driver_id, status=status)
+                if with_repairs:
+                    workshop = Workshop(name=f'Workshop {uuid.uuid4().hex[:8]}', capacity=5)
+                    report.repairs.append(Repair(workshop=workshop, status='pending'))
+                db.session.add(report)
+                reports.append(report)
+            db.session.commit()
+            return [report.id for report in reports]
+    return make
+
+
+@pytest.fixture
+def peer(app):
+    """A socket standing in for another worker's event socket"""
+    path = os.path.join(app.config['EVENT_SOCKET_DIR'], 'peer.sock')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    sock.settimeout(2)
+    yield sock
+    sock.close()
+    os.remove(path)
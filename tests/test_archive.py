@@ -0,0 +1,52 @@
+"""Archived reports leave delta sync but keep their ids and keys, and stay in the export"""
+import json
+from datetime import datetime, timedelta
+
+
+def archive(app, report_id):
+    from extensions import db
+    from archive import archive_batch
+    with app.app_context():
+        with db.engine.begin() as conn:
+            ids, _ = archive_batch(conn, datetime.utcnow() + timedelta(days=1), report_id - 1, 1)
+    assert ids == [report_id]
+
+
+def test_archived_report_stays_taken(app, client, make_driver):
+    _, headers = make_driver()
+    row = {'truck_id': 'TRK900', 'issue_description': 'Worn tyres', 'status': 'completed',
+           'idempotency_key': 'archived-key'}
+    report_id = client.post('/api/v1/reports/bulk', json=[row], headers=headers).get_json()['results'][0]['report_id']
+    token = client.get('/api/v1/reports', headers=headers).get_json()['meta']['sync_token']
+    archive(app, report_id)
+
+    changes = client.get('/api/v1/reports', query_string={'updated_since': token}, headers=headers).get_json()
+    assert changes['deleted'] == [report_id]
+    # Still readable by id
+    assert client.get(f'/api/v1/reports/{report_id}', headers=headers).status_code == 200
+
+    retry = client.post('/api/v1/reports/bulk', json=[row], headers=headers).get_json()['results'][0]
+    assert (retry['status'], retry['report_id']) == ('duplicate', report_id)
+
+    # It had the highest id, which SQLite would otherwise hand out again
+    rv = client.post('/api/v1/reports', json={'truck_id': 'TRK901', 'issue_description': 'Oil leak'}, headers=headers)
+    assert rv.get_json()['report_id'] > report_id
+
+
+def test_export_includes_archived_reports(app, logged_in, make_driver, make_reports):
+    driver_id, _ = make_driver()
+    report_id = make_reports(driver_id, status='completed')[0]
+    archive(app, report_id)
+
+    def exported(**args):
+        rv = logged_in.get('/api/export-reports', query_string=dict(format='ndjson', **args))
+        assert rv.status_code == 200
+        return [json.loads(line) for line in rv.data.decode().splitlines()]
+
+    rows = [row for row in exported() if row['report_id'] == report_id]
+    assert len(rows) == 1
+    assert rows[0]['repair_id'] is not None and rows[0]['workshop_name'].startswith('Workshop')
+    assert not [row for row in exported(include_archived='false') if row['report_id'] == report_id]
+    # Search states that it cannot find archived reports
+    meta = logged_in.get('/api/search-reports', query_string={'q': 'brake'}).get_json()['meta']
+    assert meta['includes_archived'] is False
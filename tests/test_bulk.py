@@ -0,0 +1,17 @@
+def test_every_result_carries_its_idempotency_key(client, make_driver):
+    _, headers = make_driver()
+    rows = [
+        {'truck_id': 'TRK001', 'issue_description': 'Brake noise', 'idempotency_key': 'bulk-key-1'},
+        {'truck_id': 'TRK001', 'issue_description': 'Brake noise', 'idempotency_key': 'bulk-key-1'},
+        {'truck_id': 'TRK002', 'issue_description': 'Oil leak'},
+        {'issue_description': 'No truck', 'idempotency_key': 'bulk-key-2'},
+    ]
+    first = client.post('/api/v1/reports/bulk', json=rows, headers=headers).get_json()['results']
+    assert [row['status'] for row in first] == ['created', 'duplicate', 'created', 'invalid']
+    assert [row['idempotency_key'] for row in first[:2]] == ['bulk-key-1', 'bulk-key-1']
+    assert first[2]['idempotency_key']
+    assert first[3]['idempotency_key'] == 'bulk-key-2'
+
+    retry = client.post('/api/v1/reports/bulk', json=rows[:1], headers=headers).get_json()['results']
+    assert retry == [{'index': 0, 'idempotency_key': 'bulk-key-1', 'status': 'duplicate',
+                      'report_id': first[0]['report_id']}]
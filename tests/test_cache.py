@@ -0,0 +1,26 @@
+"""Invalidations reach the memory caches of the other workers on the host"""
+import json
+import time
+
+
+def test_invalidations_are_sent_to_other_workers(app, peer):
+    from cache import invalidate
+    with app.app_context():
+        invalidate('report:1', 'workshop:2')
+    assert json.loads(peer.recv(65536)) == {'invalidate': ['report:1', 'workshop:2']}
+
+
+def test_invalidations_from_other_workers_drop_entries(app, peer):
+    from cache import get_cache
+    from events import get_bus
+    cache = get_cache(app)
+    entry = {'status': 200, 'headers': {}, 'body': b'{}'}
+    cache.set('remote', entry, {'report:3'}, cache.generation())
+    assert cache.get('remote') == entry
+
+    # Holding a memory cache is enough for the worker to listen
+    peer.sendto(json.dumps({'invalidate': ['report:3']}).encode(), get_bus(app).path)
+    deadline = time.monotonic() + 2
+    while cache.get('remote') is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.get('remote') is None
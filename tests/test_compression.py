@@ -0,0 +1,57 @@
+"""Responses are compressed with the encoding the client prefers, and only when worth it"""
+import gzip
+import json
+import pytest
+import compression
+
+
+@pytest.fixture
+def listing(client, make_driver, make_reports):
+    """GET the driver's report listing, well over COMPRESS_MIN_SIZE, with the given Accept-Encoding"""
+    driver_id, headers = make_driver()
+    make_reports(driver_id, 12, with_repairs=False)
+
+    def get(accept_encoding=None, **args):
+        extra = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+        return client.get('/api/v1/reports', query_string={'per_page': 12, **args}, headers={**headers, **extra})
+    return get
+
+
+def test_gzip_when_accepted(listing):
+    plain = listing()
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+    assert len(plain.get_data()) > 1024
+
+    rv = listing('gzip, deflate')
+    assert rv.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in rv.headers['Vary']
+    # Only the sync token, taken from the clock, differs
+    assert json.loads(gzip.decompress(rv.get_data()))['data'] == plain.get_json()['data']
+    # Another representation of the same version
+    assert rv.headers['ETag'].startswith('W/')
+
+
+@pytest.mark.parametrize('accept_encoding', ['gzip;q=0', 'identity', 'deflate'])
+def test_refused_or_unknown_encodings_get_the_plain_body(listing, accept_encoding):
+    assert 'Content-Encoding' not in listing(accept_encoding).headers
+
+
+def test_preference_order_picks_brotli_when_available(listing, monkeypatch):
+    class FakeBrotli:
+        @staticmethod
+        def compress(data, quality):
+            return b'br:' + data
+    monkeypatch.setattr(compression, 'brotli', FakeBrotli)
+    assert listing('gzip;q=0.5, br').headers['Content-Encoding'] == 'br'
+    assert listing('gzip, br;q=0.5').headers['Content-Encoding'] == 'gzip'
+    monkeypatch.setattr(compression, 'brotli', None)
+    assert 'Content-Encoding' not in listing('br').headers
+
+
+def test_small_responses_are_left_alone(client, make_driver):
+    _, headers = make_driver()
+    rv = client.get('/api/v1/profile', headers={**headers, 'Accept-Encoding': 'gzip'})
+    assert rv.status_code == 200
+    assert 'Content-Encoding' not in rv.headers
+
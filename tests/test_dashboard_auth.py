@@ -0,0 +1,20 @@
+"""The session-authenticated JSON endpoints turn anonymous callers away to the login page"""
+import pytest
+
+ENDPOINTS = [
+    '/api/search-reports?q=brake',
+    '/api/stats',
+    '/api/export-reports',
+]
+
+
+@pytest.mark.parametrize('url', ENDPOINTS)
+def test_anonymous_callers_are_sent_to_login(client, url):
+    rv = client.get(url)
+    assert rv.status_code == 302
+    assert '/login' in rv.headers['Location']
+
+
+@pytest.mark.parametrize('url', ENDPOINTS)
+def test_logged_in_callers_are_served(logged_in, url):
+    assert logged_in.get(url).status_code == 200
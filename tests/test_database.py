@@ -0,0 +1,21 @@
+"""Connection tuning follows the app that owns each engine"""
+
+
+def busy_timeout(app):
+    from extensions import db
+    with app.app_context():
+        db.get_engine(app).dispose()
+        with db.engine.connect() as conn:
+            return conn.exec_driver_sql("PRAGMA busy_timeout").scalar()
+
+
+def test_each_app_tunes_its_own_connections(app):
+    from app import create_app
+
+    timeout = busy_timeout(app)
+    other_config = type('OtherConfig', (), dict(app.config, SQLITE_BUSY_TIMEOUT_MS=timeout + 1234))
+    for _ in range(3):
+        other = create_app(other_config)
+    assert busy_timeout(other) == timeout + 1234
+    # Apps built later do not retune the connections of earlier ones
+    assert busy_timeout(app) == timeout
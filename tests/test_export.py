@@ -0,0 +1,51 @@
+"""The report export streams CSV or NDJSON in chunks, gzipped when the client accepts it"""
+import csv
+import io
+import gzip
+import json
+import pytest
+
+
+def test_csv_export_has_a_row_per_repair(logged_in, make_driver, make_reports):
+    driver_id, _ = make_driver()
+    report_id, = make_reports(driver_id, status='in_progress')
+    rv = logged_in.get('/api/export-reports', query_string={'format': 'csv', 'status': 'in_progress'})
+    assert rv.status_code == 200
+    assert rv.is_streamed
+    assert rv.mimetype == 'text/csv'
+    assert 'attachment; filename=reports.csv' == rv.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(rv.get_data(as_text=True))))
+    mine = [row for row in rows if row['report_id'] == str(report_id)]
+    assert len(mine) == 1 and mine[0]['repair_status'] == 'pending'
+    assert {row['status'] for row in rows} == {'in_progress'}
+
+
+def test_large_exports_arrive_in_chunks(app, logged_in, make_driver, make_reports, monkeypatch):
+    import export
+    monkeypatch.setattr(export, 'CHUNK_SIZE', 256)
+    monkeypatch.setitem(app.config, 'EXPORT_BATCH_SIZE', 2)
+    driver_id, _ = make_driver()
+    make_reports(driver_id, 6)
+    rv = logged_in.get('/api/export-reports', query_string={'format': 'ndjson'})
+    chunks = list(rv.response)
+    assert len(chunks) > 2
+    rows = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+    # In report order
+    keys = [(row['reported_date'], row['report_id']) for row in rows]
+    assert keys == sorted(keys)
+
+
+def test_gzip_is_negotiated(logged_in):
+    plain = logged_in.get('/api/export-reports', query_string={'format': 'ndjson'})
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+
+    rv = logged_in.get('/api/export-reports', query_string={'format': 'ndjson'},
+                       headers={'Accept-Encoding': 'gzip, deflate'})
+    assert rv.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(rv.get_data()) == plain.get_data()
+
+
+@pytest.mark.parametrize('args', [{'format': 'xml'}, {'status': 'lost'}, {'include_archived': 'maybe'}])
+def test_bad_export_parameters_are_rejected(logged_in, args):
+    assert logged_in.get('/api/export-reports', query_string=args).status_code == 400
@@ -0,0 +1,60 @@
+"""Nearest-workshop lookups: distance order, the max_km cut-off and the antimeridian"""
+import pytest
+from extensions import db
+from models import Workshop
+
+
+@pytest.fixture
+def place(app):
+    """Create a located workshop; returns its id"""
+    def make(name, latitude, longitude):
+        with app.app_context():
+            workshop = Workshop(name=name, latitude=latitude, longitude=longitude, capacity=2)
+            db.session.add(workshop)
+            db.session.commit()
+            return workshop.id
+    return make
+
+
+def nearest(client, headers, **args):
+    rv = client.get('/api/v1/workshops/nearest', query_string=args, headers=headers)
+    assert rv.status_code == 200, rv.get_data(as_text=True)
+    return rv.get_json()['data']
+
+
+def test_workshops_come_closest_first(client, make_driver, place):
+    _, headers = make_driver()
+    # Along the equator off Africa, ~111 km per degree
+    far, near, middle = place('Far', 0, 3.0), place('Near', 0, 0.1), place('Middle', 0, 1.0)
+    found = nearest(client, headers, lat=0, lon=0, limit=3)
+    assert [workshop['id'] for workshop in found] == [near, middle, far]
+    assert [round(workshop['distance_km']) for workshop in found] == [11, 111, 334]
+
+
+def test_max_km_leaves_out_farther_workshops(client, make_driver, place):
+    _, headers = make_driver()
+    near, _ = place('Close', 45, -30.05), place('Distant', 45, -32)
+    found = nearest(client, headers, lat=45, lon=-30, limit=5, max_km=50)
+    assert [workshop['id'] for workshop in found] == [near]
+
+
+def test_search_crosses_the_antimeridian(client, make_driver, place):
+    _, headers = make_driver()
+    west, east = place('Taveuni', -16.8, 179.95), place('Lau', -16.8, -179.9)
+    # From either side of 180°, the workshop across it is found too
+    found = nearest(client, headers, lat=-16.8, lon=179.99, limit=2, max_km=100)
+    assert [workshop['id'] for workshop in found] == [west, east]
+    found = nearest(client, headers, lat=-16.8, lon=-179.95, limit=2, max_km=100)
+    assert [workshop['id'] for workshop in found] == [east, west]
+
+
+@pytest.mark.parametrize('args', [
+    {'lat': 91, 'lon': 0},
+    {'lat': 'north', 'lon': 0},
+    {'lat': 0, 'lon': 0, 'limit': 0},
+    {'lat': 0, 'lon': 0, 'max_km': -1},
+    {'lat': 0, 'lon': 0, 'limit': 'some'},
+])
+def test_bad_positions_are_rejected(client, make_driver, args):
+    _, headers = make_driver()
+    assert client.get('/api/v1/workshops/nearest', query_string=args, headers=headers).status_code == 400
@@ -0,0 +1,69 @@
+"""The SQLite write lock of the gevent mode, exercised with plain threads"""
+import threading
+from green import WriteLock
+
+
+def acquire_elsewhere(lock, timeout=1):
+    """Whether another thread gets the lock within timeout seconds"""
+    got = threading.Event()
+
+    def run():
+        info = {}
+        lock.acquire(info)
+        got.set()
+        lock.release(info)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return got.wait(timeout)
+
+
+def test_second_connection_of_the_holder_does_not_wait():
+    lock, first, second = WriteLock(), {}, {}
+    lock.acquire(first)
+    lock.acquire(second)
+    assert not second
+    lock.release(second)
+    assert not acquire_elsewhere(lock, 0.2)
+    lock.release(first)
+    assert acquire_elsewhere(lock)
+
+
+def test_release_from_another_thread():
+    # Pool checkin may run outside the greenlet that wrote
+    lock, info = WriteLock(), {}
+    lock.acquire(info)
+    thread = threading.Thread(target=lock.release, args=(info,))
+    thread.start()
+    thread.join()
+    assert acquire_elsewhere(lock)
+
+
+def test_request_end_releases_a_forgotten_lock():
+    lock, info = WriteLock(), {}
+    lock.acquire(info)
+    assert lock.release_owned()
+    assert acquire_elsewhere(lock)
+    # The transaction's own end later finds nothing to release
+    lock.release(info)
+    assert not lock.release_owned()
+
+
+def test_request_end_rolls_back_a_leaked_transaction(tmp_path):
+    from sqlalchemy import create_engine, text
+    # No busy timeout: a write waiting on SQLite's lock fails at once
+    engine = create_engine(f"sqlite:///{tmp_path / 'leak.db'}", connect_args={'timeout': 0})
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE t (x INTEGER)"))
+
+    lock, leaked = WriteLock(), engine.connect()
+    leaked.begin()
+    leaked.execute(text("INSERT INTO t VALUES (1)"))
+    lock.acquire(leaked.info, leaked)
+    assert lock.release_owned()
+    assert acquire_elsewhere(lock)
+
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO t VALUES (2)"))
+        assert conn.execute(text("SELECT x FROM t")).scalars().all() == [2]
+    leaked.close()
@@ -0,0 +1,43 @@
+"""The profile comes from the token's claims; driver changes reach every worker's identity cache"""
+import json
+import time
+
+
+def test_tokens_without_claims_load_the_driver_once(app, client, make_driver):
+    from flask_jwt_extended import create_access_token
+    from query_counter import assert_max_queries
+    driver_id, _ = make_driver(name='Legacy Token')
+    with app.app_context():
+        headers = {'Authorization': f'Bearer {create_access_token(identity=driver_id)}'}
+        with assert_max_queries(1):
+            assert client.get('/api/v1/profile', headers=headers).get_json()['name'] == 'Legacy Token'
+        with assert_max_queries(0):
+            assert client.get('/api/v1/profile', headers=headers).status_code == 200
+
+
+def test_driver_changes_are_sent_to_other_workers(app, make_driver, peer):
+    from extensions import db
+    from models import Driver
+    driver_id, _ = make_driver()
+    with app.app_context():
+        db.session.get(Driver, driver_id).name = 'Renamed'
+        db.session.commit()
+    # The response cache sends its driver tag too
+    messages = [json.loads(peer.recv(65536)) for _ in range(2)]
+    assert {'identities': [driver_id]} in messages
+
+
+def test_invalidations_from_other_workers_drop_drivers(app, make_driver, peer):
+    from events import get_bus
+    from identity import get_cache, get_identity
+    driver_id, _ = make_driver()
+    with app.app_context():
+        get_identity(driver_id)
+    cache = get_cache(app)
+    assert driver_id in cache.entries
+
+    peer.sendto(json.dumps({'identities': [driver_id]}).encode(), get_bus(app).path)
+    deadline = time.monotonic() + 2
+    while driver_id in cache.entries and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert driver_id not in cache.entries
@@ -0,0 +1,118 @@
+import io
+import os
+import errno
+import hashlib
+import pytest
+from datetime import datetime, timedelta
+import images
+from extensions import db
+from models import ImageBlob, MaintenanceReport
+
+
+def make_blob(app, driver_id, sha256, claimed_at):
+    with app.app_context():
+        db.session.add(ImageBlob(sha256=sha256, status='pending', ref_count=1, claimed_at=claimed_at))
+        report = MaintenanceReport(truck_id='TRK1', issue_description='Cracked mirror', driver_id=driver_id,
+                                   image_hash=sha256, image_status='pending', image_url='/full.jpg')
+        db.session.add(report)
+        db.session.commit()
+        return report.id
+
+
+def statuses(app, sha256, report_id):
+    with app.app_context():
+        return (db.session.get(ImageBlob, sha256).status, db.session.get(MaintenanceReport, report_id).image_status)
+
+
+def test_a_late_result_does_not_overwrite_a_settled_blob(app, make_driver):
+    driver_id, _ = make_driver()
+    report_id = make_blob(app, driver_id, 'a' * 64, datetime.utcnow())
+    assert images._set_image_status(app, 'a' * 64, 'ready')
+    assert not images._set_image_status(app, 'a' * 64, 'failed')
+    assert statuses(app, 'a' * 64, report_id) == ('ready', 'ready')
+
+
+def test_requeue_skips_blobs_a_live_job_may_hold(app, make_driver, monkeypatch):
+    driver_id, _ = make_driver()
+    make_blob(app, driver_id, 'b' * 64, datetime.utcnow())
+    stale_report = make_blob(app, driver_id, 'c' * 64, datetime.utcnow() - timedelta(hours=1))
+    queued = []
+    monkeypatch.setattr(images, 'enqueue', lambda pending: queued.append(pending.sha256))
+    with app.app_context():
+        folder = images._pending_folder(app)
+        for sha256 in ('b' * 64, 'c' * 64):
+            open(os.path.join(folder, sha256), 'wb').close()
+        assert images.requeue_pending() == 1
+        # The claim was renewed, so an immediate second run takes nothing
+        assert images.requeue_pending() == 0
+    assert queued == ['c' * 64]
+    assert statuses(app, 'c' * 64, stale_report) == ('pending', 'pending')
+
+
+def jpeg(color):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def upload(client, headers, data):
+    form = {'truck_id': 'TRK2', 'issue_description': 'Dented door', 'image': (io.BytesIO(data), 'photo.jpg')}
+    rv = client.post('/api/v1/reports', data=form, headers=headers, content_type='multipart/form-data')
+    assert rv.status_code == 201, rv.get_data(as_text=True)
+    return rv.get_json()['report_id']
+
+
+def failing_once(monkeypatch):
+    """Make the next process_image fail like a full disk would"""
+    process = images.process_image
+
+    def fail(*args):
+        monkeypatch.setattr(images, 'process_image', process)
+        raise OSError(errno.ENOSPC, 'No space left on device')
+    monkeypatch.setattr(images, 'process_image', fail)
+
+
+def test_a_failed_blob_is_processed_again_when_uploaded_again(app, client, make_driver, monkeypatch):
+    driver_id, headers = make_driver()
+    data = jpeg('red')
+    sha256 = hashlib.sha256(data).hexdigest()
+    failing_once(monkeypatch)
+    first = upload(client, headers, data)
+    assert statuses(app, sha256, first) == ('failed', 'failed')
+
+    second = upload(client, headers, data)
+    assert statuses(app, sha256, second) == ('ready', 'ready')
+    # The report that gave up on the first attempt gets the image too
+    assert statuses(app, sha256, first) == ('ready', 'ready')
+    with app.app_context():
+        assert db.session.get(ImageBlob, sha256).ref_count == 2
+        assert db.session.get(MaintenanceReport, first).image_url.endswith(f'{sha256}.jpg')
+
+
+def test_requeue_retries_a_blob_that_failed_on_io(app, client, make_driver, monkeypatch):
+    driver_id, headers = make_driver()
+    data = jpeg('blue')
+    sha256 = hashlib.sha256(data).hexdigest()
+    failing_once(monkeypatch)
+    report_id = upload(client, headers, data)
+    with app.app_context():
+        # The raw upload was kept for this
+        assert os.path.exists(os.path.join(images._pending_folder(app), sha256))
+        assert images.requeue_pending() == 1
+    assert statuses(app, sha256, report_id) == ('ready', 'ready')
+
+
+def test_only_undecodable_uploads_lose_their_raw_file(tmp_path):
+    raw, output = tmp_path / 'raw', tmp_path / 'out' / 'full.jpg'
+    raw.write_bytes(jpeg('green'))
+    # A file where the output directory should be: an I/O error
+    (tmp_path / 'out').write_bytes(b'')
+    with pytest.raises(OSError):
+        images.process_image(str(raw), [(str(output), 32)])
+    assert raw.exists()
+
+    raw.write_bytes(b'not an image')
+    with pytest.raises(OSError):
+        images.process_image(str(raw), [(str(tmp_path / 'full.jpg'), 32)])
+    assert not raw.exists()
@@ -0,0 +1,79 @@
+"""/metrics renders every worker's histograms added up, in the Prometheus text format"""
+import os
+import json
+import pytest
+from metrics import HISTOGRAMS
+
+# Above Linux's largest pid, so never a live worker
+DEAD_PID = 4194305
+
+
+def scrape(client):
+    rv = client.get('/metrics')
+    assert rv.status_code == 200
+    assert rv.mimetype == 'text/plain'
+    samples = {}
+    for line in rv.get_data(as_text=True).splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples, rv.get_data(as_text=True)
+
+
+def snapshot(queries):
+    """A worker snapshot holding one http_request_sql_queries observation per value"""
+    buckets = HISTOGRAMS['http_request_sql_queries'][2]
+    values = [0] * (len(buckets) + 2)
+    for count in queries:
+        values[next(i for i, bound in enumerate(buckets) if count <= bound)] += 1
+        values[-2] += count
+        values[-1] += 1
+    return {'http_request_sql_queries': [[['elsewhere'], values]]}
+
+
+def write_worker(app, pid, data):
+    path = os.path.join(app.config['METRICS_DIR'], f'worker-{pid}.json')
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    return path
+
+
+def test_requests_are_recorded_per_endpoint(client, make_driver):
+    _, headers = make_driver()
+    before, _ = scrape(client)
+    for _ in range(3):
+        client.get('/api/v1/workshops', headers=headers)
+    after, text = scrape(client)
+    labels = 'endpoint="api.get_workshops",method="GET",status="200"'
+    count = f'http_request_duration_seconds_count{{{labels}}}'
+    assert after[count] - before.get(count, 0) == 3
+    assert after[f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}}'] == after[count]
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    buckets = [value for name, value in after.items()
+               if name.startswith(f'http_request_duration_seconds_bucket{{{labels},')]
+    assert buckets == sorted(buckets)
+
+
+def test_workers_are_added_up_and_exited_ones_kept(app, client):
+    sample = 'http_request_sql_queries_count{endpoint="elsewhere"}'
+    total = 'http_request_sql_queries_sum{endpoint="elsewhere"}'
+    live = write_worker(app, os.getppid(), snapshot([1, 2]))
+    dead = write_worker(app, DEAD_PID, snapshot([5]))
+    try:
+        samples, _ = scrape(client)
+        assert (samples[sample], samples[total]) == (3, 8)
+        assert samples['http_request_sql_queries_bucket{endpoint="elsewhere",le="5.0"}'] == 3
+        # The exited worker was folded into the retired totals
+        assert not os.path.exists(dead)
+        assert os.path.exists(os.path.join(app.config['METRICS_DIR'], 'retired.json'))
+    finally:
+        os.remove(live)
+    samples, _ = scrape(client)
+    assert (samples[sample], samples[total]) == (1, 5)
+
+
+@pytest.mark.parametrize('authorization, status', [(None, 401), ('Bearer wrong', 401), ('Bearer s3cret', 200)])
+def test_metrics_token(app, client, monkeypatch, authorization, status):
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 's3cret')
+    headers = {'Authorization': authorization} if authorization else {}
+    assert client.get('/metrics', headers=headers).status_code == status
@@ -0,0 +1,18 @@
+"""Each migration applies whole or not at all"""
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+
+def test_failed_migration_leaves_no_trace(tmp_path, monkeypatch):
+    import migrations
+
+    def half_done(conn):
+        conn.execute(text("CREATE TABLE half_done (id INTEGER PRIMARY KEY)"))
+        raise RuntimeError("interrupted")
+
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [(1, 'Half done', half_done)])
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrate.db'}")
+    with pytest.raises(RuntimeError):
+        migrations.upgrade(engine)
+    assert 'half_done' not in inspect(engine).get_table_names()
+    assert migrations.applied_versions(engine) == set()
@@ -0,0 +1,65 @@
+"""Keyset pages of the report listing, and the 400s for bad cursors and filters"""
+import base64
+import pytest
+
+
+def page(client, headers, **args):
+    rv = client.get('/api/v1/reports', query_string=args, headers=headers)
+    assert rv.status_code == 200, rv.get_data(as_text=True)
+    body = rv.get_json()
+    return [report['id'] for report in body['data']], body['meta']
+
+
+def forge(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def test_cursors_walk_every_report_once_newest_first(client, make_driver, make_reports):
+    driver_id, headers = make_driver()
+    ids = make_reports(driver_id, 5, with_repairs=False)
+    seen, cursor = [], None
+    while True:
+        args = {'per_page': 2, **({'cursor': cursor} if cursor else {})}
+        batch, meta = page(client, headers, **args)
+        seen += batch
+        if not meta['has_more']:
+            assert meta['next_cursor'] is None
+            break
+        cursor = meta['next_cursor']
+    # Reports created together tie on reported_date and fall back to id
+    assert seen == sorted(ids, reverse=True)
+
+
+def test_filters_narrow_the_listing(client, make_driver, make_reports):
+    driver_id, headers = make_driver()
+    make_reports(driver_id, 2, with_repairs=False)
+    completed = make_reports(driver_id, 1, status='completed', with_repairs=False)
+    assert page(client, headers, status='completed')[0] == completed
+    assert page(client, headers, truck_id='TRK001')[0] != []
+    assert page(client, headers, end_date='2000-01-01')[0] == []
+    # A well-formed cursor is only a position, whoever made it
+    assert page(client, headers, cursor=forge(b'2000-01-01T00:00:00|1'))[0] == []
+
+
+def test_page_size_is_capped(app, client, make_driver):
+    _, headers = make_driver()
+    assert page(client, headers, per_page=10_000)[1]['per_page'] == app.config['MAX_ITEMS_PER_PAGE']
+
+
+@pytest.mark.parametrize('args', [
+    {'cursor': 'not a cursor!'},
+    {'cursor': forge(b'2024-01-01T00:00:00')},       # no id
+    {'cursor': forge(b'yesterday|7')},               # no date
+    {'cursor': forge(b'2024-01-01T00:00:00|seven')},
+    {'cursor': forge(b'\xff\xfe|1')},                # not UTF-8
+    {'status': 'lost'},
+    {'start_date': 'last week'},
+    {'end_date': '2024-13-01'},
+    {'per_page': 'ten'},
+    {'per_page': 0},
+])
+def test_bad_cursors_and_filters_are_rejected(client, make_driver, args):
+    _, headers = make_driver()
+    rv = client.get('/api/v1/reports', query_string=args, headers=headers)
+    assert rv.status_code == 400
+    assert rv.get_json()['msg']
@@ -0,0 +1,82 @@
+"""Logins shed load with a 503 when password hashing is saturated, and upgrade outdated hashes"""
+import threading
+from concurrent.futures import Future
+import pytest
+from werkzeug.security import generate_password_hash
+import passwords
+from extensions import db
+from models import Driver
+
+CHEAP = 'pbkdf2:sha256:1000'
+
+
+@pytest.fixture
+def driver(app, make_driver):
+    """(email, password) of a driver whose hash predates PASSWORD_METHOD"""
+    driver_id, _ = make_driver()
+    with app.app_context():
+        user = db.session.get(Driver, driver_id)
+        user.password = generate_password_hash('hunter22', method=CHEAP)
+        db.session.commit()
+        return user.email, 'hunter22'
+
+
+def stored_hash(app, email):
+    with app.app_context():
+        return Driver.query.filter_by(email=email).one().password
+
+
+def login(client, email, password):
+    return client.post('/api/v1/auth/login', json={'email': email, 'password': password})
+
+
+def test_login_rehashes_an_outdated_hash(app, client, driver, monkeypatch):
+    monkeypatch.setitem(app.config, 'PASSWORD_METHOD', 'pbkdf2:sha256:2000')
+    email, password = driver
+    assert login(client, email, 'wrong').status_code == 401
+    assert stored_hash(app, email).startswith(CHEAP + '$')
+
+    assert login(client, email, password).status_code == 200
+    assert stored_hash(app, email).startswith('pbkdf2:sha256:2000$')
+    # And the new hash still logs in
+    assert login(client, email, password).status_code == 200
+
+
+class FakePool:
+    """A pool with max_pending slots whose hashes never finish"""
+
+    def __init__(self, max_pending):
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.executor = self
+
+    def submit(self, fn, *args):
+        future = Future()
+        # Running, so it cannot be cancelled
+        future.set_running_or_notify_cancel()
+        return future
+
+
+@pytest.fixture
+def stuck_pool(app, monkeypatch):
+    pool = FakePool(1)
+    monkeypatch.setitem(app.config, 'PASSWORD_WORKERS', 1)
+    monkeypatch.setitem(app.config, 'PASSWORD_TIMEOUT', 0.05)
+    monkeypatch.setattr(passwords, '_get_pool', lambda app: pool)
+    return pool
+
+
+def test_a_hash_that_times_out_gets_a_503(app, client, driver, stuck_pool):
+    rv = login(client, *driver)
+    assert rv.status_code == 503
+    assert rv.headers['Retry-After'] == str(app.config['PASSWORD_RETRY_AFTER'])
+
+
+def test_logins_beyond_the_pending_limit_are_shed_at_once(client, driver, stuck_pool):
+    # The timed out hash still holds the only slot
+    assert login(client, *driver).status_code == 503
+    assert not stuck_pool.slots.acquire(blocking=False)
+    assert login(client, *driver).status_code == 503
+    register = client.post('/api/v1/auth/register', json={'name': 'N', 'email': 'new@example.com', 'password': 'x'})
+    assert register.status_code == 503
+    form = client.post('/login', data={'email': driver[0], 'password': driver[1]})
+    assert form.status_code == 503 and 'Retry-After' in form.headers
@@ -0,0 +1,75 @@
+"""
+Query budgets of the report, workshop and profile endpoints. A listing
+costs the same number of statements however many rows a page has, so a
+lazy load sneaking into a serializer fails here.
+"""
+import pytest
+from query_counter import QueryCounter, assert_max_queries
+
+
+def get(app, client, url, headers, budget):
+    with app.app_context():
+        with assert_max_queries(budget) as counter:
+            rv = client.get(url, headers=headers)
+    assert rv.status_code == 200, rv.get_data(as_text=True)
+    return counter.count
+
+
+@pytest.mark.parametrize('url, budget', [
+    ('/api/v1/reports?per_page={per_page}', 2),  # validators, page with eager loads
+    ('/api/get-reports?per_page={per_page}', 1),
+])
+def test_listing_cost_does_not_grow_with_page_size(app, client, make_driver, make_reports, url, budget):
+    driver_id, headers = make_driver()
+    make_reports(driver_id, 12)
+    small = get(app, client, url.format(per_page=2), headers, budget)
+    large = get(app, client, url.format(per_page=12), headers, budget)
+    assert small == large
+
+
+def test_report_detail_budget(app, client, make_driver, make_reports):
+    driver_id, headers = make_driver()
+    report_id, = make_reports(driver_id)
+    # The report, then its repairs with their workshops
+    get(app, client, f'/api/v1/reports/{report_id}', headers, 2)
+    get(app, client, f'/api/get-report/{report_id}', {}, 2)
+
+
+def test_cached_report_detail_runs_no_queries(app, client, make_driver, make_reports):
+    driver_id, headers = make_driver()
+    report_id, = make_reports(driver_id)
+    get(app, client, f'/api/v1/reports/{report_id}', headers, 2)
+    assert get(app, client, f'/api/v1/reports/{report_id}', headers, 0) == 0
+
+
+def test_workshop_list_budget(app, client, make_driver, make_reports):
+    driver_id, headers = make_driver()
+    make_reports(driver_id, 3)
+    get(app, client, '/api/v1/workshops', headers, 1)
+
+
+def test_profile_budget(app, client, make_driver):
+    _, headers = make_driver()
+    # Answered from the token's claims
+    assert get(app, client, '/api/v1/profile', headers, 0) == 0
+
+
+def test_counter_counts_replica_reads(app, client, make_driver, make_reports, monkeypatch):
+    import database
+    from extensions import db
+
+    driver_id, headers = make_driver()
+    make_reports(driver_id, 3)
+    # The primary's own file stands in for a replica that is never behind
+    monkeypatch.setitem(app.config, 'DATABASE_REPLICA_URLS', [app.config['SQLALCHEMY_DATABASE_URI']])
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_BINDS', {})
+    monitor = database.ReplicaMonitor(app, database.replica_keys(app), start=False)
+    monitor.check()
+    monkeypatch.setattr(database, '_monitor', monitor)
+
+    with app.app_context():
+        with QueryCounter(db.engine) as primary, assert_max_queries(2) as counter:
+            rv = client.get('/api/v1/reports', headers=headers)
+    assert rv.status_code == 200
+    assert counter.count == 2
+    assert primary.count == 0
@@ -0,0 +1,39 @@
+"""Assignments the scheduler process commits reach the web workers through the outbox"""
+
+
+def test_cached_report_changes_after_apply_plan(app, client, make_driver, make_reports):
+    from extensions import db
+    from models import Workshop
+    from events import get_bus
+    from outbox import OutboxRelay
+    from scheduler import Plan, apply_plan
+
+    driver_id, headers = make_driver()
+    report_id, = make_reports(driver_id, with_repairs=False)
+    with app.app_context():
+        workshop = Workshop(name='Outbox Workshop', latitude=59.33, longitude=18.07, capacity=5)
+        db.session.add(workshop)
+        db.session.commit()
+        workshop_id = workshop.id
+
+    url = f'/api/v1/reports/{report_id}'
+    assert client.get(url, headers=headers).get_json()['repair'] is None
+    assert client.get(url, headers=headers).headers['X-Cache'] == 'HIT'
+
+    relay = OutboxRelay(app, start=False)
+    subscription = get_bus(app).subscribe(driver_id)
+    try:
+        plan = Plan()
+        plan.queues[workshop_id].append((report_id, 1.5))
+        with app.app_context():
+            assert apply_plan(plan) == 1
+        assert relay.poll() == 1
+        event = subscription.queue.get_nowait()
+    finally:
+        get_bus(app).unsubscribe(subscription)
+
+    assert (event['type'], event['report_id'], event['workshop_id']) == ('repair.created', report_id, workshop_id)
+    rv = client.get(url, headers=headers)
+    assert rv.headers['X-Cache'] == 'MISS'
+    assert rv.get_json()['repair']['workshop_id'] == workshop_id
+    assert relay.poll() == 0
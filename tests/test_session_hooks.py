@@ -0,0 +1,52 @@
+"""Changes collected on flush are acted on at the outer commit, whatever savepoints do in between"""
+import pytest
+
+
+@pytest.fixture
+def published(monkeypatch):
+    import events
+    sent = []
+    monkeypatch.setattr(events, 'publish', lambda batch: sent.extend(batch or ()))
+    return sent
+
+
+@pytest.fixture
+def invalidated(monkeypatch):
+    import cache
+    dropped = []
+    monkeypatch.setattr(cache, 'invalidate', lambda *tags: dropped.extend(tags))
+    return dropped
+
+
+@pytest.mark.parametrize('savepoint', ['rollback', 'commit'])
+def test_savepoint_keeps_outer_changes_until_commit(app, make_driver, make_reports, published, invalidated, savepoint):
+    from extensions import db
+    from models import MaintenanceReport
+
+    driver_id, _ = make_driver()
+    report_id, = make_reports(driver_id)
+    published.clear(), invalidated.clear()
+    with app.app_context():
+        db.session.get(MaintenanceReport, report_id).status = 'in_progress'
+        db.session.flush()
+        nested = db.session.begin_nested()
+        getattr(nested, savepoint)()
+        assert published == [] and invalidated == []
+        db.session.commit()
+    assert [(e['type'], e['report_id'], e['status']) for e in published] == [('report.status', report_id, 'in_progress')]
+    assert f'report:{report_id}' in invalidated
+
+
+def test_rollback_discards_changes(app, make_driver, make_reports, published, invalidated):
+    from extensions import db
+    from models import MaintenanceReport
+
+    driver_id, _ = make_driver()
+    report_id, = make_reports(driver_id)
+    published.clear(), invalidated.clear()
+    with app.app_context():
+        db.session.get(MaintenanceReport, report_id).status = 'in_progress'
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+    assert published == [] and invalidated == []
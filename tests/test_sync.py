@@ -0,0 +1,92 @@
+"""Conditional GET and delta sync of the driver's reports"""
+from datetime import datetime, timedelta
+import pytest
+from extensions import db
+from models import MaintenanceReport
+
+
+@pytest.fixture
+def no_overlap(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'SYNC_OVERLAP_SECONDS', 0)
+
+
+def change(app, report_id, status=None, delete=False):
+    with app.app_context():
+        report = db.session.get(MaintenanceReport, report_id)
+        if delete:
+            db.session.delete(report)
+        else:
+            report.status = status
+        db.session.commit()
+
+
+@pytest.mark.parametrize('url', ['/api/v1/reports', '/api/v1/reports/{id}'])
+def test_unchanged_reports_get_a_304(app, client, make_driver, make_reports, url):
+    driver_id, headers = make_driver()
+    report_id, = make_reports(driver_id)
+    url = url.format(id=report_id)
+    first = client.get(url, headers=headers)
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+
+    cached = client.get(url, headers={**headers, 'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.get_data() == b''
+
+    change(app, report_id, 'in_progress')
+    fresh = client.get(url, headers={**headers, 'If-None-Match': etag})
+    assert fresh.status_code == 200
+    assert fresh.headers['ETag'] != etag
+
+
+def test_delta_sync_returns_changes_and_deletions(app, client, make_driver, make_reports, no_overlap):
+    driver_id, headers = make_driver()
+    changed, deleted, untouched = make_reports(driver_id, 3, with_repairs=False)
+    token = client.get('/api/v1/reports', headers=headers).get_json()['meta']['sync_token']
+
+    change(app, changed, 'completed')
+    change(app, deleted, delete=True)
+    body = client.get('/api/v1/reports', query_string={'updated_since': token}, headers=headers).get_json()
+    assert [report['id'] for report in body['data']] == [changed]
+    assert body['data'][0]['status'] == 'completed'
+    assert body['deleted'] == [deleted]
+
+    # Caught up: the next token sees nothing new
+    again = client.get('/api/v1/reports', query_string={'updated_since': body['meta']['sync_token']},
+                       headers=headers).get_json()
+    assert again['data'] == [] and again['deleted'] == []
+
+
+def test_delta_sync_pages_by_token(app, client, make_driver, make_reports, no_overlap):
+    driver_id, headers = make_driver()
+    ids = make_reports(driver_id, 3)
+    token = client.get('/api/v1/reports', headers=headers).get_json()['meta']['sync_token']
+    for report_id in ids:
+        change(app, report_id, 'pending')
+    seen = []
+    while True:
+        body = client.get('/api/v1/reports', query_string={'updated_since': token, 'per_page': 2},
+                          headers=headers).get_json()
+        seen += [report['id'] for report in body['data']]
+        token = body['meta']['sync_token']
+        if not body['meta']['has_more']:
+            break
+    assert seen == ids
+
+
+def test_expired_tokens_get_a_410(app, client, make_driver):
+    from sync import encode_token
+    _, headers = make_driver()
+    days = app.config['SYNC_TOMBSTONE_DAYS'] + 1
+    token = encode_token(datetime.utcnow() - timedelta(days=days))
+    rv = client.get('/api/v1/reports', query_string={'updated_since': token}, headers=headers)
+    assert rv.status_code == 410
+
+
+@pytest.mark.parametrize('args', [
+    {'updated_since': 'garbage'},
+    {'updated_since': 'MjAyNA', 'status': 'completed'},
+])
+def test_bad_sync_requests_get_a_400(client, make_driver, args):
+    _, headers = make_driver()
+    assert client.get('/api/v1/reports', query_string=args, headers=headers).status_code == 400
@@ -0,0 +1,48 @@
+"""Multipart photo uploads, and the memory ceilings on form fields and JSON bodies"""
+import io
+import os
+import base64
+from PIL import Image
+
+
+def jpeg():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), 'orange').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def post(client, headers, image, **fields):
+    form = {'truck_id': 'TRK3', 'issue_description': 'Broken light', **fields, 'image': (io.BytesIO(image), 'a.jpg')}
+    return client.post('/api/v1/reports', data=form, headers=headers, content_type='multipart/form-data')
+
+
+def test_multipart_upload_is_stored_and_processed(app, client, make_driver):
+    _, headers = make_driver()
+    rv = post(client, headers, jpeg())
+    assert rv.status_code == 201, rv.get_data(as_text=True)
+    assert rv.get_json()['image_status'] == 'ready'
+    report = client.get(f"/api/v1/reports/{rv.get_json()['report_id']}", headers=headers).get_json()
+    assert os.path.exists(os.path.join(app.static_folder, report['image_url'][len('/static/'):]))
+
+
+def test_file_parts_are_not_held_to_the_form_memory_ceiling(app, client, make_driver):
+    _, headers = make_driver()
+    # Spooled to disk, so far larger than the ceiling is fine
+    image = jpeg() + b'\0' * (4 * app.config['MAX_FORM_MEMORY_SIZE'])
+    assert post(client, headers, image).status_code == 201
+
+
+def test_oversized_form_fields_are_rejected(app, client, make_driver):
+    _, headers = make_driver()
+    description = 'x' * (app.config['MAX_FORM_MEMORY_SIZE'] + 1)
+    assert post(client, headers, jpeg(), issue_description=description).status_code == 413
+
+
+def test_oversized_json_bodies_are_rejected(app, client, make_driver, monkeypatch):
+    _, headers = make_driver()
+    monkeypatch.setitem(app.config, 'MAX_JSON_BODY_SIZE', 1024)
+    body = {'truck_id': 'TRK3', 'issue_description': 'Broken light',
+            'image': base64.b64encode(jpeg() + b'\0' * 4096).decode()}
+    rv = client.post('/api/v1/reports', json=body, headers=headers)
+    assert rv.status_code == 413
+    assert 'multipart' in rv.get_json()['msg']